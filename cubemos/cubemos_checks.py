@@ -0,0 +1,444 @@
+#!/usr/bin/env python3
+import itertools
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+from model_registry import ModelRegistry, model_path
+from skeleton_3d import lift_skeletons_3d, sample_depth, INVALID_POINT
+from skeleton_roi import RoiEstimator
+from skeleton_streamer import SkeletonStreamer, FrameQueue, DROP_OLDEST, BLOCK
+from skeleton_tracker import SkeletonTracker, linear_sum_assignment
+from skeleton_recorder import SkeletonRecorder, SkeletonRecording
+
+# Checks of the cubemos helpers on synthetic data, no camera, SDK or license needed:
+#   python cubemos_checks.py [check ...]
+
+
+class PinholeIntrinsics:
+    # stands in for rs.intrinsics of a 640x480 depth stream without distortion
+    def __init__(self, width=640, height=480):
+        self.width = width
+        self.height = height
+        self.ppx = width / 2.0
+        self.ppy = height / 2.0
+        self.fx = self.fy = 600.0
+        self.model = 'none'
+        self.coeffs = [0.0] * 5
+
+
+def check_skeleton_3d():
+    intrinsics = PinholeIntrinsics()
+    depth_image = np.full((intrinsics.height, intrinsics.width), 2000, dtype=np.uint16)
+
+    # a frame without people
+    for n_joints in (18, 25):
+        points, valid = lift_skeletons_3d(np.zeros((0, n_joints, 2), dtype=np.float32), depth_image, intrinsics,
+                                          0.001, np.zeros((0, n_joints), dtype=np.float32))
+        assert points.shape == (0, n_joints, 3) and valid.shape == (0, n_joints), (points.shape, valid.shape)
+    assert sample_depth(depth_image, np.zeros((0, 2)), 0.001).shape == (0,)
+
+    # the median over the window: one outlier in a 3x3 window does not move the depth
+    depth_image[100:103, 200:203] = [[1000, 1010, 1020], [1030, 9000, 1040], [1050, 1060, 1070]]
+    depth = sample_depth(depth_image, [[201, 101]], 0.001, window=3)
+    assert abs(depth[0] - 1.04) < 1e-6, depth
+    depth = sample_depth(depth_image, [[201, 101]], 0.001, window=1)
+    assert abs(depth[0] - 9.0) < 1e-6, depth
+
+    # zero depth holes: the median of the valid values only, 0 where the whole window is empty
+    depth_image[300:305, 400:405] = 0
+    depth_image[300, 400] = 1500
+    depth_image[304, 404] = 1700
+    depth = sample_depth(depth_image, [[402, 302], [452, 302]], 0.001, window=5)
+    assert np.allclose(depth, [1.6, 2.0]), depth
+    depth_image[300:305, 400:405] = 0
+    assert sample_depth(depth_image, [[402, 302]], 0.001, window=5)[0] == 0
+
+    # lifting: the joint in the hole is invalid, the others lie on the 2 m plane
+    skeletons = np.array([[[320, 240], [402, 302], [201, 101]]], dtype=np.float32)
+    points, valid = lift_skeletons_3d(skeletons, depth_image, intrinsics, 0.001, window=3)
+    assert valid.tolist() == [[True, False, True]], valid
+    assert np.allclose(points[0, 0], [0, 0, 2.0]) and (points[0, 1] == INVALID_POINT).all(), points
+    assert np.allclose(points[0, 2], [(201 - 320) / 600.0 * 1.04, (101 - 240) / 600.0 * 1.04, 1.04]), points
+    print("skeleton_3d: empty frame, window median and depth holes ok")
+
+
+class MockApi:
+    # stands in for cubemos.skeleton_tracking.nativewrapper.Api, counts the models it loaded
+    created = 0
+
+    def __init__(self, license_dir):
+        MockApi.created += 1
+        self.license_dir = license_dir
+        self.loaded = []
+        self.inferences = 0
+
+    def load_model(self, compute_device, path):
+        # loading a model takes a while, long enough for concurrent requests to overlap
+        time.sleep(0.05)
+        self.loaded.append((compute_device, path))
+
+    def estimate_keypoints(self, image, network_height):
+        self.inferences += 1
+        return []
+
+
+def brute_force_assignment(cost):
+    # the cheapest matching of every row (or every column of a wide matrix) over all permutations
+    n_rows, n_cols = cost.shape
+    if n_rows <= n_cols:
+        return min(cost[range(n_rows), list(cols)].sum() for cols in itertools.permutations(range(n_cols), n_rows))
+    return brute_force_assignment(cost.T)
+
+
+def check_skeleton_tracker():
+    # the Hungarian matching against all permutations, square, tall and wide, with and without ties
+    rng = np.random.RandomState(0)
+    for shape in ((1, 1), (3, 3), (5, 5), (6, 6), (2, 5), (4, 6), (5, 2), (6, 4)):
+        for cost in (rng.rand(*shape), rng.randint(0, 3, shape).astype(np.float64)):
+            rows, cols = linear_sum_assignment(cost)
+            assert len(rows) == min(shape) and list(rows) == sorted(set(rows)) and len(set(cols)) == len(cols)
+            assert np.isclose(cost[rows, cols].sum(), brute_force_assignment(cost)), (shape, cost)
+    rows, cols = linear_sum_assignment(np.zeros((0, 3)))
+    assert len(rows) == 0 and len(cols) == 0
+
+    # normalized joints of two people, the skeletons of a frame come in any order
+    a = person(100, 100) / 640.0
+    b = person(400, 200) / 640.0
+    confident = np.ones((2, 18), dtype=np.float32)
+    tracker = SkeletonTracker(max_people=2, n_joints=18, max_missed=2)
+    ids, smoothed = tracker.update(np.stack((a, b)), confident, 0.0)
+    assert ids.tolist() == [0, 1] and np.allclose(smoothed, np.stack((a, b)))
+    for frame in range(1, 4):
+        step = 0.002 * frame
+        ids, _ = tracker.update(np.stack((b + step, a + step)), confident, frame / 30.0)
+        assert ids.tolist() == [1, 0], ids
+    # all slots in use, a third person gets no track
+    ids, _ = tracker.update(np.stack((a, b, person(300, 400) / 640.0)), np.ones((3, 18)), 4 / 30.0)
+    assert ids.tolist() == [0, 1, -1], ids
+
+    # a track survives max_missed frames without its skeleton and expires after that
+    for frame in range(5, 7):
+        ids, _ = tracker.update(a[None], confident[:1], frame / 30.0)
+        assert ids.tolist() == [0], ids
+    ids, _ = tracker.update(np.stack((a, b)), confident, 7 / 30.0)
+    assert ids.tolist() == [0, 1], ids
+    for frame in range(8, 11):
+        tracker.update(a[None], confident[:1], frame / 30.0)
+    ids, _ = tracker.update(np.stack((a, b)), confident, 11 / 30.0)
+    assert ids.tolist() == [0, 2], ids
+
+    # the One-Euro filter damps the jitter of a person standing still and follows a fast move
+    tracker = SkeletonTracker(max_people=1, n_joints=18)
+    jitter = []
+    for frame in range(60):
+        noisy = a + rng.normal(0, 0.002, a.shape).astype(np.float32)
+        _, smoothed = tracker.update(noisy[None], confident[:1], frame / 30.0)
+        jitter.append((noisy - a, smoothed[0] - a))
+    raw_jitter = np.std([noise for noise, _ in jitter[10:]])
+    smoothed_jitter = np.std([error for _, error in jitter[10:]])
+    assert smoothed_jitter < 0.7 * raw_jitter, (raw_jitter, smoothed_jitter)
+    for frame in range(60, 70):
+        _, smoothed = tracker.update((a + 0.003 * (frame - 59))[None], confident[:1], frame / 30.0)
+    assert np.abs(smoothed[0] - (a + 0.03)).max() < 0.01, np.abs(smoothed[0] - (a + 0.03)).max()
+    print("skeleton_tracker: the filter cuts the jitter of a still person from %.4f to %.4f" % (
+        raw_jitter, smoothed_jitter))
+
+
+def check_skeleton_recorder():
+    n_joints, chunk_rows = 18, 8
+    rng = np.random.RandomState(1)
+    expected = {name: [] for name in ('timestamp', 'id', 'joints', 'joints_confidence', 'joints_3d')}
+
+    def frame(recorder, timestamp, n_skeletons):
+        ids = np.arange(n_skeletons, dtype=np.int32) + int(10 * timestamp)
+        joints = rng.rand(n_skeletons, n_joints, 2).astype(np.float32)
+        confidences = rng.rand(n_skeletons, n_joints).astype(np.float32)
+        joints_3d = rng.rand(n_skeletons, n_joints, 3).astype(np.float32)
+        recorder.append(timestamp, ids, joints, confidences, joints_3d)
+        for name, value in (('timestamp', np.full(n_skeletons, timestamp)), ('id', ids), ('joints', joints),
+                            ('joints_confidence', confidences), ('joints_3d', joints_3d)):
+            expected[name].append(value)
+
+    def compare(rows, start=None, stop=None):
+        timestamps = np.concatenate(expected['timestamp'])
+        start = -np.inf if start is None else start
+        stop = np.inf if stop is None else stop
+        selected = (timestamps >= start) & (timestamps < stop)
+        for name, values in expected.items():
+            assert np.array_equal(rows[name], np.concatenate(values)[selected]), (name, start, stop)
+        return int(selected.sum())
+
+    directory = tempfile.mkdtemp(prefix='cubemos_checks_')
+    path = os.path.join(directory, 'skeletons.cmsk')
+    try:
+        recorder = SkeletonRecorder(path, n_joints, has_3d=True, chunk_rows=chunk_rows)
+        # 7 rows, then flushed within the first chunk: readable up to the last row
+        for index, n_skeletons in enumerate((2, 0, 3, 2)):
+            frame(recorder, 0.1 * index, n_skeletons)
+        recorder.flush()
+        with SkeletonRecording(path) as recording:
+            assert recording.n_chunks == 1 and len(recording) == 7, (recording.n_chunks, len(recording))
+            assert compare(recording.query()) == 7
+
+        # appending after the flush completes the same chunk, a frame of 11 skeletons spans two chunks
+        for index, n_skeletons in enumerate((3, 11, 1, 2, 4, 1, 4), start=4):
+            frame(recorder, 0.1 * index, n_skeletons)
+        recorder.close()
+        with SkeletonRecording(path) as recording:
+            assert recording.n_chunks == 5 and len(recording) == 33 == recorder.rows, (recording.n_chunks,
+                                                                                      len(recording))
+            assert recording.time_range == (0.0, 0.1 * 10)
+            assert [len(recording.chunk(index)['id']) for index in range(5)] == [8, 8, 8, 8, 1]
+            assert compare(recording.query()) == 33
+            # inside the first chunk the rows are views on the file
+            rows = recording.query(0.0, 0.25)
+            assert compare(rows, 0.0, 0.25) == 5 and not rows['joints'].flags.owndata
+            # across chunks, including the frame split over two chunks
+            assert compare(recording.query(0.25, 0.75), 0.25, 0.75) == 19
+            assert compare(recording.query(0.45, None), 0.45, None) == 23
+            # empty ranges: before, after, between two frames and start == stop
+            for start, stop in ((-1.0, 0.0), (1.05, 2.0), (0.51, 0.59), (0.3, 0.3)):
+                rows = recording.query(start, stop)
+                assert compare(rows, start, stop) == 0 and rows['joints_3d'].shape == (0, n_joints, 3), (start, stop)
+        try:
+            with SkeletonRecorder(path, n_joints) as recorder:
+                frame(recorder, 1.0, 1)
+                recorder.append(0.5, np.zeros(1), np.zeros((1, n_joints, 2)), np.zeros((1, n_joints)))
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("a timestamp going back in time was accepted")
+    finally:
+        shutil.rmtree(directory)
+
+
+def check_model_registry():
+    sdk_path = tempfile.mkdtemp(prefix='cubemos-sdk-')
+    try:
+        for precision in ('fp32', 'fp16'):
+            os.makedirs(os.path.dirname(model_path(sdk_path, precision)))
+            open(model_path(sdk_path, precision), 'wb').close()
+        initialised = []
+        MockApi.created = 0
+        registry = ModelRegistry(sdk_path, 'license', api_factory=MockApi, initialise=initialised.append,
+                                 device_map={'CPU': 'cpu', 'GPU': 'gpu', 'MYRIAD': 'myriad'})
+        assert registry.available_precisions() == ['fp32', 'fp16']
+
+        # concurrent requests for the same model and device share one instance
+        models = []
+        threads = [threading.Thread(target=lambda: models.append(registry.get('fp32', 'cpu'))) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(models) == 4 and all(model is models[0] for model in models)
+        assert MockApi.created == 1 and models[0].api.loaded == [('cpu', model_path(sdk_path, 'fp32'))]
+
+        # every other precision and device is a model of its own
+        fp16 = registry.get('fp16', 'CPU')
+        gpu = registry.get('fp32', 'GPU')
+        assert len({id(models[0]), id(fp16), id(gpu)}) == 3 and MockApi.created == 3
+        assert gpu.api.loaded == [('gpu', model_path(sdk_path, 'fp32'))]
+        assert initialised == [sdk_path], "the SDK is initialised once"
+
+        # load and warm up times of every model
+        registry.warm_up('fp32', 'CPU', 64, 48)
+        metrics = registry.metrics()
+        assert set(metrics) == {'initialise', 'fp32/CPU', 'fp16/CPU', 'fp32/GPU'}, metrics
+        assert metrics['initialise'] is not None
+        assert set(metrics['fp32/CPU']) == {'create_api', 'load_model', 'warm_up'}, metrics
+        assert metrics['fp32/CPU']['load_model'] >= 0.05 and models[0].api.inferences == 1
+        assert set(metrics['fp16/CPU']) == {'create_api', 'load_model'}, metrics
+
+        registry.clear()
+        assert registry.get('fp32', 'CPU') is not models[0] and MockApi.created == 4
+        print("model_registry: %d Apis for 3 models and a reload, load_model %.1f ms, warm_up %.2f ms" % (
+            MockApi.created, 1000 * metrics['fp32/CPU']['load_model'], 1000 * metrics['fp32/CPU']['warm_up']))
+    finally:
+        shutil.rmtree(sdk_path)
+
+
+class FakeEstimator:
+    # stands in for CubemosData, one skeleton whose joints hold the frame number
+    def __init__(self, delay):
+        self.delay = delay
+        self.frames = []
+
+    def estimate_skeleton_array(self, frame):
+        time.sleep(self.delay)
+        self.frames.append(frame)
+        return np.full((1, 25, 2), frame, dtype=np.float32), np.ones((1, 25), dtype=np.float32)
+
+
+def counting_capture(count, delay=0.0):
+    # frames are their numbers, None ends the stream after count frames
+    frames = iter(range(count))
+
+    def capture():
+        time.sleep(delay)
+        return next(frames, None)
+    return capture
+
+
+def run_streamer(capture, estimator, policy, render_delay=0.0, stop_after=None):
+    rendered = []
+
+    def render(frame, joints, confidences):
+        assert (joints == frame).all(), "the joints belong to the frame rendered"
+        time.sleep(render_delay)
+        rendered.append(frame)
+    streamer = SkeletonStreamer(capture, estimator, render, queue_size=1, policy=policy).start()
+    if stop_after is not None:
+        time.sleep(stop_after)
+        streamer.stop(timeout=1.0)
+    else:
+        assert streamer.wait(10.0), "the streamer stops at the end of the stream"
+        streamer.stop(timeout=1.0)
+    assert not any(thread.is_alive() for thread in streamer._threads), "stop() joins every stage"
+    return streamer, rendered
+
+
+def check_skeleton_streamer():
+    # a closed queue rejects puts and keeps its items for the consumer to drain
+    for policy in (DROP_OLDEST, BLOCK):
+        queue = FrameQueue(2, policy)
+        assert queue.put(1) and queue.put(2)
+        queue.close()
+        assert not queue.put(3) and queue.dropped == 0, queue.dropped
+        assert [queue.get(), queue.get(), queue.get(0.01)] == [1, 2, None]
+    queue = FrameQueue(2, DROP_OLDEST)
+    for item in range(5):
+        assert queue.put(item)
+    assert queue.dropped == 3 and [queue.get(), queue.get()] == [3, 4]
+
+    # BLOCK: the capture waits for the inference, every frame is rendered in order
+    estimator = FakeEstimator(0.002)
+    streamer, rendered = run_streamer(counting_capture(100), estimator, BLOCK)
+    stats = streamer.stats()
+    assert rendered == list(range(100)), rendered
+    assert stats['dropped'] == {'inference_queue': 0, 'render_queue': 0}, stats['dropped']
+    assert stats['inference']['count'] == 100 and stats['end_to_end']['count'] == 100, stats
+
+    # DROP_OLDEST: a capture faster than the inference loses frames, the rest keeps its order
+    estimator = FakeEstimator(0.005)
+    streamer, rendered = run_streamer(counting_capture(200, 0.0005), estimator, DROP_OLDEST)
+    dropped = streamer.stats()['dropped']
+    assert dropped['inference_queue'] > 0, dropped
+    assert rendered == sorted(set(rendered)) and rendered[-1] == 199, rendered
+    assert len(rendered) + dropped['inference_queue'] + dropped['render_queue'] == 200, (len(rendered), dropped)
+    print("skeleton_streamer: block rendered 100 of 100, drop_oldest rendered %d of 200 in order" % len(rendered))
+
+    # shutdown of an endless stream, also with producers waiting on full BLOCK queues
+    for policy in (DROP_OLDEST, BLOCK):
+        endless = iter(range(10 ** 9))
+        start = time.perf_counter()
+        streamer, rendered = run_streamer(lambda: next(endless), FakeEstimator(0.002), policy, render_delay=0.01,
+                                          stop_after=0.2)
+        elapsed = time.perf_counter() - start - 0.2
+        assert not streamer.running and rendered == sorted(set(rendered)), rendered
+        print("skeleton_streamer: %s stopped in %.1f ms after %d frames" % (policy, 1000 * elapsed, len(rendered)))
+
+
+class StubKeypointEstimator:
+    # stands in for CubemosData.estimate_raw_keypoints: the images hold the full frame x, y of every pixel,
+    # so the stub finds the people of the scene that lie completely inside a crop, in crop coordinates
+    def __init__(self):
+        self.people = {}
+        self.calls = []
+
+    def __call__(self, image):
+        height, width = image.shape[:2]
+        x0, y0 = image[0, 0]
+        self.calls.append((width, height))
+        found = [(person_id, joints - (x0, y0)) for person_id, joints in sorted(self.people.items())
+                 if (joints >= (x0, y0)).all() and (joints < (x0 + width, y0 + height)).all()]
+        joints = np.array([joints for _, joints in found], dtype=np.float32).reshape(-1, 18, 2)
+        return joints, np.ones(joints.shape[:2], dtype=np.float32), np.array([id for id, _ in found], dtype=np.int32)
+
+
+def person(x, y):
+    # 18 joints spread over a 40x120 pixel person standing at x, y
+    return np.column_stack((x + np.linspace(0, 40, 18), y + np.linspace(0, 120, 18))).astype(np.float32)
+
+
+def check_skeleton_roi():
+    width, height = 640, 480
+    image = np.stack(np.meshgrid(np.arange(width), np.arange(height)), axis=-1).astype(np.int32)
+    estimator = StubKeypointEstimator()
+    roi = RoiEstimator(estimator, width, height, refresh_interval=4, padding=0.25, min_size=64)
+    estimator.people = {1: person(50, 50), 2: person(450, 300)}
+
+    def frame():
+        del estimator.calls[:]
+        joints, confidences, ids = roi.estimate(image)
+        return sorted(ids.tolist()), list(estimator.calls), joints, ids
+
+    # the first frame is a full frame
+    ids, calls, _, _ = frame()
+    assert ids == [1, 2] and calls == [(width, height)], (ids, calls)
+
+    # crops around both people: one inference per crop, none on the full frame
+    estimator.people[1] = person(55, 52)
+    ids, calls, joints, found = frame()
+    assert ids == [1, 2] and len(calls) == 2 and (width, height) not in calls, calls
+    assert all(w * h < width * height / 10 for w, h in calls), calls
+    assert np.allclose(joints[found.tolist().index(1)], person(55, 52)), "crop joints in full frame coordinates"
+    crop_pixels = sum(w * h for w, h in calls)
+
+    # a person leaves its crop: both crops are inferred, then the full frame, three calls for one frame
+    estimator.people[1] = person(300, 50)
+    ids, calls, _, _ = frame()
+    assert ids == [1, 2] and len(calls) == 3 and calls[-1] == (width, height), calls
+    assert roi.fallback_frames == 1 and roi.full_frames == 2 and roi.cropped_frames == 1
+    fallback_calls = len(calls)
+
+    # a new person only shows up with the next refresh, every refresh_interval frames
+    estimator.people[3] = person(150, 300)
+    ids, calls, _, _ = frame()
+    ids, calls, _, _ = frame()
+    ids, calls, _, _ = frame()
+    assert ids == [1, 2] and len(calls) == 2, (ids, calls)
+    ids, calls, _, _ = frame()
+    assert ids == [1, 2, 3] and calls == [(width, height)], (ids, calls)
+    assert roi.full_frames == 3 and roi.cropped_frames == 4 and roi.fallback_frames == 1
+
+    # a refresh on every frame never crops, a refresh_interval below 1 is rejected up front
+    roi = RoiEstimator(estimator, width, height, refresh_interval=1)
+    for _ in range(3):
+        ids, calls, _, _ = frame()
+        assert ids == [1, 2, 3] and calls == [(width, height)], (ids, calls)
+    assert roi.full_frames == 3 and roi.cropped_frames == 0
+    try:
+        RoiEstimator(estimator, width, height, refresh_interval=0)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("refresh_interval=0 was accepted")
+    print("skeleton_roi: crops infer %.1f%% of the frame pixels, a fallback frame costs %d inferences" % (
+        100.0 * crop_pixels / (width * height), fallback_calls))
+
+
+CHECKS = {
+    'skeleton_3d': check_skeleton_3d,
+    'skeleton_tracker': check_skeleton_tracker,
+    'skeleton_recorder': check_skeleton_recorder,
+    'model_registry': check_model_registry,
+    'skeleton_streamer': check_skeleton_streamer,
+    'skeleton_roi': check_skeleton_roi,
+}
+
+
+def main(argv):
+    for name in argv or list(CHECKS):
+        if name not in CHECKS:
+            raise SystemExit("unknown check {}, use one of {}".format(name, ', '.join(CHECKS)))
+        CHECKS[name]()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,14 +1,67 @@
 #!/usr/bin/env python3
-import os
-import platform
-import time
-
 import cv2
 import pyrealsense2 as rs
 import numpy as np
-from cubemos.core.nativewrapper import CM_TargetComputeDevice
-from cubemos.core.nativewrapper import initialise_logging, CM_LogLevel
-from cubemos.skeleton_tracking.nativewrapper import Api
+import model_registry
+from skeleton_3d import lift_skeletons_3d
+from skeleton_roi import RoiEstimator
+
+
+# Number of joints delivered by the cubemos model (COCO-18 layout)
+RAW_JOINT_COUNT = 18
+
+# Derived joints appended after the raw joints, each built from four source joints:
+#   18: mid hip, the midpoint of right hip (8) and left hip (11)
+#   19: head centre, the mean of the eyes (14, 15) and ears (16, 17)
+# The mid hip sources are repeated so both rows average over four entries.
+DERIVED_JOINT_SOURCES = np.array([[8, 11, 8, 11],
+                                  [14, 15, 16, 17]])
+# Confidence of a derived joint is the product of its sources, index 18 is a constant 1 padding slot
+DERIVED_CONFIDENCE_SOURCES = np.array([[8, 11, 18, 18],
+                                       [14, 15, 16, 17]])
+# Index of the zero fill joint following the derived joints
+ZERO_JOINT = RAW_JOINT_COUNT + len(DERIVED_JOINT_SOURCES)
+
+# Order of the output joints as indices into the raw + derived + zero joints
+OUTPUT_JOINT_INDEX = np.array([10, 9, 8, 11, 12, 13, 18, 1, 1, 19, 4, 3, 2, 5, 6, 7, 0, 14, 16,
+                               15, 17, ZERO_JOINT, ZERO_JOINT, ZERO_JOINT, ZERO_JOINT])
+OUTPUT_JOINT_COUNT = len(OUTPUT_JOINT_INDEX)
+
+# Record layout returned by CubemosData.estimate_skeleton_array(frame, structured=True)
+SKELETON_DTYPE = np.dtype([
+    ('id', np.int32),
+    ('joints', np.float32, (OUTPUT_JOINT_COUNT, 2)),
+    ('joints_confidence', np.float32, (OUTPUT_JOINT_COUNT,)),
+])
+
+
+def remap_skeletons(raw_joints, raw_confidences, image_width, image_height):
+    """
+    Converts the raw keypoints of all skeletons in a frame to the standard joint format.
+
+    :param raw_joints: array (n_skeletons, 18, 2) of joint pixel coordinates
+    :param raw_confidences: array (n_skeletons, 18) of joint confidences
+    :param image_width: width used to normalise the x coordinates
+    :param image_height: height used to normalise the y coordinates
+    :return: (joints, confidences) with shapes (n_skeletons, 25, 2) and (n_skeletons, 25)
+    """
+    n_skeletons = len(raw_joints)
+    if n_skeletons == 0:
+        return (np.zeros((0, OUTPUT_JOINT_COUNT, 2), dtype=np.float32),
+                np.zeros((0, OUTPUT_JOINT_COUNT), dtype=np.float32))
+
+    joints = np.empty((n_skeletons, ZERO_JOINT + 1, 2), dtype=np.float32)
+    np.multiply(raw_joints, (1.0 / image_width, 1.0 / image_height), out=joints[:, :RAW_JOINT_COUNT])
+    joints[:, RAW_JOINT_COUNT:ZERO_JOINT] = joints[:, DERIVED_JOINT_SOURCES].mean(axis=2)
+    joints[:, ZERO_JOINT] = 0
+
+    confidences = np.empty((n_skeletons, ZERO_JOINT + 1), dtype=np.float32)
+    confidences[:, :RAW_JOINT_COUNT] = raw_confidences
+    confidences[:, RAW_JOINT_COUNT] = 1
+    confidences[:, RAW_JOINT_COUNT:ZERO_JOINT] = confidences[:, DERIVED_CONFIDENCE_SOURCES].prod(axis=2)
+    confidences[:, ZERO_JOINT] = 0
+
+    return joints[:, OUTPUT_JOINT_INDEX], confidences[:, OUTPUT_JOINT_INDEX]
 
 
 class CubemosData:
@@ -19,14 +72,28 @@ class CubemosData:
     ___________
     image_width: camera resolution
     image_height: camera resolution
+    roi_refresh_interval: when set, inference runs on regions around the people of the previous
+                          frame and on the full frame every roi_refresh_interval frames
+    precision: model variant in models/skeleton-tracking, "fp32" or "fp16"
+    device: compute device, "CPU", "GPU" or "MYRIAD"
+    registry: ModelRegistry the model is loaded from, defaults to the one shared by the process
     frame: pyrealense2 or opencv frame
 
     Methods
     _______
-    __init__(self, image_width=1280, image_height=720):
+    __init__(self, image_width=1280, image_height=720, roi_refresh_interval=None, precision="fp32",
+             device="CPU", registry=None):
+
+    warm_up(self):
 
     estimate_skeleton(self, frames):
 
+    estimate_skeleton_array(self, frame, structured=False):
+
+    estimate_raw_keypoints(self, color_image):
+
+    estimate_skeleton_3d(self, frame, window=5):
+
     default_log_dir(self):
 
     default_license_dir(self):
@@ -35,30 +102,37 @@ class CubemosData:
 
     render_result(self, skeletons, img, confidence_threshold):
     """
-    def __init__(self, image_width=1280, image_height=720):
-
-        self.check_license_and_variables_exist()
-
-        # Get the path of the native libraries and ressource files
-        sdk_path = os.environ["CUBEMOS_SKEL_SDK"]
-        initialise_logging(sdk_path, CM_LogLevel.CM_LL_INFO, True, self.default_log_dir())
+    def __init__(self, image_width=1280, image_height=720, roi_refresh_interval=None, precision="fp32",
+                 device="CPU", registry=None):
 
         # Configure depth and color streams of the intel realsense
         self.image_width = image_width
         self.image_height = image_height
 
-        # Initialize the cubemos api with a valid license key in default_license_dir()
-        self.api = Api(self.default_license_dir())
-        model_path = os.path.join(
-            sdk_path, "models", "skeleton-tracking", "fp32", "skeleton-tracking.cubemos"
-        )
-        self.api.load_model(CM_TargetComputeDevice.CM_CPU, model_path)
+        # The cubemos api is loaded on first use and shared by all instances with the same model
+        self.precision = precision
+        self.device = device
+        self.registry = registry if registry is not None else model_registry.get_registry()
+
+        # Crop the inference to the people found in the previous frame
+        self.roi_estimator = None
+        if roi_refresh_interval is not None:
+            self.roi_estimator = RoiEstimator(self.estimate_raw_keypoints, image_width, image_height,
+                                              refresh_interval=roi_refresh_interval)
 
-        # Get the intrinsics information for calculation of 3D point
-        # frames = pipeline.wait_for_frames()
-        # depth = frames.get_depth_frame()
-        # depth_intrin = depth.profile.as_video_stream_profile().intrinsics
-        #
+    @property
+    def model(self):
+        return self.registry.get(self.precision, self.device)
+
+    @property
+    def api(self):
+        return self.model.api
+
+    def warm_up(self):
+        """
+        Loads the model and runs a first inference, returns the loading and warm up times in seconds.
+        """
+        return self.registry.warm_up(self.precision, self.device, self.image_width, self.image_height).metrics
 
     def estimate_skeleton(self, frame):
         """
@@ -76,83 +150,95 @@ class CubemosData:
         :return: dictionary of the frame data
         """
         try:
-            if isinstance(frame, rs.pyrealsense2.composite_frame):
-                # frames = pipeline.wait_for_frames()
-                depth = frame.get_depth_frame()
-                color = frame.get_color_frame()
-
-                # # Convert images to numpy arrays
-                depth_image = np.asanyarray(depth.get_data())
-                color_image = np.asanyarray(color.get_data())
-            else:
-                color_image = frame
-
-            # perform inference
-            skeletons = self.api.estimate_keypoints(color_image, 256)
-            # print("skeletons:", skeletons)
+            joints, confidences = self.estimate_skeleton_array(frame)
 
             joint_data = {
-                'number_skeletons': len(skeletons)
+                'number_skeletons': len(joints)
             }
 
-            # sometimes len(skeletons)==0, does not throw exception when human not detected
-            for skeleton_index, skeleton in enumerate(skeletons):
-                joints = []
-                confidence = skeleton.confidences
-                joints_depth = []
-                # print(skeleton.joints)
-                for joint in skeleton.joints:
-                    # build list of normalized data
-                    try:
-                        joints.append(joint.x / self.image_width)
-                        joints.append(joint.y / self.image_height)
-                    except Exception as ex:
-                        print("Exception occured: \"{}\"".format(ex))
-
-
-                    # joints_depth.append(depth.get_distance(int(joint.x), int(joint.y)))
-
-
-                # TODO: check joint index for average
-                # append a zero at the end to use as a fill value for other joints
-                joints.append((joints[16] + joints[22]) / 2)
-                joints.append((joints[23] + joints[17]) / 2)
-                joints.append(joints[28] + joints[32] + joints[30] + joints[34] / 4)
-                joints.append(joints[29] + joints[33] + joints[31] + joints[35] / 4)
-
-                joints.append(0)
-
-                # TODO: add comments for which joints
-                confidence.append(confidence[11] * confidence[8])
-                confidence.append(confidence[14] * confidence[15] * confidence[16] * confidence[17])
-                confidence.append(0)
-                zero = len(joints) - 1
-                zero_c = len(confidence) - 1
-
-                new_confidence_index = [10, 9, 8, 11, 12, 13, 18, 1, 1, 19, 4, 3, 2, 5, 6, 7, 0, 14, 16,
-                                       15, 17, zero_c, zero_c, zero_c, zero_c]
-
-                new_joint_index = [20, 21, 18, 19, 16, 17, 22, 23, 24, 25, 26, 27, 36, 37,
-                                   2, 3, 2, 3, 38, 39, 8, 9, 6, 7, 4, 5, 10, 11, 12, 13, 14, 15,
-                                   0, 1, 28, 29, 32, 33, 30, 31, 34, 35, zero, zero, zero, zero, zero, zero, zero, zero]
-
-                new_joints = [joints[i] for i in new_joint_index]
-                new_confidence = [confidence[i] for i in new_confidence_index]
+            # flatten to the [x0, y0, x1, y1, ...] layout of the dictionary format
+            flat_joints = joints.reshape(len(joints), -1).tolist()
+            flat_confidences = confidences.tolist()
+            for skeleton_index in range(len(joints)):
                 # TODO: update confidence values
-                joint_data[str(skeleton_index)] = {'joints': new_joints,
-                                                   'joints_confidence': new_confidence,
-                                                   'human_confidence': [0] * len(new_joints)
+                joint_data[str(skeleton_index)] = {'joints': flat_joints[skeleton_index],
+                                                   'joints_confidence': flat_confidences[skeleton_index],
+                                                   'human_confidence': [0] * len(flat_joints[skeleton_index])
                                                    }
-
-                # TODO: remove print statements
-                print(confidence[20])
-                print(confidence[19])
-                print(confidence[18])
             return joint_data #, self.keypoint_ids
 
         except Exception as ex:
             print("Exception occured: \"{}\"".format(ex))
 
+    def estimate_skeleton_array(self, frame, structured=False):
+        """
+        Runs inference on a frame and returns every skeleton in the standard joint format as arrays.
+
+        :param frame: opencv or pyrealsense2 frame
+        :param structured: return a structured array of SKELETON_DTYPE instead of a tuple
+        :return: (joints, confidences) with shapes (n_skeletons, 25, 2) and (n_skeletons, 25),
+                 or a structured array with fields 'id', 'joints' and 'joints_confidence'
+        """
+        depth_image = None
+        if isinstance(frame, rs.pyrealsense2.composite_frame):
+            color = frame.get_color_frame()
+            color_image = np.asanyarray(color.get_data())
+            depth = frame.get_depth_frame()
+            if depth:
+                depth_image = np.asanyarray(depth.get_data())
+        else:
+            color_image = frame
+
+        if self.roi_estimator is not None:
+            raw_joints, raw_confidences, ids = self.roi_estimator.estimate(color_image, depth_image)
+        else:
+            raw_joints, raw_confidences, ids = self.estimate_raw_keypoints(color_image)
+        joints, confidences = remap_skeletons(raw_joints, raw_confidences, self.image_width, self.image_height)
+
+        if not structured:
+            return joints, confidences
+
+        skeleton_array = np.zeros(len(joints), dtype=SKELETON_DTYPE)
+        skeleton_array['id'] = ids
+        skeleton_array['joints'] = joints
+        skeleton_array['joints_confidence'] = confidences
+        return skeleton_array
+
+    def estimate_raw_keypoints(self, color_image):
+        """
+        Runs inference on an image and returns the keypoints as delivered by the model.
+
+        :param color_image: opencv image
+        :return: (joints, confidences, ids) with shapes (n_skeletons, 18, 2), (n_skeletons, 18)
+                 and (n_skeletons,), joints in pixels of color_image
+        """
+        # perform inference
+        # sometimes len(skeletons)==0, does not throw exception when human not detected
+        skeletons = self.model.estimate_keypoints(color_image, 256)
+
+        raw_joints = np.array([skeleton.joints for skeleton in skeletons], dtype=np.float32)
+        raw_confidences = np.array([skeleton.confidences for skeleton in skeletons], dtype=np.float32)
+        ids = np.array([skeleton.id for skeleton in skeletons], dtype=np.int32)
+        return (raw_joints.reshape(-1, RAW_JOINT_COUNT, 2), raw_confidences.reshape(-1, RAW_JOINT_COUNT), ids)
+
+    def estimate_skeleton_3d(self, frame, window=5):
+        """
+        Runs inference on a pyrealsense2 frameset and lifts every joint to 3D with its depth frame.
+
+        :param frame: pyrealsense2 composite frame with a depth and a color frame
+        :param window: odd size of the neighbourhood the depth of a joint is sampled from
+        :return: (joints, confidences, joints_3d), joints_3d is an array (n_skeletons, 25, 3) in meters
+                 with -1 for the joints that could not be lifted
+        """
+        depth = frame.get_depth_frame()
+        joints, confidences = self.estimate_skeleton_array(frame)
+
+        depth_image = np.asanyarray(depth.get_data())
+        depth_intrin = depth.profile.as_video_stream_profile().intrinsics
+        pixels = joints * (self.image_width, self.image_height)
+        joints_3d, _ = lift_skeletons_3d(pixels, depth_image, depth_intrin, depth.get_units(),
+                                         confidences, window=window)
+        return joints, confidences, joints_3d
 
     keypoint_ids = [
         (1, 2),
@@ -175,35 +261,13 @@ class CubemosData:
     ]
 
     def default_log_dir(self):
-        if platform.system() == "Windows":
-            return os.path.join(os.environ["LOCALAPPDATA"], "Cubemos", "SkeletonTracking", "logs")
-        elif platform.system() == "Linux":
-            return os.path.join(os.environ["HOME"], ".cubemos", "skeleton_tracking", "logs")
-        else:
-            raise Exception("{} is not supported".format(platform.system()))
+        return model_registry.default_log_dir()
 
     def default_license_dir(self):
-        if platform.system() == "Windows":
-            return os.path.join(os.environ["LOCALAPPDATA"], "Cubemos", "SkeletonTracking", "license")
-        elif platform.system() == "Linux":
-            return os.path.join(os.environ["HOME"], ".cubemos", "skeleton_tracking", "license")
-        else:
-            raise Exception("{} is not supported".format(platform.system()))
+        return model_registry.default_license_dir()
 
     def check_license_and_variables_exist(self):
-        license_path = os.path.join(self.default_license_dir(), "cubemos_license.json")
-        if not os.path.isfile(license_path):
-            raise Exception(
-                "The license file has not been found at location \"" +
-                self.default_license_dir() + "\". "
-                                             "Please have a look at the Getting Started Guide on how to "
-                                             "use the post-installation script to generate the license file")
-        if "CUBEMOS_SKEL_SDK" not in os.environ:
-            raise Exception(
-                "The environment Variable \"CUBEMOS_SKEL_SDK\" is not set. "
-                "Please check the troubleshooting section in the Getting "
-                "Started Guide to resolve this issue."
-            )
+        model_registry.check_license_and_variables_exist()
 
     def get_valid_limbs(self, keypoint_ids, skeleton, confidence_threshold):
         limbs = [
@@ -1,12 +1,17 @@
+import time
 
 import cv2
 import numpy as np
 import pyrealsense2 as rs
 from cubemos_data import CubemosData
+from skeleton_streamer import SkeletonStreamer, DROP_OLDEST
+from skeleton_tracker import SkeletonTracker
 
 # *************************************************************************
 # create cubemos object
 cubemos = CubemosData()
+# keeps the skeleton ids stable between frames and smooths the joints
+tracker = SkeletonTracker()
 # *************************************************************************
 
 image_width = 1280
@@ -23,31 +28,49 @@ pipeline.start()
 frames = pipeline.wait_for_frames()
 depth = frames.get_depth_frame()
 depth_intrin = depth.profile.as_video_stream_profile().intrinsics
-print('press \'q\' to quit.')
-while True:
+
+
+def capture():
     # Create a pipeline object. This object configures the streaming camera and owns it's handle
-    frames = pipeline.wait_for_frames()
-    depth = frames.get_depth_frame()
-    color = frames.get_color_frame()
-    if not depth or not color: continue
+    while True:
+        frames = pipeline.wait_for_frames()
+        color = frames.get_color_frame()
+        if not color: continue
+        # take ownership of the frame, it is handed over to the inference thread
+        color.keep()
+
+        # Convert images to numpy arrays
+        return np.asanyarray(color.get_data())
 
-    # Convert images to numpy arrays
-    depth_image = np.asanyarray(depth.get_data())
-    color_image = np.asanyarray(color.get_data())
 
+def render(color_image, joints, confidences):
     color_image = cv2.cvtColor(color_image,
                                cv2.COLOR_BGR2RGB)  # color adjustment, not sure what is going on
-    # self.render_result(skeletons, color_image, 0.5)
 
     # *************************************************************************
-    # print the frames, returned as list
-    print('press \'q\' to quit.')
-    print(cubemos.estimate_skeleton(frames))
+    # draw the tracked joints, returned as normalized arrays
+    ids, joints = tracker.update(joints, confidences, time.time())
+    pixels = (joints * (image_width, image_height)).astype(int)
+    for skeleton_id, skeleton_pixels, skeleton_confidences in zip(ids, pixels, confidences):
+        for x, y in skeleton_pixels[skeleton_confidences > 0.5]:
+            cv2.circle(color_image, (int(x), int(y)), 4, (100, 254, 213), -1)
+        x, y = skeleton_pixels[0]
+        cv2.putText(color_image, str(skeleton_id), (int(x), int(y) - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (100, 254, 213), 2)
     # *************************************************************************
 
     cv2.namedWindow('cubemos skeleton tracking', cv2.WINDOW_AUTOSIZE)
     cv2.imshow('cubemos skeleton tracking', color_image)
 
     keyPressed = cv2.waitKey(1)
-    if keyPressed == 113:
-        break
\ No newline at end of file
+    return keyPressed != 113
+
+
+print("model loaded in", cubemos.warm_up())
+print('press \'q\' to quit.')
+streamer = SkeletonStreamer(capture, cubemos, render, queue_size=1, policy=DROP_OLDEST).start()
+try:
+    streamer.wait()
+finally:
+    streamer.stop(timeout=1.0)
+    pipeline.stop()
+    print(streamer.stats())
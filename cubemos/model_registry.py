@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+import os
+import platform
+import threading
+import time
+
+import numpy as np
+
+PRECISIONS = ("fp32", "fp16")
+DEVICES = ("CPU", "GPU", "MYRIAD")
+
+
+def default_log_dir():
+    if platform.system() == "Windows":
+        return os.path.join(os.environ["LOCALAPPDATA"], "Cubemos", "SkeletonTracking", "logs")
+    elif platform.system() == "Linux":
+        return os.path.join(os.environ["HOME"], ".cubemos", "skeleton_tracking", "logs")
+    else:
+        raise Exception("{} is not supported".format(platform.system()))
+
+
+def default_license_dir():
+    if platform.system() == "Windows":
+        return os.path.join(os.environ["LOCALAPPDATA"], "Cubemos", "SkeletonTracking", "license")
+    elif platform.system() == "Linux":
+        return os.path.join(os.environ["HOME"], ".cubemos", "skeleton_tracking", "license")
+    else:
+        raise Exception("{} is not supported".format(platform.system()))
+
+
+def check_license_and_variables_exist():
+    license_path = os.path.join(default_license_dir(), "cubemos_license.json")
+    if not os.path.isfile(license_path):
+        raise Exception(
+            "The license file has not been found at location \"" +
+            default_license_dir() + "\". "
+            "Please have a look at the Getting Started Guide on how to "
+            "use the post-installation script to generate the license file")
+    if "CUBEMOS_SKEL_SDK" not in os.environ:
+        raise Exception(
+            "The environment Variable \"CUBEMOS_SKEL_SDK\" is not set. "
+            "Please check the troubleshooting section in the Getting "
+            "Started Guide to resolve this issue."
+        )
+
+
+def model_path(sdk_path, precision):
+    return os.path.join(sdk_path, "models", "skeleton-tracking", precision, "skeleton-tracking.cubemos")
+
+
+def _initialise_sdk(sdk_path):
+    # the native wrappers are only imported once a model is actually needed
+    from cubemos.core.nativewrapper import initialise_logging, CM_LogLevel
+    check_license_and_variables_exist()
+    initialise_logging(sdk_path, CM_LogLevel.CM_LL_INFO, True, default_log_dir())
+
+
+def _create_api(license_dir):
+    from cubemos.skeleton_tracking.nativewrapper import Api
+    return Api(license_dir)
+
+
+def _compute_device(name):
+    from cubemos.core.nativewrapper import CM_TargetComputeDevice
+    return getattr(CM_TargetComputeDevice, "CM_" + name)
+
+
+class LoadedModel:
+    """
+    A cubemos Api with a loaded model and the time each loading step took.
+
+    Attributes
+    ___________
+    api: the cubemos skeleton tracking Api
+    precision: model precision variant
+    device: compute device name
+    lock: serialises inference calls of the instances sharing the Api
+    metrics: seconds spent creating the Api, loading the model and warming up
+    """
+    def __init__(self, api, precision, device, metrics):
+        self.api = api
+        self.precision = precision
+        self.device = device
+        self.lock = threading.Lock()
+        self.metrics = metrics
+
+    def estimate_keypoints(self, image, network_height=256):
+        with self.lock:
+            return self.api.estimate_keypoints(image, network_height)
+
+
+class ModelRegistry:
+    """
+    Process-wide cache of loaded skeleton tracking models.
+
+    Logging is initialised and a model is loaded the first time it is requested, later requests
+    for the same precision and compute device share the loaded Api.
+
+    Attributes
+    ___________
+    sdk_path: cubemos SDK directory, defaults to the CUBEMOS_SKEL_SDK environment variable
+    license_dir: directory of the license file
+    api_factory: callable api_factory(license_dir) creating an Api, e.g. a mock in tests
+    initialise: callable initialise(sdk_path) run once before the first Api is created
+    device_map: optional dictionary from device name to the value passed to load_model
+
+    Methods
+    _______
+    get(self, precision="fp32", device="CPU"):
+
+    warm_up(self, precision="fp32", device="CPU", image_width=1280, image_height=720, network_height=256):
+
+    available_precisions(self):
+
+    metrics(self):
+
+    clear(self):
+    """
+    def __init__(self, sdk_path=None, license_dir=None, api_factory=None, initialise=None, device_map=None):
+        self._sdk_path = sdk_path
+        self._license_dir = license_dir
+        self._api_factory = api_factory or _create_api
+        self._initialise = initialise or _initialise_sdk
+        self._device_map = device_map
+        self._models = {}
+        self._initialise_seconds = None
+        self._lock = threading.Lock()
+
+    @property
+    def sdk_path(self):
+        if self._sdk_path is None:
+            if "CUBEMOS_SKEL_SDK" not in os.environ:
+                check_license_and_variables_exist()
+            self._sdk_path = os.environ["CUBEMOS_SKEL_SDK"]
+        return self._sdk_path
+
+    @property
+    def license_dir(self):
+        if self._license_dir is None:
+            self._license_dir = default_license_dir()
+        return self._license_dir
+
+    def available_precisions(self):
+        """
+        Returns the precision variants found in the models/skeleton-tracking directory of the SDK.
+        """
+        return [precision for precision in PRECISIONS if os.path.isfile(model_path(self.sdk_path, precision))]
+
+    def get(self, precision="fp32", device="CPU"):
+        """
+        Returns the LoadedModel for a precision and compute device, loading it on first use.
+        """
+        if precision not in PRECISIONS:
+            raise ValueError("unknown model precision \"{}\", use one of {}".format(precision, PRECISIONS))
+        device = device.upper()
+        if device not in DEVICES:
+            raise ValueError("unknown compute device \"{}\", use one of {}".format(device, DEVICES))
+
+        key = (precision, device)
+        with self._lock:
+            model = self._models.get(key)
+            if model is None:
+                model = self._load(precision, device)
+                self._models[key] = model
+            return model
+
+    def warm_up(self, precision="fp32", device="CPU", image_width=1280, image_height=720, network_height=256):
+        """
+        Loads the model and runs one inference on a blank image, so the first real frame is not delayed.
+        """
+        model = self.get(precision, device)
+        image = np.zeros((image_height, image_width, 3), dtype=np.uint8)
+        start = time.perf_counter()
+        model.estimate_keypoints(image, network_height)
+        model.metrics['warm_up'] = time.perf_counter() - start
+        return model
+
+    def metrics(self):
+        """
+        Returns the loading and warm up times of every loaded model in seconds.
+        """
+        with self._lock:
+            result = {'initialise': self._initialise_seconds}
+            for (precision, device), model in self._models.items():
+                result["{}/{}".format(precision, device)] = dict(model.metrics)
+            return result
+
+    def clear(self):
+        """
+        Drops every cached model, the next get() loads again.
+        """
+        with self._lock:
+            self._models.clear()
+
+    def _load(self, precision, device):
+        if self._initialise_seconds is None:
+            start = time.perf_counter()
+            self._initialise(self.sdk_path)
+            self._initialise_seconds = time.perf_counter() - start
+
+        path = model_path(self.sdk_path, precision)
+        if not os.path.isfile(path):
+            raise Exception("The {} model has not been found at location \"{}\"".format(precision, path))
+        compute_device = self._device_map[device] if self._device_map else _compute_device(device)
+
+        start = time.perf_counter()
+        api = self._api_factory(self.license_dir)
+        created = time.perf_counter()
+        api.load_model(compute_device, path)
+        loaded = time.perf_counter()
+        return LoadedModel(api, precision, device, {'create_api': created - start, 'load_model': loaded - created})
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """
+    Returns the ModelRegistry shared by the whole process.
+    """
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ModelRegistry()
+        return _registry
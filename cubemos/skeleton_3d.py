@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+import numpy as np
+
+# Joints closer to the camera than this (meters) are treated as invalid depth readings
+MIN_DISTANCE = 0.3
+# Value written to the coordinates of joints that could not be lifted
+INVALID_POINT = -1.0
+
+
+def _distortion_name(intrinsics):
+    # pyrealsense2 enums print as "distortion.inverse_brown_conrady", plain strings are accepted as well
+    model = getattr(intrinsics, 'model', None)
+    if model is None:
+        return 'none'
+    return str(model).split('.')[-1]
+
+
+def sample_depth(depth_image, pixels, depth_scale, window=5):
+    """
+    Samples the depth at many pixels as the median of the non zero values in a window around each pixel.
+
+    :param depth_image: array (height, width) of raw depth values
+    :param pixels: array (..., 2) of x, y pixel coordinates
+    :param depth_scale: meters per raw depth unit
+    :param window: odd size of the square neighbourhood
+    :return: array (...) of depths in meters, 0 where the whole window is empty
+    """
+    if window < 1 or window % 2 == 0:
+        raise ValueError("window must be a positive odd number")
+    height, width = depth_image.shape
+    pixels = np.asarray(pixels, dtype=np.float32)
+    batch_shape = pixels.shape[:-1]
+    pixels = pixels.reshape(-1, 2)
+    if len(pixels) == 0:
+        return np.zeros(batch_shape, dtype=np.float32)
+
+    # one (n_pixels, window * window) gather of the neighbourhoods, clamped at the image border
+    offsets = np.arange(window) - window // 2
+    u = np.clip(np.round(pixels[:, 0]).astype(np.intp), 0, width - 1)
+    v = np.clip(np.round(pixels[:, 1]).astype(np.intp), 0, height - 1)
+    rows = np.clip(v[:, None, None] + offsets[None, :, None], 0, height - 1)
+    cols = np.clip(u[:, None, None] + offsets[None, None, :], 0, width - 1)
+    patches = depth_image[rows, cols].reshape(len(pixels), -1).astype(np.float32)
+
+    # median over the valid values only: zeros are sorted to the end as inf
+    valid_count = np.count_nonzero(patches, axis=1)
+    patches[patches == 0] = np.inf
+    patches.sort(axis=1)
+    index = np.arange(len(patches))
+    lower = patches[index, np.maximum(valid_count - 1, 0) // 2]
+    upper = patches[index, valid_count // 2]
+    depth = np.where(valid_count > 0, 0.5 * (lower + upper), 0) * depth_scale
+    return depth.astype(np.float32).reshape(batch_shape)
+
+
+def deproject_pixels(pixels, depth, intrinsics):
+    """
+    Vectorized equivalent of rs.rs2_deproject_pixel_to_point for many pixels at once.
+
+    :param pixels: array (..., 2) of x, y pixel coordinates
+    :param depth: array (...) of depths in meters
+    :param intrinsics: rs.intrinsics or any object with ppx, ppy, fx, fy, model and coeffs
+    :return: array (..., 3) of points in meters
+    """
+    pixels = np.asarray(pixels, dtype=np.float32)
+    x = (pixels[..., 0] - intrinsics.ppx) / intrinsics.fx
+    y = (pixels[..., 1] - intrinsics.ppy) / intrinsics.fy
+
+    model = _distortion_name(intrinsics)
+    if model in ('inverse_brown_conrady', 'brown_conrady'):
+        coeffs = intrinsics.coeffs
+        if model == 'inverse_brown_conrady':
+            r2 = x * x + y * y
+            f = 1 + coeffs[0] * r2 + coeffs[1] * r2 * r2 + coeffs[4] * r2 * r2 * r2
+            x, y = (x * f + 2 * coeffs[2] * x * y + coeffs[3] * (r2 + 2 * x * x),
+                    y * f + 2 * coeffs[3] * x * y + coeffs[2] * (r2 + 2 * y * y))
+        else:
+            # iterative undistortion, as done by librealsense
+            xo, yo = x, y
+            for _ in range(10):
+                r2 = x * x + y * y
+                icdist = 1 / (1 + ((coeffs[4] * r2 + coeffs[1]) * r2 + coeffs[0]) * r2)
+                delta_x = 2 * coeffs[2] * x * y + coeffs[3] * (r2 + 2 * x * x)
+                delta_y = 2 * coeffs[3] * x * y + coeffs[2] * (r2 + 2 * y * y)
+                x = (xo - delta_x) * icdist
+                y = (yo - delta_y) * icdist
+    elif model != 'none':
+        raise ValueError("distortion model \"{}\" is not supported".format(model))
+
+    depth = np.asarray(depth, dtype=np.float32)
+    return np.stack((x * depth, y * depth, depth), axis=-1).astype(np.float32)
+
+
+def lift_skeletons_3d(skeletons, depth_image, intrinsics, depth_scale, confidences=None,
+                      confidence_threshold=0.01, window=5, min_distance=MIN_DISTANCE):
+    """
+    Lifts the joints of every skeleton in a frame to 3D points in one pass.
+
+    The depth of each joint is the median of the valid depth values in a window x window
+    neighbourhood, single pixels often read zero at the silhouette of a person.
+
+    :param skeletons: array (n_skeletons, n_joints, 2) of joint pixel coordinates
+    :param depth_image: array (height, width) of raw depth values aligned to the joint coordinates
+    :param intrinsics: intrinsics of the depth image
+    :param depth_scale: meters per raw depth unit
+    :param confidences: optional array (n_skeletons, n_joints), joints at or below confidence_threshold are not lifted
+    :param confidence_threshold: minimum confidence of a joint to be lifted
+    :param window: odd size of the depth sampling neighbourhood
+    :param min_distance: joints closer than this (meters) are not lifted
+    :return: (points, valid) with points an array (n_skeletons, n_joints, 3) in meters, invalid joints
+             set to INVALID_POINT, and valid a boolean array (n_skeletons, n_joints)
+    """
+    skeletons = np.asarray(skeletons, dtype=np.float32)
+    if len(skeletons) == 0:
+        # a frame without people
+        n_joints = skeletons.shape[1] if skeletons.ndim == 3 else 0
+        return np.zeros((0, n_joints, 3), dtype=np.float32), np.zeros((0, n_joints), dtype=bool)
+    height, width = depth_image.shape
+    # joints beyond the border of the image are moved onto the last row or column
+    pixels = np.clip(skeletons, 0, (width - 1, height - 1))
+
+    depth = sample_depth(depth_image, pixels, depth_scale, window)
+    valid = depth >= min_distance
+    if confidences is not None:
+        valid &= np.asarray(confidences) > confidence_threshold
+
+    points = deproject_pixels(pixels, depth, intrinsics)
+    points[~valid] = INVALID_POINT
+    return points, valid
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+import os
+import struct
+
+import numpy as np
+
+# File layout
+# ___________
+# file header:  magic, version, joints per skeleton, flags, rows per chunk (FILE_HEADER, padded to 64 bytes)
+# chunks:       chunk header (CHUNK_HEADER, padded to 32 bytes) followed by one contiguous block per column,
+#               every block sized for the full chunk capacity, so chunk k starts at a computable offset
+MAGIC = b'CMSK'
+VERSION = 1
+FILE_HEADER = struct.Struct('<4sHHII')
+FILE_HEADER_SIZE = 64
+CHUNK_HEADER = struct.Struct('<IIdd')
+CHUNK_HEADER_SIZE = 32
+FLAG_JOINTS_3D = 1
+
+
+def _columns(n_joints, has_3d):
+    columns = [
+        ('timestamp', np.dtype('<f8'), ()),
+        ('id', np.dtype('<i4'), ()),
+        ('joints', np.dtype('<f4'), (n_joints, 2)),
+        ('joints_confidence', np.dtype('<f4'), (n_joints,)),
+    ]
+    if has_3d:
+        columns.append(('joints_3d', np.dtype('<f4'), (n_joints, 3)))
+    return columns
+
+
+def _chunk_size(columns, capacity):
+    return CHUNK_HEADER_SIZE + sum(dtype.itemsize * int(np.prod(shape)) * capacity for _, dtype, shape in columns)
+
+
+class SkeletonRecorder:
+    """
+    Appends skeleton rows to a chunked, columnar binary file.
+
+    Every row holds the timestamp, skeleton id, joints, joint confidences and optionally the 3D joints
+    of one skeleton. Rows are collected in a preallocated chunk and written when the chunk is full,
+    on flush() and on close(). Timestamps have to be appended in non-decreasing order.
+
+    Attributes
+    ___________
+    path: file to write, an existing file is overwritten
+    n_joints: joints per skeleton
+    has_3d: store the 3D joints as well
+    chunk_rows: rows per chunk
+
+    Methods
+    _______
+    append(self, timestamp, ids, joints, confidences, joints_3d=None):
+
+    append_skeletons(self, timestamp, skeletons, joints_3d=None):
+
+    flush(self):
+
+    close(self):
+    """
+    def __init__(self, path, n_joints=25, has_3d=False, chunk_rows=4096):
+        self.path = path
+        self.n_joints = n_joints
+        self.has_3d = has_3d
+        self.chunk_rows = chunk_rows
+        self.rows = 0
+
+        self._columns = _columns(n_joints, has_3d)
+        self._chunk = {name: np.zeros((chunk_rows,) + shape, dtype=dtype) for name, dtype, shape in self._columns}
+        self._chunk_fill = 0
+        self._chunk_index = 0
+        self._chunk_size = _chunk_size(self._columns, chunk_rows)
+        self._last_timestamp = -np.inf
+
+        self._file = open(path, 'wb')
+        header = FILE_HEADER.pack(MAGIC, VERSION, n_joints, FLAG_JOINTS_3D if has_3d else 0, chunk_rows)
+        self._file.write(header.ljust(FILE_HEADER_SIZE, b'\0'))
+
+    def append(self, timestamp, ids, joints, confidences, joints_3d=None):
+        """
+        Appends the skeletons of one frame.
+
+        :param timestamp: frame time in seconds
+        :param ids: array (n_skeletons,) of skeleton ids
+        :param joints: array (n_skeletons, n_joints, 2)
+        :param confidences: array (n_skeletons, n_joints)
+        :param joints_3d: array (n_skeletons, n_joints, 3), required when the recorder has_3d
+        """
+        if timestamp < self._last_timestamp:
+            raise ValueError("timestamps have to be appended in non-decreasing order")
+        if self.has_3d and joints_3d is None:
+            raise ValueError("the recorder stores 3D joints, joints_3d is missing")
+        self._last_timestamp = timestamp
+
+        values = {'timestamp': timestamp, 'id': ids, 'joints': joints, 'joints_confidence': confidences,
+                  'joints_3d': joints_3d}
+        n_rows = len(ids)
+        start = 0
+        while start < n_rows:
+            count = min(n_rows - start, self.chunk_rows - self._chunk_fill)
+            rows = slice(self._chunk_fill, self._chunk_fill + count)
+            for name, _, _ in self._columns:
+                value = values[name]
+                self._chunk[name][rows] = value if np.ndim(value) == 0 else value[start:start + count]
+            self._chunk_fill += count
+            self.rows += count
+            start += count
+            if self._chunk_fill == self.chunk_rows:
+                self._write_chunk()
+                self._chunk_index += 1
+                self._chunk_fill = 0
+
+    def append_skeletons(self, timestamp, skeletons, joints_3d=None):
+        """
+        Appends the structured array returned by CubemosData.estimate_skeleton_array(frame, structured=True).
+        """
+        self.append(timestamp, skeletons['id'], skeletons['joints'], skeletons['joints_confidence'], joints_3d)
+
+    def flush(self):
+        """
+        Writes the partially filled chunk so the file is readable up to the last appended row.
+        """
+        if self._chunk_fill:
+            self._write_chunk()
+        self._file.flush()
+
+    def close(self):
+        if self._file.closed:
+            return
+        self.flush()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _write_chunk(self):
+        fill = self._chunk_fill
+        timestamps = self._chunk['timestamp']
+        header = CHUNK_HEADER.pack(fill, 0, timestamps[0], timestamps[fill - 1])
+        self._file.seek(FILE_HEADER_SIZE + self._chunk_index * self._chunk_size)
+        self._file.write(header.ljust(CHUNK_HEADER_SIZE, b'\0'))
+        for name, _, _ in self._columns:
+            column = self._chunk[name]
+            # unused rows of a partial chunk are zeroed so the chunk always has its full size
+            column[fill:] = 0
+            self._file.write(column.tobytes())
+
+
+class SkeletonRecording:
+    """
+    Memory-maps a file written by SkeletonRecorder and answers time range queries with NumPy views.
+
+    Methods
+    _______
+    chunk(self, index):
+
+    query(self, start=None, stop=None):
+
+    close(self):
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as file:
+            header = file.read(FILE_HEADER.size)
+        if len(header) < FILE_HEADER.size:
+            raise ValueError("\"{}\" is not a skeleton recording".format(path))
+        magic, version, n_joints, flags, chunk_rows = FILE_HEADER.unpack(header)
+        if magic != MAGIC:
+            raise ValueError("\"{}\" is not a skeleton recording".format(path))
+        if version != VERSION:
+            raise ValueError("unsupported skeleton recording version {}".format(version))
+
+        self.n_joints = n_joints
+        self.has_3d = bool(flags & FLAG_JOINTS_3D)
+        self.chunk_rows = chunk_rows
+        self._columns = _columns(n_joints, self.has_3d)
+        self._chunk_size = _chunk_size(self._columns, chunk_rows)
+
+        size = os.path.getsize(path)
+        self.n_chunks = max(size - FILE_HEADER_SIZE, 0) // self._chunk_size
+        if self.n_chunks:
+            self._map = np.memmap(path, dtype=np.uint8, mode='r')
+            # chunk headers read through one strided view, without touching the chunk data
+            headers = np.ndarray((self.n_chunks,), dtype=np.dtype([('rows', '<u4'), ('reserved', '<u4'),
+                                                                   ('first', '<f8'), ('last', '<f8')]),
+                                 buffer=self._map, offset=FILE_HEADER_SIZE, strides=(self._chunk_size,))
+            self._chunk_rows_filled = np.array(headers['rows'])
+            self._chunk_first = np.array(headers['first'])
+            self._chunk_last = np.array(headers['last'])
+        else:
+            self._map = None
+            self._chunk_rows_filled = np.zeros(0, dtype=np.uint32)
+            self._chunk_first = np.zeros(0)
+            self._chunk_last = np.zeros(0)
+
+    def __len__(self):
+        return int(self._chunk_rows_filled.sum())
+
+    @property
+    def time_range(self):
+        if not self.n_chunks:
+            return None
+        return float(self._chunk_first[0]), float(self._chunk_last[-1])
+
+    def chunk(self, index):
+        """
+        Returns a dictionary of read-only views on the filled rows of one chunk.
+        """
+        offset = FILE_HEADER_SIZE + index * self._chunk_size + CHUNK_HEADER_SIZE
+        rows = int(self._chunk_rows_filled[index])
+        views = {}
+        for name, dtype, shape in self._columns:
+            views[name] = np.ndarray((rows,) + shape, dtype=dtype, buffer=self._map, offset=offset)
+            offset += dtype.itemsize * int(np.prod(shape)) * self.chunk_rows
+        return views
+
+    def query(self, start=None, stop=None):
+        """
+        Returns the rows with start <= timestamp < stop as a dictionary of column arrays.
+
+        The arrays are views into the file when the rows lie in one chunk, rows spanning several
+        chunks are concatenated.
+        """
+        start = -np.inf if start is None else start
+        stop = np.inf if stop is None else stop
+        first = np.searchsorted(self._chunk_last, start, side='left')
+        last = np.searchsorted(self._chunk_first, stop, side='left')
+
+        parts = []
+        for index in range(first, last):
+            views = self.chunk(index)
+            timestamps = views['timestamp']
+            begin = np.searchsorted(timestamps, start, side='left')
+            end = np.searchsorted(timestamps, stop, side='left')
+            if end > begin:
+                parts.append({name: view[begin:end] for name, view in views.items()})
+
+        if len(parts) == 1:
+            return parts[0]
+        if not parts:
+            return {name: np.zeros((0,) + shape, dtype=dtype) for name, dtype, shape in self._columns}
+        return {name: np.concatenate([part[name] for part in parts]) for name, _, _ in self._columns}
+
+    def close(self):
+        self._map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+import numpy as np
+
+RAW_JOINT_COUNT = 18
+
+
+def skeleton_boxes(joints, confidences, confidence_threshold=0.1):
+    """
+    Bounding boxes of the detected joints of each skeleton.
+
+    :param joints: array (n_skeletons, n_joints, 2) of pixel coordinates, undetected joints are negative
+    :param confidences: array (n_skeletons, n_joints)
+    :return: array (n_boxes, 4) of [x0, y0, x1, y1], skeletons without detected joints are left out
+    """
+    detected = (confidences > confidence_threshold) & (joints >= 0).all(axis=2)
+    keep = detected.any(axis=1)
+    joints, detected = joints[keep], detected[keep]
+    low = np.where(detected[..., None], joints, np.inf).min(axis=1)
+    high = np.where(detected[..., None], joints, -np.inf).max(axis=1)
+    return np.concatenate((low, high), axis=1)
+
+
+def pad_boxes(boxes, padding, min_size, image_width, image_height):
+    """
+    Grows the boxes by a fraction of their size and clips them to the image.
+
+    :return: integer array (n_boxes, 4) of [x0, y0, x1, y1], x1 and y1 exclusive
+    """
+    size = np.maximum(boxes[:, 2:] - boxes[:, :2], min_size)
+    centre = 0.5 * (boxes[:, :2] + boxes[:, 2:])
+    half = 0.5 * size * (1 + 2 * padding)
+    padded = np.concatenate((centre - half, centre + half), axis=1)
+    padded = np.floor(padded).astype(np.int64)
+    np.clip(padded, 0, (image_width, image_height, image_width, image_height), out=padded)
+    return padded
+
+
+def merge_boxes(boxes):
+    """
+    Replaces overlapping boxes by their union until no two boxes overlap.
+    """
+    boxes = [list(box) for box in boxes]
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(boxes)):
+            for j in range(i + 1, len(boxes)):
+                a, b = boxes[i], boxes[j]
+                if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                    boxes[i] = [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+                    del boxes[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return np.array(boxes, dtype=np.int64).reshape(-1, 4)
+
+
+def grow_box_to_foreground(box, joints, depth_image, depth_margin, search_padding):
+    """
+    Extends a box to the pixels around it whose depth is close to the depth of the person.
+
+    The depth of the person is the median depth at its joints, the search is limited to the box grown
+    by search_padding times its size so the floor or a wall at the same distance do not take over.
+    """
+    height, width = depth_image.shape
+    pixels = np.round(joints).astype(np.int64)
+    inside = (pixels >= 0).all(axis=1) & (pixels[:, 0] < width) & (pixels[:, 1] < height)
+    joint_depth = depth_image[pixels[inside, 1], pixels[inside, 0]]
+    joint_depth = joint_depth[joint_depth > 0]
+    if len(joint_depth) == 0:
+        return box
+    person_depth = np.median(joint_depth)
+
+    grow = (np.array([box[2] - box[0], box[3] - box[1]]) * search_padding).astype(np.int64)
+    x0, y0 = np.maximum(box[:2] - grow, 0)
+    x1, y1 = np.minimum(box[2:] + grow, (width, height))
+    region = depth_image[y0:y1, x0:x1]
+    foreground = (region > 0) & (np.abs(region.astype(np.float32) - person_depth) < depth_margin)
+    rows = np.nonzero(foreground.any(axis=1))[0]
+    cols = np.nonzero(foreground.any(axis=0))[0]
+    if len(rows) == 0:
+        return box
+    return np.array([min(box[0], x0 + cols[0]), min(box[1], y0 + rows[0]),
+                     max(box[2], x0 + cols[-1] + 1), max(box[3], y0 + rows[-1] + 1)], dtype=np.int64)
+
+
+class RoiEstimator:
+    """
+    Runs the keypoint inference on regions of interest around the people of the previous frame.
+
+    The regions are the padded joint bounding boxes of the previous frame, optionally grown to the
+    foreground found in the depth image. The keypoints found in the crops are mapped back to full
+    frame coordinates. The full frame is processed every refresh_interval frames to pick up new
+    people, and whenever the crops found fewer people than the previous frame. Such a fallback frame
+    costs the inference on every crop plus the inference on the full frame, it is counted in
+    fallback_frames (and in full_frames).
+
+    Attributes
+    ___________
+    infer: callable infer(image) returning (joints, confidences, ids) arrays of shapes
+           (n, 18, 2), (n, 18) and (n,), joint coordinates in pixels of the image
+    image_width: width of the full frame
+    image_height: height of the full frame
+    refresh_interval: full frame inference every refresh_interval frames, 1 for every frame
+    padding: fraction of the box size added on every side
+    min_size: minimum width and height of a box before padding, in pixels
+    depth_margin: depth range around the person counted as foreground, in raw depth units
+    confidence_threshold: joints at or below this confidence do not contribute to the boxes
+    full_frames: frames whose keypoints came from the full frame
+    cropped_frames: frames whose keypoints came from the crops
+    fallback_frames: full frames run after the crops of the same frame found fewer people
+
+    Methods
+    _______
+    estimate(self, color_image, depth_image=None):
+
+    reset(self):
+    """
+    def __init__(self, infer, image_width, image_height, refresh_interval=10, padding=0.25, min_size=64,
+                 depth_margin=500, confidence_threshold=0.1):
+        if refresh_interval < 1:
+            raise ValueError("refresh_interval must be at least 1")
+        self.infer = infer
+        self.image_width = image_width
+        self.image_height = image_height
+        self.refresh_interval = refresh_interval
+        self.padding = padding
+        self.min_size = min_size
+        self.depth_margin = depth_margin
+        self.confidence_threshold = confidence_threshold
+        self.full_frames = 0
+        self.cropped_frames = 0
+        self.fallback_frames = 0
+        self.reset()
+
+    def reset(self):
+        self._frame_count = 0
+        self._previous = None
+
+    def regions(self, depth_image=None):
+        """
+        Returns the crop boxes for the next frame, None if the full frame has to be processed.
+        """
+        if self._previous is None or self._frame_count % self.refresh_interval == 0:
+            return None
+        joints, confidences = self._previous
+        boxes = skeleton_boxes(joints, confidences, self.confidence_threshold)
+        if len(boxes) < len(joints) or len(boxes) == 0:
+            return None
+        boxes = pad_boxes(boxes, self.padding, self.min_size, self.image_width, self.image_height)
+        if depth_image is not None:
+            boxes = np.array([grow_box_to_foreground(box, skeleton_joints, depth_image, self.depth_margin,
+                                                     self.padding)
+                              for box, skeleton_joints in zip(boxes, joints)])
+        return merge_boxes(boxes)
+
+    def estimate(self, color_image, depth_image=None):
+        """
+        Returns the (joints, confidences, ids) of the frame in full frame pixel coordinates.
+        """
+        boxes = self.regions(depth_image)
+        self._frame_count += 1
+
+        if boxes is not None:
+            joints, confidences, ids = self._estimate_crops(color_image, boxes)
+            if len(joints) >= len(self._previous[0]):
+                self.cropped_frames += 1
+                self._previous = (joints, confidences)
+                return joints, confidences, ids
+            # a person left its crop, the frame is inferred a second time
+            self.fallback_frames += 1
+
+        joints, confidences, ids = self.infer(color_image)
+        self.full_frames += 1
+        # restart the refresh interval from this full frame
+        self._frame_count = 1
+        self._previous = (joints, confidences) if len(joints) else None
+        return joints, confidences, ids
+
+    def _estimate_crops(self, color_image, boxes):
+        results = [self.infer(np.ascontiguousarray(color_image[y0:y1, x0:x1])) for x0, y0, x1, y1 in boxes]
+        joints = np.concatenate([result[0] for result in results]).reshape(-1, RAW_JOINT_COUNT, 2)
+        confidences = np.concatenate([result[1] for result in results]).reshape(-1, RAW_JOINT_COUNT)
+        ids = np.concatenate([result[2] for result in results])
+
+        # move the detected joints from crop to full frame coordinates, undetected joints stay negative
+        offsets = np.repeat(boxes[:, :2], [len(result[0]) for result in results], axis=0)
+        detected = (joints >= 0).all(axis=2, keepdims=True)
+        joints = np.where(detected, joints + offsets[:, None, :], joints).astype(np.float32)
+        return joints, confidences, ids
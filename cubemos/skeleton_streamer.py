@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+import threading
+import time
+from collections import deque
+
+# Queue policies when a stage produces faster than the next one consumes
+DROP_OLDEST = "drop_oldest"
+BLOCK = "block"
+
+
+class FrameQueue:
+    """
+    Bounded queue between two pipeline stages.
+
+    With the DROP_OLDEST policy a put on a full queue discards the oldest item so the
+    consumer always gets the most recent frame. With the BLOCK policy the producer waits
+    for free space instead.
+
+    Attributes
+    ___________
+    maxsize: maximum number of queued items
+    policy: DROP_OLDEST or BLOCK
+    dropped: number of items discarded because the queue was full
+    """
+    def __init__(self, maxsize=1, policy=DROP_OLDEST):
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+        if policy not in (DROP_OLDEST, BLOCK):
+            raise ValueError("unknown queue policy \"{}\"".format(policy))
+        self.maxsize = maxsize
+        self.policy = policy
+        self.dropped = 0
+        self._items = deque()
+        self._closed = False
+        self._condition = threading.Condition()
+
+    def put(self, item):
+        """
+        Adds an item, returns False if the queue was closed before the item could be added.
+        """
+        with self._condition:
+            if self.policy == BLOCK:
+                while len(self._items) >= self.maxsize and not self._closed:
+                    self._condition.wait()
+            # the items of a closed queue are left for the consumer to drain
+            if self._closed:
+                return False
+            if len(self._items) >= self.maxsize:
+                self._items.popleft()
+                self.dropped += 1
+            self._items.append(item)
+            self._condition.notify_all()
+            return True
+
+    def get(self, timeout=None):
+        """
+        Removes and returns the oldest item, or None if the queue is closed or the timeout expired.
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._items or self._closed, timeout):
+                return None
+            if not self._items:
+                return None
+            item = self._items.popleft()
+            self._condition.notify_all()
+            return item
+
+    def close(self):
+        """
+        Wakes up every waiting producer and consumer, further puts are rejected.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def __len__(self):
+        with self._condition:
+            return len(self._items)
+
+
+class StageStats:
+    """
+    Latency counters of one pipeline stage, all times in seconds.
+    """
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, elapsed):
+        with self._lock:
+            self.count += 1
+            self.total += elapsed
+            self.last = elapsed
+            if elapsed > self.max:
+                self.max = elapsed
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'count': self.count,
+                'mean_ms': 1000.0 * self.total / self.count if self.count else 0.0,
+                'max_ms': 1000.0 * self.max,
+                'last_ms': 1000.0 * self.last,
+            }
+
+
+class SkeletonStreamer:
+    """
+    Runs capture, skeleton inference and rendering on separate worker threads.
+
+    The stages are joined by bounded FrameQueues, so a slow inference never stalls the
+    capture and a slow display never stalls the inference. With the default queue size
+    of one and the DROP_OLDEST policy each stage works on the latest available frame.
+
+    Attributes
+    ___________
+    capture: callable returning the next frame, or None at the end of the stream
+    estimator: object with an estimate_skeleton_array(frame) method, e.g. CubemosData
+    render: optional callable render(frame, joints, confidences), returning False stops the streamer
+    queue_size: size of the queues between the stages
+    policy: DROP_OLDEST or BLOCK
+
+    Methods
+    _______
+    start(self):
+
+    stop(self, timeout=None):
+
+    wait(self, timeout=None):
+
+    latest_result(self):
+
+    stats(self):
+    """
+    def __init__(self, capture, estimator, render=None, queue_size=1, policy=DROP_OLDEST):
+        self.capture = capture
+        self.estimator = estimator
+        self.render = render
+
+        self._inference_queue = FrameQueue(queue_size, policy)
+        self._render_queue = FrameQueue(queue_size, policy)
+        self._stop_event = threading.Event()
+        self._threads = []
+        self._latest_result = None
+        self._result_lock = threading.Lock()
+
+        self._stats = {
+            'capture': StageStats(),
+            'inference': StageStats(),
+            'render': StageStats(),
+            'end_to_end': StageStats(),
+        }
+
+    def start(self):
+        if self._threads:
+            raise RuntimeError("SkeletonStreamer has already been started")
+        workers = [('capture', self._capture_loop), ('inference', self._inference_loop),
+                   ('render', self._render_loop)]
+        for name, target in workers:
+            thread = threading.Thread(target=target, name="skeleton-" + name, daemon=True)
+            self._threads.append(thread)
+            thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        """
+        Signals all stages to finish and joins the worker threads.
+        """
+        self._stop_event.set()
+        self._inference_queue.close()
+        self._render_queue.close()
+        for thread in self._threads:
+            if thread is not threading.current_thread():
+                thread.join(timeout)
+
+    def wait(self, timeout=None):
+        """
+        Blocks until the streamer stops, returns True if it has stopped.
+        """
+        return self._stop_event.wait(timeout)
+
+    @property
+    def running(self):
+        return bool(self._threads) and not self._stop_event.is_set()
+
+    def latest_result(self):
+        """
+        Returns the most recent (frame, joints, confidences) tuple, or None before the first inference.
+        """
+        with self._result_lock:
+            return self._latest_result
+
+    def stats(self):
+        """
+        Returns the latency of each stage and the number of frames dropped between the stages.
+        """
+        result = {name: stage.as_dict() for name, stage in self._stats.items()}
+        result['dropped'] = {
+            'inference_queue': self._inference_queue.dropped,
+            'render_queue': self._render_queue.dropped,
+        }
+        return result
+
+    def _capture_loop(self):
+        try:
+            while not self._stop_event.is_set():
+                start = time.perf_counter()
+                frame = self.capture()
+                if frame is None:
+                    break
+                captured = time.perf_counter()
+                self._stats['capture'].add(captured - start)
+                if not self._inference_queue.put((captured, frame)):
+                    break
+        except Exception as ex:
+            print("Exception occured in capture: \"{}\"".format(ex))
+        finally:
+            self._inference_queue.close()
+
+    def _inference_loop(self):
+        try:
+            while True:
+                item = self._inference_queue.get()
+                if item is None:
+                    break
+                captured, frame = item
+                start = time.perf_counter()
+                joints, confidences = self.estimator.estimate_skeleton_array(frame)
+                self._stats['inference'].add(time.perf_counter() - start)
+                with self._result_lock:
+                    self._latest_result = (frame, joints, confidences)
+                if not self._render_queue.put((captured, frame, joints, confidences)):
+                    break
+        except Exception as ex:
+            print("Exception occured in inference: \"{}\"".format(ex))
+        finally:
+            self._render_queue.close()
+
+    def _render_loop(self):
+        try:
+            while True:
+                item = self._render_queue.get()
+                if item is None:
+                    break
+                captured, frame, joints, confidences = item
+                keep_running = True
+                if self.render is not None:
+                    start = time.perf_counter()
+                    keep_running = self.render(frame, joints, confidences)
+                    self._stats['render'].add(time.perf_counter() - start)
+                self._stats['end_to_end'].add(time.perf_counter() - captured)
+                if keep_running is False:
+                    break
+        except Exception as ex:
+            print("Exception occured in render: \"{}\"".format(ex))
+        finally:
+            self._stop_event.set()
+            self._inference_queue.close()
+            self._render_queue.close()
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+import math
+
+import numpy as np
+
+# Cost of a pair of skeletons without any joint detected in both
+NO_MATCH_COST = 1e6
+
+
+def linear_sum_assignment(cost):
+    """
+    Solves the rectangular assignment problem with the Hungarian algorithm.
+
+    :param cost: array (n_rows, n_cols) of finite assignment costs
+    :return: (row_index, col_index) of the minimum cost matching, sorted by row
+    """
+    cost = np.asarray(cost, dtype=np.float64)
+    transposed = cost.shape[0] > cost.shape[1]
+    if transposed:
+        cost = cost.T
+    n_rows, n_cols = cost.shape
+    if n_rows == 0:
+        return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)
+
+    # potentials and matching use 1-based indices, column 0 is a virtual start column
+    u = np.zeros(n_rows + 1)
+    v = np.zeros(n_cols + 1)
+    row_of_col = np.zeros(n_cols + 1, dtype=np.intp)
+    way = np.zeros(n_cols + 1, dtype=np.intp)
+    for row in range(1, n_rows + 1):
+        row_of_col[0] = row
+        col0 = 0
+        min_slack = np.full(n_cols + 1, np.inf)
+        used = np.zeros(n_cols + 1, dtype=bool)
+        while True:
+            used[col0] = True
+            row0 = row_of_col[col0]
+            free = ~used[1:]
+            slack = cost[row0 - 1] - u[row0] - v[1:]
+            improved = free & (slack < min_slack[1:])
+            min_slack[1:][improved] = slack[improved]
+            way[1:][improved] = col0
+            candidates = np.where(free, min_slack[1:], np.inf)
+            col1 = int(np.argmin(candidates)) + 1
+            delta = candidates[col1 - 1]
+            u[row_of_col[used]] += delta
+            v[used] -= delta
+            min_slack[1:][free] -= delta
+            col0 = col1
+            if row_of_col[col0] == 0:
+                break
+        # augment along the alternating path
+        while col0 != 0:
+            col1 = way[col0]
+            row_of_col[col0] = row_of_col[col1]
+            col0 = col1
+
+    cols = np.nonzero(row_of_col[1:])[0]
+    rows = row_of_col[1:][cols] - 1
+    if transposed:
+        rows, cols = cols, rows
+    order = np.argsort(rows)
+    return rows[order], cols[order]
+
+
+def joint_distance_matrix(joints_a, valid_a, joints_b, valid_b):
+    """
+    Mean distance between the joints two sets of skeletons have in common.
+
+    :param joints_a: array (n, n_joints, 2)
+    :param valid_a: boolean array (n, n_joints)
+    :param joints_b: array (m, n_joints, 2)
+    :param valid_b: boolean array (m, n_joints)
+    :return: array (n, m), NO_MATCH_COST for pairs without a common joint
+    """
+    distance = np.linalg.norm(joints_a[:, None] - joints_b[None, :], axis=3)
+    common = valid_a[:, None] & valid_b[None, :]
+    count = common.sum(axis=2)
+    total = np.where(common, distance, 0).sum(axis=2)
+    return np.where(count > 0, total / np.maximum(count, 1), NO_MATCH_COST)
+
+
+class SkeletonTracker:
+    """
+    Keeps stable ids for the skeletons across frames and smooths their joints with a One-Euro filter.
+
+    Skeletons are associated to the tracks of the previous frames with Hungarian matching on the
+    mean joint distance. All track state lives in arrays preallocated for max_people tracks.
+
+    Attributes
+    ___________
+    max_people: number of tracks that can be alive at the same time
+    n_joints: joints per skeleton
+    max_distance: largest mean joint distance of a match, in the units of the joints
+    max_missed: frames a track survives without a matching skeleton
+    confidence_threshold: joints at or below this confidence are treated as not detected
+    min_cutoff, beta, d_cutoff: One-Euro filter parameters, the default beta suits normalized joints
+
+    Methods
+    _______
+    update(self, joints, confidences, timestamp):
+
+    reset(self):
+    """
+    def __init__(self, max_people=8, n_joints=25, max_distance=0.1, max_missed=5, confidence_threshold=0.1,
+                 min_cutoff=1.0, beta=50.0, d_cutoff=1.0):
+        self.max_people = max_people
+        self.n_joints = n_joints
+        self.max_distance = max_distance
+        self.max_missed = max_missed
+        self.confidence_threshold = confidence_threshold
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+
+        self.ids = np.full(max_people, -1, dtype=np.int64)
+        self.missed = np.zeros(max_people, dtype=np.int32)
+        self.last_time = np.zeros(max_people, dtype=np.float64)
+        self.joints = np.zeros((max_people, n_joints, 2), dtype=np.float32)
+        self.velocity = np.zeros((max_people, n_joints, 2), dtype=np.float32)
+        self.valid = np.zeros((max_people, n_joints), dtype=bool)
+        self._next_id = 0
+
+    def reset(self):
+        self.ids.fill(-1)
+        self.missed.fill(0)
+        self.valid.fill(False)
+        self._next_id = 0
+
+    @property
+    def active(self):
+        return self.ids >= 0
+
+    def update(self, joints, confidences, timestamp):
+        """
+        Associates the skeletons of a frame with the existing tracks and filters their joints.
+
+        :param joints: array (n_skeletons, n_joints, 2), e.g. from CubemosData.estimate_skeleton_array
+        :param confidences: array (n_skeletons, n_joints)
+        :param timestamp: frame time in seconds
+        :return: (ids, smoothed) with ids an array (n_skeletons,), -1 for skeletons that did not get a
+                 track because all slots are in use, and smoothed an array (n_skeletons, n_joints, 2)
+        """
+        joints = np.asarray(joints, dtype=np.float32).reshape(-1, self.n_joints, 2)
+        detected = np.asarray(confidences).reshape(-1, self.n_joints) > self.confidence_threshold
+        n_skeletons = len(joints)
+
+        # associate the skeletons with the active tracks
+        slot_of_skeleton = np.full(n_skeletons, -1, dtype=np.intp)
+        active_slots = np.nonzero(self.active)[0]
+        if n_skeletons and len(active_slots):
+            cost = joint_distance_matrix(joints, detected, self.joints[active_slots], self.valid[active_slots])
+            rows, cols = linear_sum_assignment(cost)
+            accepted = cost[rows, cols] <= self.max_distance
+            slot_of_skeleton[rows[accepted]] = active_slots[cols[accepted]]
+
+        matched = slot_of_skeleton >= 0
+        if matched.any():
+            self._filter(slot_of_skeleton[matched], joints[matched], detected[matched], timestamp)
+
+        # start new tracks in the free slots
+        free_slots = np.nonzero(~self.active)[0]
+        new_skeletons = np.nonzero(~matched)[0][:len(free_slots)]
+        new_slots = free_slots[:len(new_skeletons)]
+        if len(new_slots):
+            self.ids[new_slots] = np.arange(self._next_id, self._next_id + len(new_slots))
+            self._next_id += len(new_slots)
+            self.joints[new_slots] = joints[new_skeletons]
+            self.velocity[new_slots] = 0
+            self.valid[new_slots] = detected[new_skeletons]
+            self.last_time[new_slots] = timestamp
+            slot_of_skeleton[new_skeletons] = new_slots
+
+        # age the tracks without a skeleton in this frame
+        seen = np.zeros(self.max_people, dtype=bool)
+        seen[slot_of_skeleton[slot_of_skeleton >= 0]] = True
+        self.missed[seen] = 0
+        self.missed[self.active & ~seen] += 1
+        expired = self.missed > self.max_missed
+        self.ids[expired] = -1
+        self.missed[expired] = 0
+        self.valid[expired] = False
+
+        assigned = slot_of_skeleton >= 0
+        ids = np.full(n_skeletons, -1, dtype=np.int64)
+        ids[assigned] = self.ids[slot_of_skeleton[assigned]]
+        smoothed = joints.copy()
+        smoothed[assigned] = self.joints[slot_of_skeleton[assigned]]
+        return ids, smoothed
+
+    def _alpha(self, cutoff, dt):
+        tau = 1.0 / (2 * math.pi * cutoff)
+        return 1.0 / (1.0 + tau / dt)
+
+    def _filter(self, slots, joints, detected, timestamp):
+        """
+        One-Euro filter step for the joints of the matched tracks, all slots at once.
+        """
+        dt = np.maximum(timestamp - self.last_time[slots], 1e-3)[:, None, None]
+        previous = self.joints[slots]
+
+        raw_velocity = (joints - previous) / dt
+        velocity = self.velocity[slots]
+        velocity += self._alpha(self.d_cutoff, dt) * (raw_velocity - velocity)
+        cutoff = self.min_cutoff + self.beta * np.abs(velocity)
+        filtered = previous + self._alpha(cutoff, dt) * (joints - previous)
+
+        # joints detected for the first time start from the raw value, undetected joints hold their position
+        was_valid = self.valid[slots][..., None]
+        now_detected = detected[..., None]
+        filtered = np.where(was_valid, filtered, joints)
+        velocity = np.where(was_valid, velocity, 0)
+        self.joints[slots] = np.where(now_detected, filtered, previous)
+        self.velocity[slots] = np.where(now_detected, velocity, self.velocity[slots])
+        self.valid[slots] |= detected
+        self.last_time[slots] = timestamp
@@ -2,6 +2,7 @@
 import json
 import os
 import platform
+import sys
 import time
 from collections import namedtuple
 
@@ -12,6 +13,10 @@ from cubemos.core.nativewrapper import CM_TargetComputeDevice
 from cubemos.core.nativewrapper import initialise_logging, CM_LogLevel
 from cubemos.skeleton_tracking.nativewrapper import Api
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "cubemos"))
+from skeleton_3d import lift_skeletons_3d
+from skeleton_recorder import SkeletonRecorder, SkeletonRecording
+
 keypoint_ids = [
     (1, 2),
     (1, 5),
@@ -131,8 +136,9 @@ if __name__ == "__main__":
         depth = frames.get_depth_frame()
         depth_intrin = depth.profile.as_video_stream_profile().intrinsics
 
-        all_joints = {}
-        all_joints_depth = {}
+        # every frame of the session is appended to a skeleton recording
+        recording_filename = 'skeletons-' + time.strftime("%Y%m%d-%H%M%S") + '.bin'
+        recorder = SkeletonRecorder(recording_filename, n_joints=18, has_3d=True)
 
         try:
             while True:
@@ -153,40 +159,26 @@ if __name__ == "__main__":
                 skeletons = api.estimate_keypoints(color_image, 256)
                 # print("skeletons:", skeletons)
 
+                # calculate the 3D keypoints of all skeletons in the frame in one pass
+                joints_2D = np.array([skeleton.joints for skeleton in skeletons], dtype=np.float32).reshape(-1, 18, 2)
+                confidences = np.array([skeleton.confidences for skeleton in skeletons], dtype=np.float32).reshape(-1, 18)
+                joints_3D, _ = lift_skeletons_3d(joints_2D, depth_image, depth_intrin, depth.get_units(), confidences)
+
                 # sometimes len(skeletons)==0, does not throw exception when human not detected
                 if len(skeletons) > 0:
-                    skeleton = skeletons[0]
-                    joints = []
-                    joints_depth = []
-                    print(skeleton.joints)
-                    for joint in skeleton.joints:
-                        # build list of normalized data
-                        joints.append(joint.x/image_width)
-                        joints.append(joint.y/image_height)
-                        # joints_depth.append(depth.get_distance(int(joint.x), int(joint.y)))
+                    # build list of normalized data
+                    joints = (joints_2D[0] / (image_width, image_height)).ravel().tolist()
+                    joints_depth = joints_3D[0, :, 2].tolist()
 
                     print(joints)
                     print(joints_depth)
-                    all_joints[frame_time] = joints
-                    all_joints_depth[frame_time] = joints_depth
-                else:
-                    all_joints[frame_time] = [0]
-                    all_joints_depth[frame_time] = [0]
+
+                ids = np.array([skeleton.id for skeleton in skeletons], dtype=np.int32)
+                recorder.append(frame_time, ids, joints_2D / (image_width, image_height), confidences, joints_3D)
 
                 print("*" * 50)
-                # *****************************************************************
-                # I don't think this is needed
-                #
-                # perform inference again to demonstrate tracking functionality.
-                # usually you would estimate the keypoints on another image and then
-                # update the tracking id
-                # new_skeletons = api.estimate_keypoints(color_image, 256)
-                # print("new_skeletons:", new_skeletons)
-                # new_skeletons = api.update_tracking_id(skeletons, new_skeletons)
-                # print("new_skeletons:", new_skeletons)
-                # print("skeletons:", skeletons)
-                # print("*"*50)
-                # *********************************************************************
+                # stable ids and smoothed joints across frames are provided by
+                # cubemos/skeleton_tracker.py without a second estimate_keypoints call
 
                 # render the skeletons on top of the acquired image and display it
                 color_image = cv2.cvtColor(color_image, cv2.COLOR_BGR2RGB) #color adjustment, not sure what is going on
@@ -196,41 +188,22 @@ if __name__ == "__main__":
 
                 keyPressed = cv2.waitKey(1)
                 if keyPressed == 115:
-                    skeleton_dump = []
                     data_filename = 'data-' +  time.strftime("%Y%m%d-%H%M%S") + '.json'
-                    # calculate 3D keypoints if the trigger with the keyboard was made
+                    # the 3D keypoints are already calculated for every frame, joints without a valid depth are [-1,-1,-1]
+                    skeleton_dump = [skeletons_3D(skeleton.id, joints_3D[skeleton_index].tolist())
+                                     for skeleton_index, skeleton in enumerate(skeletons)]
                     with open(data_filename, 'w') as outfile:
-                        for skeleton_index in range(len(skeletons)):
-                            skeleton_2D = skeletons[skeleton_index]
-                            joints_2D = skeleton_2D.joints
-                            joints_3D = [[-1,-1,-1]] *  len(joints_2D) 
-                            for joint_index in range(len(joints_2D)):                        
-                                # check if the joint was detected and has valid coordinate
-                                # if so, calculate 3d point based on it and write it to the json dump
-                                if skeleton_2D.confidences[joint_index] > 0.01 :
-
-                                    # if the image co-ordinate is beyond the width of the image, correct it
-                                    if joints_2D[joint_index].x >= image_width:
-                                        joints_2D[joint_index].x = image_width - 1
-                                    if joints_2D[joint_index].y >= image_height:
-                                        joints_2D[joint_index].y = image_height - 1 
-
-                                    distance = depth.get_distance(int(joints_2D[joint_index].x), int(joints_2D[joint_index].y))
-                                    depth_pixel = [ int(joints_2D[joint_index].x), int(joints_2D[joint_index].y)]
-                                    if distance >= 0.3:
-                                        point_3d = rs.rs2_deproject_pixel_to_point(depth_intrin, depth_pixel, distance)
-                                        joints_3D[joint_index] = point_3d
-                            skeleton_dump.append(skeletons_3D(skeleton_2D.id, joints_3D))
                         # write the calculated keypoints for all the skeletons into a JSON file
                         json.dump(skeleton_dump, outfile)
                         print("Saved the skeletons to the file " + data_filename)
                 elif keyPressed == 113:
-                    print(all_joints)
-                    print(all_joints_depth)
                     break
  
         finally:
             pipeline.stop()
+            recorder.close()
+            with SkeletonRecording(recording_filename) as recording:
+                print("Recorded", len(recording), "skeletons between", recording.time_range, "to", recording_filename)
             
     except Exception as ex:
         print("Exception occured: \"{}\"".format(ex))
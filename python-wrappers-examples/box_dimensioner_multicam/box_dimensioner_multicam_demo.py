@@ -19,11 +19,22 @@ import numpy as np
 
 # Import helper functions and classes written to wrap the RealSense, OpenCV and Kabsch Calibration usage
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from realsense_device_manager import DeviceManager
 from calibration_kabsch import PoseEstimation
-from helper_functions import get_boundary_corners_2D
+from helper_functions import get_boundary_corners_2D, PointCloudAccumulator
 from measurement_task import calculate_boundingbox_points, calculate_cumulative_pointcloud, visualise_measurements
 
+def poll_frames(device_manager):
+	"""
+	Waits for the next frames of all the devices, telling the user while a device doesn't deliver any
+	"""
+	while True:
+		try:
+			return device_manager.poll_frames()
+		except RuntimeError as error:
+			print(str(error) + ", waiting for the devices..")
+
 def run_demo():
 	
 	# Define some constants 
@@ -36,6 +47,9 @@ def run_demo():
 	chessboard_height = 9 	# squares
 	square_size = 0.0253 # meters
 
+	point_cloud_workers = 0 # threads processing the depth frames, 0 for one per device, 1 without threads
+	executor = None
+
 	try:
 		# Enable the streams from all the intel realsense devices
 		rs_config = rs.config()
@@ -49,7 +63,7 @@ def run_demo():
 		
 		# Allow some frames for the auto-exposure controller to stablise
 		for frame in range(dispose_frames_for_stablisation):
-			frames = device_manager.poll_frames()
+			frames = poll_frames(device_manager)
 
 		assert( len(device_manager._available_devices) > 0 )
 		"""
@@ -67,8 +81,8 @@ def run_demo():
 		# Estimate the pose of the chessboard in the world coordinate using the Kabsch Method
 		calibrated_device_count = 0
 		while calibrated_device_count < len(device_manager._available_devices):
-			frames = device_manager.poll_frames()
-			pose_estimator = PoseEstimation(frames, intrinsics_devices, chessboard_params)
+			frames = poll_frames(device_manager)
+			pose_estimator = PoseEstimation(frames, intrinsics_devices, chessboard_params, device_manager.get_depth_filter_chains())
 			transformation_result_kabsch  = pose_estimator.perform_pose_estimation()
 			object_point = pose_estimator.get_chessboard_corners_in3d()
 			calibrated_device_count = 0
@@ -108,6 +122,9 @@ def run_demo():
 		# Load the JSON settings file in order to enable High Accuracy preset for the realsense
 		device_manager.load_settings_json("./HighResHighAccuracyPreset.json")
 
+		# Smooth the depth over more frames for the measurement, starting without the history of the calibration
+		device_manager.set_depth_filter_options(temporal_smooth_alpha=0.1, temporal_smooth_delta=80)
+
 		# Get the extrinsics of the device to be used later
 		extrinsics_devices = device_manager.get_depth_to_color_extrinsics(frames)
 
@@ -117,13 +134,20 @@ def run_demo():
 			for key, value in calibration_info.items():
 				calibration_info_devices[key].append(value)
 
+		# Collect the pointcloud of all the devices in one buffer reused for every frame
+		point_cloud_accumulator = PointCloudAccumulator()
+
+		# Process the depth frames of the devices in parallel
+		workers = point_cloud_workers or len(device_manager._available_devices)
+		executor = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+
 		# Continue acquisition until terminated with Ctrl+C by the user
 		while 1:
 			 # Get the frames from all the devices
-				frames_devices = device_manager.poll_frames()
+				frames_devices = poll_frames(device_manager)
 
 				# Calculate the pointcloud using the depth frames from all the devices
-				point_cloud = calculate_cumulative_pointcloud(frames_devices, calibration_info_devices, roi_2D)
+				point_cloud = calculate_cumulative_pointcloud(frames_devices, calibration_info_devices, roi_2D, depth_filter_chains=device_manager.get_depth_filter_chains(), point_cloud_accumulator=point_cloud_accumulator, executor=executor)
 
 				# Get the bounding box for the pointcloud in image coordinates of the color imager
 				bounding_box_points_color_image, length, width, height = calculate_boundingbox_points(point_cloud, calibration_info_devices )
@@ -133,8 +157,12 @@ def run_demo():
 
 	except KeyboardInterrupt:
 		print("The program was interupted by the user. Closing the program...")
+		print("Depth post processing times:\n" + device_manager.report_depth_filters())
+		print("Frame collection: " + device_manager.get_frame_collector().report())
 	
 	finally:
+		if executor is not None:
+			executor.shutdown()
 		device_manager.disable_streams()
 		cv2.destroyAllWindows()
 	
@@ -73,58 +73,118 @@ def calculate_transformation_kabsch(src_points, dst_points):
 """
 
 class Transformation:
+	"""
+	Rigid transformation given by a rotation matrix and a translation vector
+
+	Attributes
+	___________
+	pose_mat : array
+		(4,4) homogeneous matrix of the transformation
+
+	Methods
+	_______
+	apply_transformation(self, points, out=None):
+
+	inverse(self):
+
+	compose(self, other):
+	"""
 	def __init__(self, rotation_matrix, translation_vector):
 		self.pose_mat = np.zeros((4,4))
 		self.pose_mat[:3,:3] = rotation_matrix
 		self.pose_mat[:3,3] = translation_vector.flatten()
 		self.pose_mat[3,3] = 1
-	
-	def apply_transformation(self, points):
+		# The rotation and the (3,1) translation of the transformation by dtype of the points
+		self._rigid = {}
+		self._inverse = None
+
+	def _rigid_parts(self, dtype):
+		rigid = self._rigid.get(dtype)
+		if rigid is None:
+			rigid = self._rigid[dtype] = (np.array(self.pose_mat[:3,:3], dtype=dtype), np.array(self.pose_mat[:3,3:], dtype=dtype))
+		return rigid
+
+	def apply_transformation(self, points, out=None):
 		""" 
 		Applies the transformation to the pointcloud
 		
 		Parameters:
 		-----------
 		points : array
-			(3, N) matrix where N is the number of points
+			(3, N) matrix where N is the number of points, or (N, 3) matrix with a point in every row.
+			A (3, 3) matrix is taken as three points in its columns
+		out : array
+			Matrix of the shape of points to write the transformed points in, may be points itself
 		
 		Returns:
 		----------
 		points_transformed : array
-			(3, N) transformed matrix
+			(3, N) or (N, 3) transformed matrix, like points. float32 points are transformed in float32,
+			all others in float64
 		"""
-		assert(points.shape[0] == 3)
-		n = points.shape[1] 
-		points_ = np.vstack((points, np.ones((1,n))))
-		points_trans_ = np.matmul(self.pose_mat, points_)
-		points_transformed = np.true_divide(points_trans_[:3,:], points_trans_[[-1], :])
+		assert(points.ndim == 2 and 3 in points.shape)
+		dtype = np.float32 if points.dtype == np.float32 else np.float64
+		rotation_matrix, translation_vector = self._rigid_parts(dtype)
+		if points.shape[0] == 3:
+			points_transformed = np.matmul(rotation_matrix, points, out=out)
+			points_transformed += translation_vector
+		else:
+			points_transformed = np.matmul(points, rotation_matrix.T, out=out)
+			points_transformed += translation_vector.T
 		return points_transformed
 	
 	def inverse(self):
 		"""
-		Computes the inverse transformation and returns a new Transformation object
+		Computes the inverse transformation, which is kept and returned again by later calls
 
 		Returns:
 		-----------
 		inverse: Transformation
 
 		"""
-		rotation_matrix = self.pose_mat[:3,:3]
-		translation_vector = self.pose_mat[:3,3]
-		
-		rot = np.transpose(rotation_matrix)
-		trans = - np.matmul(np.transpose(rotation_matrix), translation_vector)
-		return Transformation(rot, trans)
+		if self._inverse is None:
+			rotation_matrix = self.pose_mat[:3,:3]
+			translation_vector = self.pose_mat[:3,3]
+			self._inverse = Transformation(rotation_matrix.T, - np.matmul(translation_vector, rotation_matrix))
+			self._inverse._inverse = self
+		return self._inverse
+
+	def compose(self, other):
+		"""
+		Combines two transformations into one
+
+		Parameters:
+		-----------
+		other : Transformation
+			The transformation applied first
+
+		Returns:
+		-----------
+		composed: Transformation
+			Applies other and then this transformation in one step
+		"""
+		pose_mat = np.matmul(self.pose_mat, other.pose_mat)
+		return Transformation(pose_mat[:3,:3], pose_mat[:3,3])
 	
 	
 
 class PoseEstimation:
 
-	def __init__(self, frames, intrinsic, chessboard_params):
+	def __init__(self, frames, intrinsic, chessboard_params, depth_filter_chains=None):
 		assert(len(chessboard_params) == 3)
 		self.frames = frames
 		self.intrinsic = intrinsic
-		self.chessboard_params = chessboard_params		
+		self.chessboard_params = chessboard_params
+		self.depth_filter_chains = depth_filter_chains
+
+	def post_process_depth_frame(self, serial, depth_frame):
+		"""
+		Filters the depth frame with the DepthFilterChain of the device when one was given,
+		otherwise with filters created for this frame only
+		"""
+		if self.depth_filter_chains is None:
+			return post_process_depth_frame(depth_frame)
+		return self.depth_filter_chains[serial].process(depth_frame)
 
 	def get_chessboard_corners_in3d(self):
 		"""
@@ -151,7 +211,7 @@ class PoseEstimation:
 		"""
 		corners3D = {}
 		for (serial, frameset) in self.frames.items():
-			depth_frame = post_process_depth_frame(frameset[rs.stream.depth])
+			depth_frame = self.post_process_depth_frame(serial, frameset[rs.stream.depth])
 			infrared_frame = frameset[(rs.stream.infrared, 1)]
 			depth_intrinsics = self.intrinsic[serial][rs.stream.depth]	
 			found_corners, points2D = cv_find_chessboard(depth_frame, infrared_frame, self.chessboard_params)
@@ -221,7 +281,7 @@ class PoseEstimation:
 
 		for (serial, frameset) in self.frames.items():
 
-			depth_frame = post_process_depth_frame(frameset[rs.stream.depth])
+			depth_frame = self.post_process_depth_frame(serial, frameset[rs.stream.depth])
 			infrared_frame = frameset[(rs.stream.infrared, 1)]
 			found_corners, points2D = cv_find_chessboard(depth_frame, infrared_frame, self.chessboard_params)
 			boundary[serial] = [np.floor(np.amin(points2D[0,:])).astype(int), np.floor(np.amax(points2D[0,:])).astype(int), np.floor(np.amin(points2D[1,:])).astype(int), np.floor(np.amax(points2D[1,:])).astype(int)]
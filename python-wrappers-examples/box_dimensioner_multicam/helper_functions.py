@@ -169,23 +169,177 @@ def convert_depth_frame_to_pointcloud(depth_image, camera_intrinsics ):
 
 	"""
 	
-	[height, width] = depth_image.shape
+	x, y, z = get_depth_projector(camera_intrinsics).pointcloud(depth_image)
+	return x, y, z
+
 
-	nx = np.linspace(0, width-1, width)
-	ny = np.linspace(0, height-1, height)
-	u, v = np.meshgrid(nx, ny)
-	x = (u.flatten() - camera_intrinsics.ppx)/camera_intrinsics.fx
-	y = (v.flatten() - camera_intrinsics.ppy)/camera_intrinsics.fy
+def get_depth_projector(camera_intrinsics, depth_scale=0.001, undistort=False):
+	"""
+	Get the DepthProjector for the intrinsics, which is created once for every set of intrinsics
 
-	z = depth_image.flatten() / 1000;
-	x = np.multiply(x,z)
-	y = np.multiply(y,z)
+	Parameters:
+	-----------
+	camera_intrinsics : The intrinsic values of the imager in whose coordinate system the depth_frame is computed
+	depth_scale 	  : double
+						The depth in meters of one depth unit
+	undistort 		  : bool
+						Remove the lens distortion of the intrinsics from the rays of the pixels
 
-	x = x[np.nonzero(z)]
-	y = y[np.nonzero(z)]
-	z = z[np.nonzero(z)]
+	Return:
+	----------
+	depth_projector : DepthProjector
+	"""
+	key = DepthProjector.key(camera_intrinsics, depth_scale, undistort)
+	depth_projector = _depth_projectors.get(key)
+	if depth_projector is None:
+		depth_projector = _depth_projectors[key] = DepthProjector(camera_intrinsics, depth_scale, undistort)
+	return depth_projector
 
-	return x, y, z
+
+def undistort_normalized_points(x, y, model, coeffs):
+	"""
+	Remove the lens distortion from normalized image coordinates the way rs2_deproject_pixel_to_point does
+
+	Parameters:
+	-----------
+	x, y 	: array
+			  The normalized image coordinates (pixel - principal point) / focal length
+	model 	: str
+			  Name of the distortion model, 'brown_conrady' or 'inverse_brown_conrady'
+	coeffs 	: array
+			  The five distortion coefficients k1, k2, p1, p2, k3
+
+	Return:
+	----------
+	x, y : array
+		The undistorted normalized image coordinates
+	"""
+	[k1, k2, p1, p2, k3] = coeffs[:5]
+	if model == 'inverse_brown_conrady':
+		r2 = x*x + y*y
+		f = 1 + ((k3*r2 + k2)*r2 + k1)*r2
+		ux = x*f + 2*p1*x*y + p2*(r2 + 2*x*x)
+		uy = y*f + 2*p2*x*y + p1*(r2 + 2*y*y)
+		return ux, uy
+	if model == 'brown_conrady':
+		# The distortion can not be inverted in closed form, 10 iterations as in librealsense
+		xo = x
+		yo = y
+		for iteration in range(10):
+			r2 = x*x + y*y
+			icdist = 1 / (1 + ((k3*r2 + k2)*r2 + k1)*r2)
+			delta_x = 2*p1*x*y + p2*(r2 + 2*x*x)
+			delta_y = 2*p2*x*y + p1*(r2 + 2*y*y)
+			x = (xo - delta_x)*icdist
+			y = (yo - delta_y)*icdist
+		return x, y
+	raise ValueError("Undistortion of the distortion model " + model + " is not supported")
+
+
+class DepthProjector:
+	"""
+	Converts the depth images of one imager to point clouds
+
+	The ray of every pixel, the point at a depth of one depth unit, is computed once from the intrinsics and
+	kept as a float32 table. A depth image is then converted with a single multiplication of the table with
+	the depth into buffers of the caller, which can be reused for every image. A projector only reads its table,
+	so one projector is shared by all the threads converting images of the same intrinsics.
+
+	Attributes
+	___________
+	width, height : int
+					The size of the depth images
+	rays 		  : array
+					(3, height*width) float32 point of every pixel at one depth unit
+
+	Methods
+	_______
+	project(self, depth_image):
+
+	pointcloud(self, depth_image):
+	"""
+	def __init__(self, camera_intrinsics, depth_scale=0.001, undistort=False):
+		self.width = camera_intrinsics.width
+		self.height = camera_intrinsics.height
+		x = (np.arange(self.width, dtype=np.float64) - camera_intrinsics.ppx)/camera_intrinsics.fx
+		y = (np.arange(self.height, dtype=np.float64) - camera_intrinsics.ppy)/camera_intrinsics.fy
+		x, y = np.meshgrid(x, y)
+		if undistort:
+			x, y = undistort_normalized_points(x, y, distortion_model_name(camera_intrinsics.model),
+											   list(camera_intrinsics.coeffs))
+		self.rays = np.empty((3, self.height*self.width), dtype=np.float32)
+		self.rays[0] = x.reshape(-1)*depth_scale
+		self.rays[1] = y.reshape(-1)*depth_scale
+		self.rays[2] = depth_scale
+
+	@staticmethod
+	def key(camera_intrinsics, depth_scale=0.001, undistort=False):
+		"""
+		The intrinsics values a DepthProjector depends on, rs.intrinsics can not be used as a dictionary key
+
+		"""
+		return (camera_intrinsics.width, camera_intrinsics.height, camera_intrinsics.ppx, camera_intrinsics.ppy,
+				camera_intrinsics.fx, camera_intrinsics.fy, distortion_model_name(camera_intrinsics.model),
+				tuple(camera_intrinsics.coeffs), depth_scale, undistort)
+
+	def project(self, depth_image, points=None, valid=None):
+		"""
+		Convert every pixel of the depth image to a 3D point
+
+		Parameters:
+		-----------
+		depth_image : array
+					  (height, width) depth image in depth units
+		points 		: array
+					  (3, height*width) float32 buffer for the points, a new array if left out
+		valid 		: array
+					  (height*width) bool buffer for the mask, a new array if left out
+
+		Return:
+		----------
+		points : array
+			(3, height*width) float32 points in meters, pixels without depth are at the origin
+		valid : array
+			(height*width) bool mask of the pixels with a depth
+		"""
+		if depth_image.shape != (self.height, self.width):
+			raise ValueError("The depth image of shape " + str(depth_image.shape) + " does not match the intrinsics")
+		if points is None:
+			points = np.empty_like(self.rays)
+		if valid is None:
+			valid = np.empty(self.height*self.width, dtype=bool)
+		depth = depth_image.reshape(1, -1)
+		np.multiply(self.rays, depth, out=points)
+		np.not_equal(depth[0], 0, out=valid)
+		return points, valid
+
+	def pointcloud(self, depth_image):
+		"""
+		Convert the pixels of the depth image with a depth to 3D points
+
+		Parameters:
+		-----------
+		depth_image : array
+					  (height, width) depth image in depth units
+
+		Return:
+		----------
+		points : array
+			(3, N) float32 points in meters, N being the number of pixels with a depth
+		"""
+		points, valid = self.project(depth_image)
+		return np.compress(valid, points, axis=1)
+
+
+def distortion_model_name(model):
+	"""
+	The name of a distortion model given as rs.distortion or as str
+
+	"""
+	return getattr(model, 'name', str(model).split('.')[-1])
+
+
+_depth_projectors = {}
 
 
 def convert_pointcloud_to_depth(pointcloud, camera_intrinsics):
@@ -277,6 +431,160 @@ def get_clipped_pointcloud(pointcloud, boundary):
 	return pointcloud
 
 
+class _SelectionBuffers:
+	# The scratch buffers of the points of one device selected by PointCloudAccumulator.select
+	__slots__ = ('points', 'valid', 'world', 'mask', 'condition', 'count')
 
+	def __init__(self, size):
+		self.points = np.empty((3, size), dtype=np.float32)
+		self.valid = np.empty(size, dtype=bool)
+		self.world = np.empty((3, size), dtype=np.float32)
+		self.mask = np.empty(size, dtype=bool)
+		self.condition = np.empty(size, dtype=bool)
+		self.count = 0
 
 
+class PointCloudAccumulator:
+	"""
+	Collects the point clouds of several devices in world coordinates in one buffer
+
+	The points of a depth image are transformed into world coordinates in scratch buffers of the device, a single
+	mask combines the valid depth, the region of interest and the height threshold and the selected points are
+	written straight behind the points of the previous devices. The buffers grow to the largest frameset seen
+	and are reused afterwards.
+
+	select only touches the scratch buffers of its device, so the points of different devices can be selected
+	in parallel threads. collect then writes them in the given order of the devices, which makes the point cloud
+	independent of the order in which the threads finished.
+
+	Attributes
+	___________
+	size : int
+		   The number of points collected since the last reset
+
+	Methods
+	_______
+	reset(self):
+
+	select(self, depth_image, camera_intrinsics, transformation, roi_2d, depth_threshold=0.01, device=None):
+
+	collect(self, devices, executor=None):
+
+	add(self, depth_image, camera_intrinsics, transformation, roi_2d, depth_threshold=0.01):
+
+	pointcloud(self):
+	"""
+	def __init__(self, capacity=0):
+		self._points = np.empty((3, capacity), dtype=np.float32)
+		self._selections = {}
+		self.size = 0
+
+	def reset(self):
+		"""
+		Start collecting the points of a new frameset
+
+		"""
+		self.size = 0
+
+	def _reserve(self, capacity):
+		if capacity > self._points.shape[1]:
+			points = np.empty((3, max(capacity, 2*self._points.shape[1])), dtype=np.float32)
+			points[:, :self.size] = self._points[:, :self.size]
+			self._points = points
+
+	def select(self, depth_image, camera_intrinsics, transformation, roi_2d, depth_threshold=0.01, device=None):
+		"""
+		Select the points of a depth image which lie within the region of interest and above the chessboard plane
+
+		Parameters:
+		-----------
+		depth_image 	  : array
+							(height, width) depth image in millimeters
+		camera_intrinsics : The intrinsic values of the imager in whose coordinate system the depth image is computed
+		transformation 	  : Transformation
+							The transformation from the coordinate system of the device to the world coordinates
+		roi_2d 			  : array
+							The region of interest given in the following order [minX, maxX, minY, maxY]
+		depth_threshold   : double
+							The height in meters above the chessboard plane (along the negative Z-axis) from which on
+							points are used
+		device 			  : str
+							Serial number of the device, names the scratch buffers the points are selected in
+
+		Return:
+		----------
+		count : int
+			The number of points selected
+		"""
+		size = camera_intrinsics.width * camera_intrinsics.height
+		selection = self._selections.get(device)
+		if selection is None or selection.valid.shape[0] != size:
+			selection = self._selections[device] = _SelectionBuffers(size)
+		points, valid = get_depth_projector(camera_intrinsics).project(depth_image, selection.points, selection.valid)
+		world = selection.world
+		mask = selection.mask
+		condition = selection.condition
+
+		transformation.apply_transformation(points, out=world)
+
+		np.copyto(mask, valid)
+		for (row, comparison, bound) in ((0, np.greater, roi_2d[0]), (0, np.less, roi_2d[1]),
+										 (1, np.greater, roi_2d[2]), (1, np.less, roi_2d[3]),
+										 (2, np.less, -depth_threshold)):
+			comparison(world[row], bound, out=condition)
+			mask &= condition
+
+		selection.count = int(np.count_nonzero(mask))
+		return selection.count
+
+	def _place(self, selection, offset):
+		for row in range(3):
+			np.compress(selection.mask, selection.world[row], out=self._points[row, offset:offset + selection.count])
+
+	def collect(self, devices, executor=None):
+		"""
+		Write the points selected for the devices behind the points collected so far
+
+		Parameters:
+		-----------
+		devices  : list
+				   Serial numbers of the devices in the order their points are written in
+		executor : concurrent.futures.Executor
+				   Writes the points of the devices in parallel, they are written one after the other if left out
+		"""
+		selections = [self._selections[device] for device in devices]
+		offsets = np.cumsum([self.size] + [selection.count for selection in selections])
+		self._reserve(int(offsets[-1]))
+		if executor is None:
+			for (selection, offset) in zip(selections, offsets):
+				self._place(selection, offset)
+		else:
+			# Every device writes its own part of the buffer
+			futures = [executor.submit(self._place, selection, offset) for (selection, offset) in zip(selections, offsets)]
+			for future in futures:
+				future.result()
+		self.size = int(offsets[-1])
+
+	def add(self, depth_image, camera_intrinsics, transformation, roi_2d, depth_threshold=0.01):
+		"""
+		Select the points of a depth image like select and write them behind the points collected so far
+
+		Return:
+		----------
+		count : int
+			The number of points added
+		"""
+		count = self.select(depth_image, camera_intrinsics, transformation, roi_2d, depth_threshold)
+		self.collect([None])
+		return count
+
+	def pointcloud(self):
+		"""
+		The points collected since the last reset
+
+		Return:
+		----------
+		pointcloud : array
+			(3, size) float32 view of the buffer, overwritten by the frameset after the next reset
+		"""
+		return self._points[:, :self.size]
@@ -8,10 +8,44 @@ import pyrealsense2 as rs
 import numpy as np
 import cv2
 from realsense_device_manager import post_process_depth_frame
-from helper_functions import convert_depth_frame_to_pointcloud, get_clipped_pointcloud
+from helper_functions import PointCloudAccumulator
+from projection_helpers import transform_points, project_points_to_pixels
 
 
-def calculate_cumulative_pointcloud(frames_devices, calibration_info_devices, roi_2d, depth_threshold = 0.01):
+def select_device_points(device, frame, calibration_info, roi_2d, depth_threshold, depth_filter_chains, point_cloud_accumulator):
+	"""
+	Filter the depth frame of one device and select its points in world coordinates for the cumulative pointcloud,
+	the points are selected in the scratch buffers of the device in the accumulator
+
+	Parameters:
+	-----------
+	device : str
+		Serial number of the device
+
+	frame : dict
+		The frames of the device
+
+	calibration_info : [transformation_devices, intrinsics_devices]
+		The calibration information of the device as in calculate_cumulative_pointcloud
+
+	Return:
+	----------
+	count : int
+		The number of points selected
+	"""
+	# Filter the depth_frame using the Temporal filter and get the corresponding pointcloud for each frame
+	if depth_filter_chains is not None:
+		filtered_depth_frame = depth_filter_chains[device].process(frame[rs.stream.depth])
+	else:
+		filtered_depth_frame = post_process_depth_frame(frame[rs.stream.depth], temporal_smooth_alpha=0.1, temporal_smooth_delta=80)
+
+	# Get the point cloud in the world-coordinates using the transformation and filter it based on the depth of the object
+	# The object placed has its height in the negative direction of z-axis due to the right-hand coordinate system
+	return point_cloud_accumulator.select(np.asanyarray(filtered_depth_frame.get_data()), calibration_info[1][rs.stream.depth],
+										  calibration_info[0], roi_2d, depth_threshold, device)
+
+
+def calculate_cumulative_pointcloud(frames_devices, calibration_info_devices, roi_2d, depth_threshold = 0.01, depth_filter_chains = None, point_cloud_accumulator = None, executor = None):
 	"""
  Calculate the cumulative pointcloud from the multiple devices
 	Parameters:
@@ -39,29 +73,44 @@ def calculate_cumulative_pointcloud(frames_devices, calibration_info_devices, ro
 	depth_threshold : double
 		The threshold for the depth value (meters) in world-coordinates beyond which the point cloud information will not be used.
 		Following the right-hand coordinate system, if the object is placed on the chessboard plane, the height of the object will increase along the negative Z-axis
+
+	depth_filter_chains : dict
+		keys: str
+			Serial number of the device
+		values: DepthFilterChain
+			The depth post processing filters of the device, as kept by the DeviceManager.
+			Without them the depth frames are filtered without temporal history
+
+	point_cloud_accumulator : PointCloudAccumulator
+		The buffer to collect the points in, reused from frame to frame. A new one is used if it is left out
+
+	executor : concurrent.futures.Executor
+		Processes the depth frames of the devices in parallel, e.g. a ThreadPoolExecutor with a thread per device.
+		The devices are processed one after the other if it is left out. The pointcloud is the same either way
 	
 	Return:
 	----------
 	point_cloud_cumulative : array
-		The cumulative pointcloud from the multiple devices
+		The cumulative (3 x N) float32 pointcloud from the multiple devices, a view of the buffer of the accumulator
 	"""
 	# Use a threshold of 5 centimeters from the chessboard as the area where useful points are found
-	point_cloud_cumulative = np.array([-1, -1, -1]).transpose()
-	for (device, frame) in frames_devices.items() :
-		# Filter the depth_frame using the Temporal filter and get the corresponding pointcloud for each frame
-		filtered_depth_frame = post_process_depth_frame(frame[rs.stream.depth], temporal_smooth_alpha=0.1, temporal_smooth_delta=80)	
-		point_cloud = convert_depth_frame_to_pointcloud( np.asarray( filtered_depth_frame.get_data()), calibration_info_devices[device][1][rs.stream.depth])
-		point_cloud = np.asanyarray(point_cloud)
-
-		# Get the point cloud in the world-coordinates using the transformation
-		point_cloud = calibration_info_devices[device][0].apply_transformation(point_cloud)
-
-		# Filter the point cloud based on the depth of the object
-		# The object placed has its height in the negative direction of z-axis due to the right-hand coordinate system
-		point_cloud = get_clipped_pointcloud(point_cloud, roi_2d)
-		point_cloud = point_cloud[:,point_cloud[2,:]<-depth_threshold]
-		point_cloud_cumulative = np.column_stack( ( point_cloud_cumulative, point_cloud ) )
-	point_cloud_cumulative = np.delete(point_cloud_cumulative, 0, 1)
+	if point_cloud_accumulator is None:
+		point_cloud_accumulator = PointCloudAccumulator()
+	point_cloud_accumulator.reset()
+	devices = list(frames_devices)
+	if executor is None:
+		for device in devices:
+			select_device_points(device, frames_devices[device], calibration_info_devices[device], roi_2d, depth_threshold,
+								 depth_filter_chains, point_cloud_accumulator)
+	else:
+		futures = [executor.submit(select_device_points, device, frames_devices[device], calibration_info_devices[device], roi_2d,
+								   depth_threshold, depth_filter_chains, point_cloud_accumulator) for device in devices]
+		for future in futures:
+			future.result()
+
+	# Merge the points in the order of the devices, whichever device finished first
+	point_cloud_accumulator.collect(devices, executor)
+	point_cloud_cumulative = point_cloud_accumulator.pointcloud()
 	return point_cloud_cumulative
 
 
@@ -118,7 +167,7 @@ def calculate_boundingbox_points(point_cloud, calibration_info_devices, depth_th
 		min_area_rectangle = cv2.minAreaRect(coord)
 		bounding_box_world_2d = cv2.boxPoints(min_area_rectangle)
 		# Caculate the height of the pointcloud
-		height = max(point_cloud[2,:]) - min(point_cloud[2,:]) + depth_threshold
+		height = point_cloud[2,:].max() - point_cloud[2,:].min() + depth_threshold
 
 		# Get the upper and lower bounding box corner points in 3D
 		height_array = np.array([[-height], [-height], [-height], [-height], [0], [0], [0], [0]])
@@ -128,16 +177,11 @@ def calculate_boundingbox_points(point_cloud, calibration_info_devices, depth_th
 		bounding_box_points_color_image={}
 		for (device, calibration_info) in calibration_info_devices.items():
 			# Transform the bounding box corner points to the device coordinates
-			bounding_box_device_3d = calibration_info[0].inverse().apply_transformation(bounding_box_world_3d.transpose())
+			bounding_box_device_3d = calibration_info[0].inverse().apply_transformation(bounding_box_world_3d)
 			
 			# Obtain the image coordinates in the color imager using the bounding box 3D corner points in the device coordinates
-			color_pixel=[]
-			bounding_box_device_3d = bounding_box_device_3d.transpose().tolist()
-			for bounding_box_point in bounding_box_device_3d: 
-				bounding_box_color_image_point = rs.rs2_transform_point_to_point(calibration_info[2], bounding_box_point)			
-				color_pixel.append(rs.rs2_project_point_to_pixel(calibration_info[1][rs.stream.color], bounding_box_color_image_point))
-			
-			bounding_box_points_color_image[device] = np.row_stack( color_pixel )
+			bounding_box_color_3d = transform_points(calibration_info[2], bounding_box_device_3d)
+			bounding_box_points_color_image[device] = project_points_to_pixels(calibration_info[1][rs.stream.color], bounding_box_color_3d)
 		return bounding_box_points_color_image, min_area_rectangle[1][0], min_area_rectangle[1][1], height
 	else : 
 		return {},0,0,0
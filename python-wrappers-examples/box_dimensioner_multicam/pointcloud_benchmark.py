@@ -0,0 +1,154 @@
+##################################################################################################
+##       License: Apache 2.0. See LICENSE file in root directory.		                      ####
+##################################################################################################
+##                  Box Dimensioner with multiple cameras: Point cloud benchmark 			  ####
+##################################################################################################
+
+# Measures the time and the peak memory of collecting the point cloud of several devices on synthetic
+# depth images, without any device connected:
+#   python pointcloud_benchmark.py [devices] [frames] [workers]
+
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pyrealsense2 as rs
+
+from calibration_kabsch import Transformation
+from helper_functions import convert_depth_frame_to_pointcloud, get_clipped_pointcloud, PointCloudAccumulator
+
+
+def synthetic_intrinsics(width=1280, height=720):
+	"""
+	Intrinsics of a D400 depth imager at the given resolution
+
+	"""
+	intrinsics = rs.intrinsics()
+	intrinsics.width = width
+	intrinsics.height = height
+	intrinsics.ppx = width / 2.0 - 0.5
+	intrinsics.ppy = height / 2.0 - 0.5
+	intrinsics.fx = 0.5 * width
+	intrinsics.fy = 0.5 * width
+	intrinsics.model = rs.distortion.brown_conrady
+	intrinsics.coeffs = [0.0] * 5
+	return intrinsics
+
+
+def synthetic_scene(devices, intrinsics, seed=0):
+	"""
+	Depth images and transformations of devices looking down at a box on the chessboard from 1 m
+
+	Returns:
+	-----------
+	depth_images : list
+		(height, width) uint16 depth images in millimeters
+	transformations : list
+		Transformation from the coordinate system of every device to the world coordinates
+	"""
+	random = np.random.RandomState(seed)
+	depth_images = []
+	transformations = []
+	for device in range(devices):
+		# The chessboard plane 1 m away, the top of a 100 mm high box in the middle
+		depth = 1000 + random.randint(-3, 4, (intrinsics.height, intrinsics.width))
+		depth[intrinsics.height // 3:2 * intrinsics.height // 3, intrinsics.width // 3:2 * intrinsics.width // 3] -= 100
+		depth[random.random_sample(depth.shape) < 0.05] = 0
+		depth_images.append(depth.astype(np.uint16))
+
+		angle = device * 2 * np.pi / devices
+		rotation_matrix = np.array([[np.cos(angle), -np.sin(angle), 0], [np.sin(angle), np.cos(angle), 0], [0, 0, 1]])
+		translation_vector = np.array([0.02 * device, -0.01 * device, -1.0])
+		transformations.append(Transformation(rotation_matrix, translation_vector))
+	return depth_images, transformations
+
+
+def cumulative_pointcloud_stacked(depth_images, intrinsics, transformations, roi_2d, depth_threshold=0.01):
+	"""
+	The point cloud collected the way calculate_cumulative_pointcloud did before the PointCloudAccumulator
+
+	"""
+	point_cloud_cumulative = np.array([-1, -1, -1]).transpose()
+	for (depth_image, transformation) in zip(depth_images, transformations):
+		point_cloud = np.asanyarray(convert_depth_frame_to_pointcloud(depth_image, intrinsics))
+		point_cloud = transformation.apply_transformation(point_cloud)
+		point_cloud = get_clipped_pointcloud(point_cloud, roi_2d)
+		point_cloud = point_cloud[:,point_cloud[2,:]<-depth_threshold]
+		point_cloud_cumulative = np.column_stack( ( point_cloud_cumulative, point_cloud ) )
+	return np.delete(point_cloud_cumulative, 0, 1)
+
+
+def cumulative_pointcloud_accumulated(depth_images, intrinsics, transformations, roi_2d, point_cloud_accumulator,
+									  depth_threshold=0.01):
+	point_cloud_accumulator.reset()
+	for (depth_image, transformation) in zip(depth_images, transformations):
+		point_cloud_accumulator.add(depth_image, intrinsics, transformation, roi_2d, depth_threshold)
+	return point_cloud_accumulator.pointcloud()
+
+
+def cumulative_pointcloud_parallel(depth_images, intrinsics, transformations, roi_2d, point_cloud_accumulator, executor,
+								   depth_threshold=0.01):
+	point_cloud_accumulator.reset()
+	futures = [executor.submit(point_cloud_accumulator.select, depth_image, intrinsics, transformation, roi_2d, depth_threshold,
+							   device)
+			   for (device, (depth_image, transformation)) in enumerate(zip(depth_images, transformations))]
+	for future in futures:
+		future.result()
+	point_cloud_accumulator.collect(list(range(len(depth_images))), executor)
+	return point_cloud_accumulator.pointcloud()
+
+
+def measure(collect, frames):
+	"""
+	Returns the mean time in milliseconds and the peak of the memory allocated in MB of collecting the point cloud
+	of one frame
+
+	"""
+	# The first frame allocates the buffers which are reused afterwards
+	collect()
+	start = time.perf_counter()
+	for frame in range(frames):
+		collect()
+	elapsed = (time.perf_counter() - start) / frames
+
+	tracemalloc.start()
+	collect()
+	peak = tracemalloc.get_traced_memory()[1]
+	tracemalloc.stop()
+	return 1000 * elapsed, peak / 1e6
+
+
+def run_benchmark(devices=4, frames=20, workers=0):
+	intrinsics = synthetic_intrinsics()
+	depth_images, transformations = synthetic_scene(devices, intrinsics)
+	roi_2d = [-0.3, 0.3, -0.3, 0.3]
+	point_cloud_accumulator = PointCloudAccumulator()
+	workers = workers or devices
+	executor = ThreadPoolExecutor(max_workers=workers)
+
+	stacked = cumulative_pointcloud_stacked(depth_images, intrinsics, transformations, roi_2d)
+	accumulated = cumulative_pointcloud_accumulated(depth_images, intrinsics, transformations, roi_2d,
+													point_cloud_accumulator)
+	assert stacked.shape == accumulated.shape
+	parallel = cumulative_pointcloud_parallel(depth_images, intrinsics, transformations, roi_2d, PointCloudAccumulator(),
+											  executor)
+	assert np.array_equal(parallel, accumulated)
+	print("%d devices %dx%d, %d points, largest difference %.2g m" % (
+		devices, intrinsics.width, intrinsics.height, accumulated.shape[1], np.abs(stacked - accumulated).max()))
+
+	for (name, collect) in (
+			("column_stack", lambda: cumulative_pointcloud_stacked(depth_images, intrinsics, transformations, roi_2d)),
+			("accumulator", lambda: cumulative_pointcloud_accumulated(depth_images, intrinsics, transformations, roi_2d,
+																	  point_cloud_accumulator)),
+			("%d threads" % workers,
+			 lambda: cumulative_pointcloud_parallel(depth_images, intrinsics, transformations, roi_2d, point_cloud_accumulator,
+													executor))):
+		elapsed, peak = measure(collect, frames)
+		print("%-12s %7.2f ms per frame, peak allocation %7.1f MB" % (name, elapsed, peak))
+	executor.shutdown()
+
+
+if __name__ == "__main__":
+	run_benchmark(*[int(argument) for argument in sys.argv[1:4]])
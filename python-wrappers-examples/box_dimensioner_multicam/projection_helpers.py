@@ -0,0 +1,176 @@
+##################################################################################################
+##       License: Apache 2.0. See LICENSE file in root directory.		                      ####
+##################################################################################################
+##                  Box Dimensioner with multiple cameras: Helper files 					  ####
+##################################################################################################
+
+# NumPy versions of rs2_transform_point_to_point and rs2_project_point_to_pixel for arrays of points
+import numpy as np
+
+from helper_functions import distortion_model_name
+
+
+def extrinsics_to_matrix(extrinsics):
+	"""
+	Get the rotation matrix and the translation vector of realsense extrinsics
+
+	Parameters:
+	-----------
+	extrinsics : rs.extrinsics
+				 The extrinsics, whose rotation is stored in column-major order
+
+	Return:
+	----------
+	rotation_matrix : array
+		(3,3) matrix
+	translation_vector : array
+		(3,) vector
+	"""
+	rotation_matrix = np.array(extrinsics.rotation, dtype=np.float64).reshape(3, 3).T
+	translation_vector = np.array(extrinsics.translation, dtype=np.float64)
+	return rotation_matrix, translation_vector
+
+
+def transform_points(extrinsics, points, out=None):
+	"""
+	Transform points from the coordinate system of one imager to another like rs2_transform_point_to_point
+
+	Parameters:
+	-----------
+	extrinsics : rs.extrinsics
+				 The extrinsics from the coordinate system of the points to the target coordinate system
+	points 	   : array
+				 (N,3) matrix with a point in every row
+	out 	   : array
+				 (N,3) matrix to write the transformed points in, may be points itself
+
+	Return:
+	----------
+	points_transformed : array
+		(N,3) matrix of the transformed points
+	"""
+	assert (points.ndim == 2 and points.shape[1] == 3)
+	rotation_matrix, translation_vector = extrinsics_to_matrix(extrinsics)
+	points_transformed = np.matmul(points, rotation_matrix.T.astype(points.dtype, copy=False), out=out)
+	points_transformed += translation_vector.astype(points_transformed.dtype, copy=False)
+	return points_transformed
+
+
+def distort_normalized_points(x, y, model, coeffs):
+	"""
+	Apply the lens distortion to normalized image coordinates the way rs2_project_point_to_pixel does
+
+	Parameters:
+	-----------
+	x, y   : array
+			 The normalized image coordinates point_x / point_z and point_y / point_z
+	model  : str
+			 Name of the distortion model: 'none', 'brown_conrady', 'modified_brown_conrady',
+			 'inverse_brown_conrady', 'ftheta' or 'kannala_brandt4'
+	coeffs : array
+			 The five distortion coefficients of the intrinsics
+
+	Return:
+	----------
+	x, y : array
+		The distorted normalized image coordinates
+	"""
+	[c0, c1, c2, c3, c4] = coeffs[:5]
+	if model in ('none', 'distortion_none'):
+		return x, y
+	if model in ('brown_conrady', 'modified_brown_conrady', 'inverse_brown_conrady'):
+		r2 = x*x + y*y
+		f = 1 + c0*r2 + c1*r2*r2 + c4*r2*r2*r2
+		if model == 'brown_conrady':
+			# The tangential distortion of the undistorted coordinates
+			return (x*f + 2*c2*x*y + c3*(r2 + 2*x*x),
+					y*f + 2*c3*x*y + c2*(r2 + 2*y*y))
+		# The tangential distortion of the radially distorted coordinates
+		x = x*f
+		y = y*f
+		return (x + 2*c2*x*y + c3*(r2 + 2*x*x),
+				y + 2*c3*x*y + c2*(r2 + 2*y*y))
+	if model in ('ftheta', 'kannala_brandt4'):
+		r = np.maximum(np.sqrt(x*x + y*y), np.finfo(np.float32).eps)
+		if model == 'ftheta':
+			rd = 1.0 / c0 * np.arctan(2 * r * np.tan(c0 / 2.0))
+		else:
+			theta = np.arctan(r)
+			theta2 = theta*theta
+			rd = theta * (1 + theta2*(c0 + theta2*(c1 + theta2*(c2 + theta2*c3))))
+		return x*rd/r, y*rd/r
+	raise ValueError("Projection with the distortion model " + model + " is not supported")
+
+
+def project_points_to_pixels(intrinsics, points):
+	"""
+	Project points to pixel coordinates like rs2_project_point_to_pixel
+
+	Parameters:
+	-----------
+	intrinsics : rs.intrinsics
+				 The intrinsics of the imager in whose coordinate system the points are given
+	points 	   : array
+				 (N,3) matrix with a point in every row, the points should be in front of the imager (Z > 0)
+
+	Return:
+	----------
+	pixels : array
+		(N,2) matrix of the pixel coordinates of the points
+	"""
+	assert (points.ndim == 2 and points.shape[1] == 3)
+	x = points[:,0] / points[:,2]
+	y = points[:,1] / points[:,2]
+	x, y = distort_normalized_points(x, y, distortion_model_name(intrinsics.model), list(intrinsics.coeffs))
+	pixels = np.empty((points.shape[0], 2), dtype=x.dtype)
+	pixels[:,0] = x*intrinsics.fx + intrinsics.ppx
+	pixels[:,1] = y*intrinsics.fy + intrinsics.ppy
+	return pixels
+
+
+"""
+  _____           _    _               
+ |_   _|___  ___ | |_ (_) _ __    __ _ 
+   | | / _ \/ __|| __|| || '_ \  / _` |
+   | ||  __/\__ \| |_ | || | | || (_| |
+   |_| \___||___/ \__||_||_| |_| \__, |
+                                  |___/ 
+
+"""
+if __name__ == "__main__":
+	# Compare the projection with the librealsense functions on fixed intrinsics of every distortion model
+	import pyrealsense2 as rs
+
+	extrinsics = rs.extrinsics()
+	angle = 0.05
+	extrinsics.rotation = [np.cos(angle), np.sin(angle), 0, -np.sin(angle), np.cos(angle), 0, 0, 0, 1]
+	extrinsics.translation = [0.015, -0.0002, 0.0004]
+
+	random = np.random.RandomState(0)
+	points = np.column_stack((random.uniform(-0.6, 0.6, 1000), random.uniform(-0.4, 0.4, 1000), random.uniform(0.3, 3.0, 1000)))
+
+	transformed = transform_points(extrinsics, points)
+	expected = np.array([rs.rs2_transform_point_to_point(extrinsics, point) for point in points.tolist()])
+	print("transform_points: largest difference %.3g m" % np.abs(transformed - expected).max())
+	assert np.allclose(transformed, expected, atol=1e-6)
+
+	for (model, coeffs) in ((rs.distortion.none, [0, 0, 0, 0, 0]),
+							(rs.distortion.brown_conrady, [0.12, -0.25, 0.001, -0.0015, 0.1]),
+							(rs.distortion.modified_brown_conrady, [0.12, -0.25, 0.001, -0.0015, 0.1]),
+							(rs.distortion.inverse_brown_conrady, [0.12, -0.25, 0.001, -0.0015, 0.1]),
+							(rs.distortion.ftheta, [0.9, 0, 0, 0, 0]),
+							(rs.distortion.kannala_brandt4, [-0.01, 0.03, -0.02, 0.004, 0])):
+		intrinsics = rs.intrinsics()
+		intrinsics.width = 1280
+		intrinsics.height = 720
+		intrinsics.ppx = 643.2
+		intrinsics.ppy = 361.7
+		intrinsics.fx = 921.4
+		intrinsics.fy = 920.9
+		intrinsics.model = model
+		intrinsics.coeffs = coeffs
+
+		pixels = project_points_to_pixels(intrinsics, transformed)
+		expected = np.array([rs.rs2_project_point_to_pixel(intrinsics, point) for point in transformed.tolist()])
+		print("project_points_to_pixels %s: largest difference %.3g pixels" % (distortion_model_name(model), np.abs(pixels - expected).max()))
+		assert np.allclose(pixels, expected, atol=1e-2)
@@ -5,6 +5,10 @@
 ##################################################################################################
 
 
+import threading
+import time
+from collections import deque
+
 import pyrealsense2 as rs
 import numpy as np
 
@@ -46,11 +50,140 @@ def enumerate_connected_devices(context):
     return connect_device
 
 
+# The depth post processing options of DepthFilterChain: (stage, option of the filter of the stage)
+DEPTH_FILTER_OPTIONS = {
+    'decimation_magnitude': ('decimation', rs.option.filter_magnitude),
+    'spatial_magnitude': ('spatial', rs.option.filter_magnitude),
+    'spatial_smooth_alpha': ('spatial', rs.option.filter_smooth_alpha),
+    'spatial_smooth_delta': ('spatial', rs.option.filter_smooth_delta),
+    'temporal_smooth_alpha': ('temporal', rs.option.filter_smooth_alpha),
+    'temporal_smooth_delta': ('temporal', rs.option.filter_smooth_delta),
+}
+
+
+class DepthFilterChain:
+    """
+    The decimation, spatial and temporal post processing filters of the depth stream of one device.
+
+    The filters are created once and reused for every frame, so the temporal filter averages over the
+    frames of the device. A frame passed in again, e.g. by two calibration steps working on the same
+    frameset, is not filtered a second time, the filtered frame of the first call is returned.
+
+    Attributes
+    ___________
+    options : dict
+              The options of the filters, keys of DEPTH_FILTER_OPTIONS
+    times   : list
+              Time in seconds spent in every stage since the last report
+    frames  : int
+              Number of frames filtered since the last report
+
+    Methods
+    _______
+    process(self, depth_frame):
+
+    set_options(self, **options):
+
+    reset(self):
+
+    report(self, reset=True):
+    """
+    def __init__(self, decimation_magnitude=1.0, spatial_magnitude=2.0, spatial_smooth_alpha=0.5,
+                 spatial_smooth_delta=20, temporal_smooth_alpha=0.4, temporal_smooth_delta=20):
+        self.options = {'decimation_magnitude': decimation_magnitude,
+                        'spatial_magnitude': spatial_magnitude,
+                        'spatial_smooth_alpha': spatial_smooth_alpha,
+                        'spatial_smooth_delta': spatial_smooth_delta,
+                        'temporal_smooth_alpha': temporal_smooth_alpha,
+                        'temporal_smooth_delta': temporal_smooth_delta}
+        self.stages = []
+        self._last_frame = None
+        self.reset()
+        self.times = [0.0] * len(self.stages)
+        self.frames = 0
+
+    def reset(self):
+        """
+        Drops the history of the temporal filter by creating the filters anew
+
+        """
+        self.stages = [('decimation', rs.decimation_filter()),
+                       ('spatial', rs.spatial_filter()),
+                       ('temporal', rs.temporal_filter())]
+        self._last_frame = None
+        self.set_options(**self.options)
+
+    def set_options(self, **options):
+        """
+        Change options of the filters in place, the history of the temporal filter is kept
+
+        Parameters:
+        -----------
+        options : double
+                  New values of options named like the arguments of the constructor
+        """
+        filters = dict(self.stages)
+        for (name, value) in options.items():
+            if name not in DEPTH_FILTER_OPTIONS:
+                raise ValueError("Unknown depth filter option " + name)
+            stage, option = DEPTH_FILTER_OPTIONS[name]
+            filters[stage].set_option(option, value)
+            self.options[name] = value
+
+    def process(self, depth_frame):
+        """
+        Filter a depth frame of the device
+
+        Parameters:
+        -----------
+        depth_frame : rs.frame()
+                      The depth frame to be post-processed
+
+        Return:
+        ----------
+        filtered_frame : rs.frame()
+                         The post-processed depth frame
+        """
+        # Post processing possible only on the depth_frame
+        assert (depth_frame.is_depth_frame())
+
+        frame_key = (depth_frame.get_frame_number(), depth_frame.get_timestamp())
+        if self._last_frame is not None and self._last_frame[0] == frame_key:
+            return self._last_frame[1]
+
+        filtered_frame = depth_frame
+        for (index, (name, depth_filter)) in enumerate(self.stages):
+            start = time.perf_counter()
+            filtered_frame = depth_filter.process(filtered_frame)
+            self.times[index] += time.perf_counter() - start
+        self.frames += 1
+        self._last_frame = (frame_key, filtered_frame)
+        return filtered_frame
+
+    def report(self, reset=True):
+        """
+        Returns the mean time per frame of every stage in milliseconds as one line of text
+
+        """
+        frames = max(self.frames, 1)
+        timings = ['%s %.2f ms' % (name, 1000 * total / frames)
+                   for ((name, _), total) in zip(self.stages, self.times)]
+        line = '%d frames, %s' % (self.frames, ', '.join(timings))
+        if reset:
+            self.times = [0.0] * len(self.stages)
+            self.frames = 0
+        return line
+
+
 def post_process_depth_frame(depth_frame, decimation_magnitude=1.0, spatial_magnitude=2.0, spatial_smooth_alpha=0.5,
                              spatial_smooth_delta=20, temporal_smooth_alpha=0.4, temporal_smooth_delta=20):
     """
     Filter the depth frame acquired using the Intel RealSense device
 
+    The filters are created for this one frame, so the temporal filter has no history to smooth with.
+    Streams of frames are filtered with the DepthFilterChain of their device, see
+    DeviceManager.get_depth_filter_chains
+
     Parameters:
     -----------
     depth_frame          : rs.frame()
@@ -73,33 +206,239 @@ def post_process_depth_frame(depth_frame, decimation_magnitude=1.0, spatial_magn
     filtered_frame : rs.frame()
                      The post-processed depth frame
     """
+    depth_filter_chain = DepthFilterChain(decimation_magnitude, spatial_magnitude, spatial_smooth_alpha,
+                                          spatial_smooth_delta, temporal_smooth_alpha, temporal_smooth_delta)
+    return depth_filter_chain.process(depth_frame)
 
-    # Post processing possible only on the depth_frame
-    assert (depth_frame.is_depth_frame())
 
-    # Available filters and control options for the filters
-    decimation_filter = rs.decimation_filter()
-    spatial_filter = rs.spatial_filter()
-    temporal_filter = rs.temporal_filter()
+def get_frames_of_streams(frameset, streams):
+    """
+    Split a frameset into its frames
 
-    filter_magnitude = rs.option.filter_magnitude
-    filter_smooth_alpha = rs.option.filter_smooth_alpha
-    filter_smooth_delta = rs.option.filter_smooth_delta
+    Parameters:
+    -----------
+    frameset : rs.composite_frame()
+               The frameset delivered by the pipeline of a device
+    streams  : [rs.stream_profile()]
+               The streams enabled on the device
 
-    # Apply the control parameters for the filter
-    decimation_filter.set_option(filter_magnitude, decimation_magnitude)
-    spatial_filter.set_option(filter_magnitude, spatial_magnitude)
-    spatial_filter.set_option(filter_smooth_alpha, spatial_smooth_alpha)
-    spatial_filter.set_option(filter_smooth_delta, spatial_smooth_delta)
-    temporal_filter.set_option(filter_smooth_alpha, temporal_smooth_alpha)
-    temporal_filter.set_option(filter_smooth_delta, temporal_smooth_delta)
+    Return:
+    ----------
+    frames : dict
+    keys  : rs.stream, or (rs.stream.infrared, index) for the infrared streams
+    values: rs.frame()
+    """
+    frames = {}
+    for stream in streams:
+        if (rs.stream.infrared == stream.stream_type()):
+            frame = frameset.get_infrared_frame(stream.stream_index())
+            key_ = (stream.stream_type(), stream.stream_index())
+        else:
+            frame = frameset.first_or_default(stream.stream_type())
+            key_ = stream.stream_type()
+        frames[key_] = frame
+    return frames
+
+
+class FrameCollector:
+    """
+    Collects the framesets of several devices and matches them in time, without polling.
+
+    A thread per device blocks in wait_for_frames of the pipeline of the device and appends the framesets
+    to the frame queue of the device, which keeps the newest queue_size framesets. A frameset of all the
+    devices is assembled as soon as every device has delivered one within tolerance milliseconds of the
+    others, framesets that are too old to be matched any more are dropped. The timestamps of different
+    devices can only be compared in the global time domain of librealsense, which the D400 cameras use by
+    default, or when all of them are stamped with the system time. Otherwise the newest frameset of every
+    device is taken as soon as each device has delivered one, without matching.
+
+    Attributes
+    ___________
+    tolerance : double
+                The largest difference in milliseconds between the timestamps of a matched frameset,
+                half the frame interval of the slowest stream by default
+    framesets : int
+                Number of framesets assembled since the last report
+    dropped   : dict
+                Number of framesets of every device dropped since the last report, either because the
+                frame queue of the device was full, the frameset was incomplete or it was not matched
+    max_skew  : double
+                The largest difference in milliseconds between the timestamps of an assembled frameset
+                since the last report
+    unmatched : int
+                Number of framesets assembled from the newest frames since the last report, because the
+                timestamps of the devices were not comparable
+
+    Methods
+    _______
+    start(self):
+
+    stop(self):
+
+    wait_for_frames(self, timeout=5000):
+
+    report(self, reset=True):
+    """
+    def __init__(self, devices, tolerance=None, queue_size=2, poll_timeout=1000):
+        """
+        Parameters:
+        -----------
+        devices      : dict
+                       The Device of every serial to collect the frames of, the pipelines must be started
+        tolerance    : double
+                       The largest difference in milliseconds between the timestamps of a matched frameset
+        queue_size   : int
+                       The number of framesets kept per device
+        poll_timeout : int
+                       Milliseconds a device thread waits for a frameset before checking for stop()
+        """
+        self._devices = dict(devices)
+        if tolerance is None:
+            fps = [stream.fps() for device in self._devices.values()
+                   for stream in device.pipeline_profile.get_streams()]
+            tolerance = 500.0 / min(fps) if fps else 0.0
+        self.tolerance = tolerance
+        self.poll_timeout = poll_timeout
+        self._queues = {serial: deque(maxlen=queue_size) for serial in self._devices}
+        # The timestamp domain of the last frameset of every device
+        self._domains = {}
+        self._condition = threading.Condition()
+        self._threads = []
+        self._running = False
+        self.framesets = 0
+        self.dropped = dict.fromkeys(self._devices, 0)
+        self.max_skew = 0.0
+        self._total_skew = 0.0
+        self.unmatched = 0
+
+    def start(self):
+        self._running = True
+        for (serial, device) in self._devices.items():
+            thread = threading.Thread(target=self._collect, args=(serial, device),
+                                      name='frames ' + serial, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _collect(self, serial, device):
+        streams = device.pipeline_profile.get_streams()
+        queue = self._queues[serial]
+        while self._running:
+            try:
+                frameset = device.pipeline.wait_for_frames(self.poll_timeout)
+            except RuntimeError:
+                # No frameset within the timeout
+                continue
+            with self._condition:
+                if frameset.size() != len(streams):
+                    self.dropped[serial] += 1
+                    continue
+                # The frameset outlives this call in the frame queue
+                frameset.keep()
+                if len(queue) == queue.maxlen:
+                    self.dropped[serial] += 1
+                self._domains[serial] = frameset.get_frame_timestamp_domain()
+                queue.append((frameset.get_timestamp(), get_frames_of_streams(frameset, streams)))
+                self._condition.notify_all()
+
+    def _assemble(self):
+        # Called holding the condition, returns None until every device has a frameset
+        if all(self._queues.values()) and not self._comparable_timestamps():
+            self.unmatched += 1
+            frames = {}
+            for (serial, queue) in self._queues.items():
+                self.dropped[serial] += len(queue) - 1
+                frames[serial] = queue.pop()[1]
+                queue.clear()
+            return frames
+        while all(self._queues.values()):
+            timestamps = {serial: queue[0][0] for (serial, queue) in self._queues.items()}
+            newest = max(timestamps.values())
+            stale = [serial for (serial, timestamp) in timestamps.items() if timestamp < newest - self.tolerance]
+            if not stale:
+                skew = newest - min(timestamps.values())
+                self.framesets += 1
+                self.max_skew = max(self.max_skew, skew)
+                self._total_skew += skew
+                return {serial: queue.popleft()[1] for (serial, queue) in self._queues.items()}
+            # A newer frameset of these devices may still match the newest one
+            for serial in stale:
+                self._queues[serial].popleft()
+                self.dropped[serial] += 1
+        return None
+
+    def _comparable_timestamps(self):
+        # The hardware clocks of different devices are not synchronized to each other
+        domains = set(self._domains.values())
+        return len(domains) == 1 and domains.pop() in (rs.timestamp_domain.global_time,
+                                                       rs.timestamp_domain.system_time)
+
+    def wait_for_frames(self, timeout=5000):
+        """
+        Wait for the next frameset of all the devices
 
-    # Apply the filters
-    filtered_frame = decimation_filter.process(depth_frame)
-    filtered_frame = spatial_filter.process(filtered_frame)
-    filtered_frame = temporal_filter.process(filtered_frame)
+        Parameters:
+        -----------
+        timeout : int
+                  Milliseconds to wait for the frameset, None waits until there is one
+
+        Return:
+        -----------
+        frames : dict
+        keys  : serial
+                Serial number of the device
+        values: dict
+                The frames of the device as returned by get_frames_of_streams,
+                None when the collector was stopped
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout / 1000.0
+        with self._condition:
+            while self._running:
+                frames = self._assemble()
+                if frames is not None:
+                    return frames
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise RuntimeError("Frames didn't arrive from all devices within " + str(timeout) + " ms")
+                self._condition.wait(remaining)
+        return None
+
+    def __iter__(self):
+        """
+        Yields the framesets of all the devices until the collector is stopped
+
+        """
+        while True:
+            frames = self.wait_for_frames(None)
+            if frames is None:
+                return
+            yield frames
 
-    return filtered_frame
+    def report(self, reset=True):
+        """
+        Returns the number of matched and unmatched framesets, the skew of the matched ones in milliseconds and
+        the dropped framesets of every device as one line of text
+
+        """
+        with self._condition:
+            mean_skew = self._total_skew / max(self.framesets, 1)
+            dropped = ', '.join('%s %d' % item for item in self.dropped.items())
+            line = '%d framesets, skew mean %.2f ms max %.2f ms, %d unmatched, dropped %s' % (
+                self.framesets, mean_skew, self.max_skew, self.unmatched, dropped)
+            if reset:
+                self.framesets = 0
+                self.unmatched = 0
+                self.dropped = dict.fromkeys(self._devices, 0)
+                self.max_skew = 0.0
+                self._total_skew = 0.0
+        return line
 
 
 """
@@ -132,6 +471,8 @@ class DeviceManager:
         self._enabled_devices = {}
         self._config = pipeline_configuration
         self._frame_counter = 0
+        self._depth_filter_chains = {}
+        self._frame_collector = None
 
     def enable_device(self, device_serial, enable_ir_emitter):
         """
@@ -155,6 +496,7 @@ class DeviceManager:
         sensor = pipeline_profile.get_device().first_depth_sensor()
         sensor.set_option(rs.option.emitter_enabled, 1 if enable_ir_emitter else 0)
         self._enabled_devices[device_serial] = (Device(pipeline, pipeline_profile))
+        self._depth_filter_chains[device_serial] = DepthFilterChain()
 
     def enable_all_devices(self, enable_ir_emitter=False):
         """
@@ -195,29 +537,42 @@ class DeviceManager:
 
     def poll_frames(self):
         """
-        Poll for frames from the enabled Intel RealSense devices. This will return at least one frame from each device. 
+        Wait for the next frames of the enabled Intel RealSense devices, one frameset from each device matched
+        in time by the FrameCollector of the devices.
         If temporal post processing is enabled, the depth stream is averaged over a certain amount of frames
         
         Parameters:
         -----------
+
+        Return:
+        -----------
+        frames : dict
+                 The frames of every device as returned by FrameCollector.wait_for_frames
+
+        Raises:
+        -----------
+        RuntimeError
+                 When not every device delivered a frameset within 5 seconds, e.g. because a device was
+                 disconnected. The collector keeps running, so polling again waits for the next frames
+        """
+        return self.get_frame_collector().wait_for_frames()
+
+    def get_frame_collector(self, tolerance=None, queue_size=2):
+        """
+        Get the FrameCollector of the enabled devices, which is started on the first call.
+        Devices enabled later are not collected.
+
+        Parameters:
+        -----------
+        tolerance  : double
+                     The largest difference in milliseconds between the timestamps of a matched frameset
+        queue_size : int
+                     The number of framesets kept per device
         """
-        frames = {}
-        while len(frames) < len(self._enabled_devices.items()) :
-            for (serial, device) in self._enabled_devices.items():
-                streams = device.pipeline_profile.get_streams()
-                frameset = device.pipeline.poll_for_frames() #frameset will be a pyrealsense2.composite_frame object
-                if frameset.size() == len(streams):
-                    frames[serial] = {}
-                    for stream in streams:
-                        if (rs.stream.infrared == stream.stream_type()):
-                            frame = frameset.get_infrared_frame(stream.stream_index())
-                            key_ = (stream.stream_type(), stream.stream_index())
-                        else:
-                            frame = frameset.first_or_default(stream.stream_type())
-                            key_ = stream.stream_type()
-                        frames[serial][key_] = frame
-
-        return frames
+        if self._frame_collector is None:
+            self._frame_collector = FrameCollector(self._enabled_devices, tolerance, queue_size)
+            self._frame_collector.start()
+        return self._frame_collector
 
     def get_depth_shape(self):
         """ 
@@ -285,7 +640,57 @@ class DeviceManager:
                 frameset[rs.stream.color].get_profile())
         return device_extrinsics
 
+    def get_depth_filter_chains(self):
+        """
+        Get the depth post processing filters of the enabled devices
+
+        Return:
+        -----------
+        depth_filter_chains : dict
+        keys  : serial
+                Serial number of the device
+        values: DepthFilterChain
+                The filters of the depth stream of the device, kept for as long as the device is enabled
+        """
+        return self._depth_filter_chains
+
+    def set_depth_filter_options(self, reset=True, **options):
+        """
+        Change the depth post processing options of all the enabled devices
+
+        Parameters:
+        -----------
+        reset   : bool
+                  Drop the history of the temporal filters, which was built up with the old options
+        options : double
+                  New values of options named like the arguments of DepthFilterChain
+        """
+        for depth_filter_chain in self._depth_filter_chains.values():
+            depth_filter_chain.set_options(**options)
+            if reset:
+                depth_filter_chain.reset()
+
+    def reset_depth_filters(self, device_serial=None):
+        """
+        Drop the history of the temporal depth filter of one device, or of all the enabled devices
+
+        """
+        for (serial, depth_filter_chain) in self._depth_filter_chains.items():
+            if device_serial is None or serial == device_serial:
+                depth_filter_chain.reset()
+
+    def report_depth_filters(self, reset=True):
+        """
+        Returns the mean time per frame of every depth filter stage of every device as lines of text
+
+        """
+        return '\n'.join('%s: %s' % (serial, depth_filter_chain.report(reset))
+                         for (serial, depth_filter_chain) in self._depth_filter_chains.items())
+
     def disable_streams(self):
+        if self._frame_collector is not None:
+            self._frame_collector.stop()
+            self._frame_collector = None
         self._config.disable_all_streams()
 
 
@@ -1,12 +1,13 @@
 #!/usr/bin/python
-import pyrealsense2 as rs
 import sys, getopt
-import asyncore
-import numpy as np
-import pickle
+import asyncio
 import socket
-import struct
-import cv2
+from ethersense_protocol import ping_message, parse_streams, read_message, split_message, decode_frame, clock, \
+    FramesetCollector, ProtocolError
+from ethersense_recording import FrameRecorder, camera_name
+from ethersense_clock import ClockClient, FrameSynchronizer
+from ethersense_mosaic import MosaicRenderer
+from ethersense_udp import FrameAssembler
 
 
 print('Number of arguments:', len(sys.argv), 'arguments.')
@@ -14,103 +15,193 @@ print('Argument List:', str(sys.argv))
 mc_ip_address = '224.0.0.1'
 local_ip_address = '192.168.0.1'
 port = 1024
+# frame datagrams of the udp transport arrive on this port
+udp_port = 1025
 chunk_size = 4096
+# the ping is repeated to keep the subscriptions alive, servers drop clients silent for 10 seconds
+ping_interval = 2.0
+# clock requests go out more often than pings, the servers answer them on the multicast port
+clock_interval = 0.5
+# framesets of different cameras further apart are not matched, in milliseconds
+sync_tolerance = 20.0
+# the mosaic window has room for this many cameras, every stream of a camera takes a tile
+cameras = 8
+
+usage = ('EtherSenseClient.py [-c depth codec] [-t tcp|udp] [-f fec group] [-s stream,stream...] [-p filters] '
+         '[-r recording directory]')
 
 def main(argv):
-    multi_cast_message(mc_ip_address, port, 'EtherSensePing')
+    # e.g. python3 EtherSenseClient.py -c rvl -t udp -f 8 -s depth,color -p decimation:filter_magnitude=4
+    try:
+        opts, args = getopt.getopt(argv, 'c:t:f:s:p:r:')
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(2)
+    opts = dict(opts)
+    streams = parse_streams(opts['-s']) if '-s' in opts else None
+    message = ping_message(opts.get('-c'), opts.get('-t'), opts.get('-f'), streams, opts.get('-p'))
+    mosaic = MosaicRenderer(tiles=cameras * len(streams or ['depth']))
+    mosaic.start()
+    # the frames as received, to be served again by EtherSenseReplay.py
+    recorder = FrameRecorder(opts['-r']) if '-r' in opts else None
+    try:
+        asyncio.run(run_client(message, opts.get('-t') == 'udp', mosaic=mosaic, recorder=recorder))
+    finally:
+        if recorder is not None:
+            recorder.close()
         
 
-#UDP client for each camera server 
-class ImageClient(asyncore.dispatcher):
-    def __init__(self, server, source):   
-        asyncore.dispatcher.__init__(self, server)
-        self.address = server.getsockname()[0]
+#client for each camera server 
+class ImageClient(object):
+    def __init__(self, source, synchronizer=None, mosaic=None, recorder=None):   
+        self.address = source[0]
         self.port = source[1]
-        self.buffer = bytearray()
-        self.windowName = self.port
-        # open cv window which is unique to the port 
-        cv2.namedWindow("window"+str(self.windowName))
-        self.remainingBytes = 0
+        # the connection, a replay server sends several cameras from one address
+        self.camera = '%s:%s' % (self.address, self.port)
+        # the cameras recorded from this connection, by the camera id of their frame headers
+        self.recorded = {}
+        self.framesets = FramesetCollector()
+        self.synchronizer = synchronizer
+        self.mosaic = mosaic
+        self.recorder = recorder
         self.frame_id = 0
-       
-    def handle_read(self):
-        if self.remainingBytes == 0:
-            # get the expected frame size
-            self.frame_length = struct.unpack('<I', self.recv(4))[0]
-            # get the timestamp of the current frame
-            self.timestamp = struct.unpack('<d', self.recv(8))
-            self.remainingBytes = self.frame_length
-        
-        # request the frame data until the frame is completely in buffer
-        data = self.recv(self.remainingBytes)
-        self.buffer += data
-        self.remainingBytes -= len(data)
-        # once the frame is fully recived, process/display it
-        if len(self.buffer) == self.frame_length:
-            self.handle_frame()
-
-    def handle_frame(self):
-        # convert the frame from string to numerical data
-        imdata = pickle.loads(self.buffer)
-        bigDepth = cv2.resize(imdata, (0,0), fx=2, fy=2, interpolation=cv2.INTER_NEAREST) 
-        cv2.putText(bigDepth, str(self.timestamp), (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (65536), 2, cv2.LINE_AA)
-        cv2.imshow("window"+str(self.windowName), bigDepth)
-        cv2.waitKey(1)
-        self.buffer = bytearray()
+
+    async def run(self, reader, writer):
+        while True:
+            # frames are read with readexactly, so headers and payloads always arrive complete
+            try:
+                header, header_bytes, payload = await read_message(reader)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                break
+            self.handle_message(header, header_bytes, payload)
+        writer.close()
+        self.close()
+
+    def close(self):
+        if self.mosaic is not None:
+            self.mosaic.remove(self.camera)
+        if self.synchronizer is not None:
+            self.synchronizer.remove(self.camera)
+        if self.recorder is not None:
+            for camera in self.recorded.values():
+                self.recorder.close(camera)
+
+    def handle_message(self, header, header_bytes, payload):
+        if self.recorder is not None:
+            # still encoded, on the client clock once the server clock is synchronized
+            estimator = self.synchronizer.clock(self.address) if self.synchronizer is not None else None
+            if estimator is not None and estimator.synchronized:
+                time = estimator.to_local(header.timestamp)
+            else:
+                time = clock()
+            camera = self.recorded.get(header.camera)
+            if camera is None:
+                camera = self.recorded[header.camera] = camera_name(self.address, header.camera)
+            self.recorder.write(camera, header_bytes, payload, time)
+        self.handle_frame(header, decode_frame(header, payload))
+
+    def handle_frame(self, header, imdata):
+        # the frames of a frameset arrive one after the other, display them once all are there
+        frameset = self.framesets.add(header, imdata)
+        if frameset is not None:
+            self.handle_frameset(*frameset)
+
+    def handle_frameset(self, frame_id, timestamp, frames):
+        self.timestamp = timestamp
+        if self.synchronizer is not None:
+            # on the clock of the client once the clock of the server is synchronized
+            local_time = self.synchronizer.add(self.camera, timestamp, frames, self.address)
+            if local_time is not None:
+                self.timestamp = local_time
+        # drawn by the render thread of the mosaic, receiving never waits for the GUI
+        if self.mosaic is not None:
+            self.mosaic.update(self.camera, '%.0f' % self.timestamp, frames)
         self.frame_id += 1
-    def readable(self):
-        return True
-
-    
-class EtherSenseClient(asyncore.dispatcher):
-    def __init__(self):
-        asyncore.dispatcher.__init__(self)
-        self.server_address = ('', 1024)
-        # create a socket for TCP connection between the client and server
-        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.socket.settimeout(5)
-        
-        self.bind(self.server_address) 	
-        self.listen(10)
 
-    def writable(self): 
-        return False # don't want write notifies
 
-    def readable(self):
-        return True
-        
-    def handle_connect(self):
-        print("connection recvied")
-
-    def handle_accept(self):
-        pair = self.accept()
-        #print(self.recv(10))
-        if pair is not None:
-            sock, addr = pair
-            print ('Incoming connection from %s' % repr(addr))
-            # when a connection is attempted, delegate image receival to the ImageClient 
-            handler = ImageClient(sock, addr)
+async def handle_connection(reader, writer, synchronizer=None, mosaic=None, recorder=None):
+    addr = writer.get_extra_info('peername')
+    print ('Incoming connection from %s' % repr(addr))
+    # when a connection is attempted, delegate image receival to the ImageClient 
+    await ImageClient(addr, synchronizer, mosaic, recorder).run(reader, writer)
+
+
+class DatagramClient(asyncio.DatagramProtocol):
+    """
+    Receives the frame datagrams of every server on one socket, with a FrameAssembler and an
+    ImageClient per server.
+    """
+    def __init__(self, synchronizer=None, mosaic=None, recorder=None):
+        self.cameras = {}
+        self.synchronizer = synchronizer
+        self.mosaic = mosaic
+        self.recorder = recorder
+
+    def datagram_received(self, data, addr):
+        camera = self.cameras.get(addr)
+        if camera is None:
+            print ('Incoming datagrams from %s' % repr(addr))
+            camera = self.cameras[addr] = (FrameAssembler(), ImageClient(addr, self.synchronizer, self.mosaic,
+                                                                          self.recorder))
+        assembler, client = camera
+        message = assembler.add(data)
+        if message is not None:
+            # every message holds a whole frameset
+            try:
+                frames = split_message(message)
+            except ProtocolError as error:
+                print(error)
+                return
+            for header, header_bytes, payload in frames:
+                # the message is a view into the assembler, which reuses it for the next frames
+                if header.codec.name == 'raw':
+                    payload = bytes(payload)
+                client.handle_message(header, header_bytes, payload)
+
+
+def datagram_socket(port):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    # room for the bursts of datagrams of several cameras
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+    sock.bind(('', port))
+    return sock
+
+
+async def run_client(message, use_udp=False, synchronizer=None, mosaic=None, recorder=None):
+    """
+    Pings the servers and hands their framesets to mosaic, a MosaicRenderer showing them. The framesets of
+    all cameras also go into synchronizer, which matches them in time, see ethersense_clock.py, and the
+    received frames into recorder, a FrameRecorder, see ethersense_recording.py.
+    """
+    loop = asyncio.get_event_loop()
+    synchronizer = synchronizer or FrameSynchronizer(sync_tolerance)
+    if use_udp:
+        await loop.create_datagram_endpoint(lambda: DatagramClient(synchronizer, mosaic, recorder),
+                                            sock=datagram_socket(udp_port))
+    _, clocks = await loop.create_datagram_endpoint(lambda: ClockClient(synchronizer, (mc_ip_address, port)),
+                                                    local_addr=('0.0.0.0', 0))
+    # listen before pinging, the servers connect back as soon as they receive the multicast message
+    server = await asyncio.start_server(
+        lambda reader, writer: handle_connection(reader, writer, synchronizer, mosaic, recorder), '', port)
+    async with server:
+        probes = 0
+        while True:
+            if probes % int(ping_interval / clock_interval) == 0:
+                multi_cast_message(mc_ip_address, port, message)
+            clocks.probe()
+            probes += 1
+            await asyncio.sleep(clock_interval)
+
 
 def multi_cast_message(ip_address, port, message):
     # send the multicast message
     multicast_group = (ip_address, port)
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    connections = {}
     try:
         # Send data to the multicast group
         print('sending "%s"' % message + str(multicast_group))
-        sent = sock.sendto(message.encode(), multicast_group)
-   
-        # defer waiting for a response using Asyncore
-        client = EtherSenseClient()
-        asyncore.loop()
-
-        # Look for responses from all recipients
-        
-    except socket.timeout:
-        print('timed out, no more responses')
+        sock.sendto(message.encode(), multicast_group)
     finally:
-        print(sys.stderr, 'closing socket')
         sock.close()
 
 if __name__ == '__main__':
@@ -0,0 +1,133 @@
+#!/usr/bin/python
+import sys, getopt
+import asyncio
+import socket
+from ethersense_protocol import parse_ping, clock, clock_reply, is_clock_message, restamp_header, ProtocolError
+from ethersense_recording import Recording
+
+
+mc_ip_address = '224.0.0.1'
+port = 1024
+
+usage = 'EtherSenseReplay.py [-x speed] [-s start time] [-l] <recording directory>'
+
+def main(argv):
+    # e.g. python3 EtherSenseReplay.py -x 2 recordings/field
+    try:
+        opts, args = getopt.getopt(argv, 'x:s:l')
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(2)
+    if len(args) != 1:
+        print(usage)
+        sys.exit(2)
+    opts = dict(opts)
+    recording = Recording(args[0])
+    if not recording.cameras:
+        print('no cameras recorded in %s' % args[0])
+        sys.exit(1)
+    speed = float(opts.get('-x', 1.0))
+    start = float(opts['-s']) if '-s' in opts else None
+    asyncio.run(serve(recording, speed, start, '-l' in opts))
+
+
+class ReplayServer(asyncio.DatagramProtocol):
+    """
+    Serves a recording made by EtherSenseClient.py -r like EtherSenseServer serves its camera, so
+    clients run without any camera present.
+
+    Every pinging client gets every recorded camera over a connection of its own, the frames exactly as
+    they were received, from the client clock time start on, at speed times the recorded rate, or as
+    fast as the client reads with speed 0. The frame timestamps are moved onto the clock of this host,
+    which answers the clock requests of the clients, so the cameras stay in step. The frame headers of each
+    camera carry its position in the recording as camera id, which tells the cameras apart at the client.
+    """
+    def __init__(self, recording, speed=1.0, start=None, repeat=False, client_port=port):
+        self.recording = recording
+        self.client_port = client_port
+        self.speed = speed
+        self.start = start
+        self.repeat = repeat
+        self.transport = None
+        self.clients = set()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        received = clock()
+        if is_clock_message(data):
+            try:
+                self.transport.sendto(clock_reply(data, received), addr)
+            except ProtocolError as error:
+                print(error)
+            return
+        try:
+            options = parse_ping(data)
+        except ProtocolError as error:
+            print(error)
+            return
+        # later pings only keep the client alive
+        if addr[0] in self.clients:
+            return
+        self.clients.add(addr[0])
+        asyncio.ensure_future(self.replay(addr, options))
+
+    async def replay(self, address, options):
+        if options['transport'] != 'tcp':
+            print('replaying to %s over tcp' % address[0])
+        print('replaying %s to %s as recorded' % (', '.join(self.recording.cameras), address[0]))
+        try:
+            # the cameras start together, from the first frame of the recording
+            first = [self.recording.time_range(camera)[0] for camera in self.recording.cameras]
+            origin = min(time for time in first if time is not None)
+            if self.start is not None:
+                origin = max(origin, self.start)
+            while True:
+                started = clock()
+                await asyncio.gather(*[self.replayCamera(address, camera, camera_id, origin, started)
+                                       for camera_id, camera in enumerate(self.recording.cameras)])
+                if not self.repeat:
+                    break
+        finally:
+            self.clients.discard(address[0])
+
+    async def replayCamera(self, address, camera, camera_id, origin, started):
+        try:
+            reader, writer = await asyncio.open_connection(address[0], self.client_port)
+        except OSError as error:
+            print('Exception occured: {}'.format(error))
+            return
+        sent = 0
+        try:
+            for time, header, header_bytes, payload in self.recording.frames(camera, self.start):
+                due = started + (time - origin) / self.speed if self.speed else clock()
+                delay = due - clock()
+                if delay > 0:
+                    await asyncio.sleep(delay / 1000.0)
+                writer.write(restamp_header(header_bytes, due, camera_id))
+                writer.write(payload)
+                await writer.drain()
+                sent += 1
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+        print('%s: replayed %d frames of %s' % (address[0], sent, camera))
+
+
+def multicast_socket(port):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(('', port))
+    return sock
+
+
+async def serve(recording, speed=1.0, start=None, repeat=False):
+    loop = asyncio.get_event_loop()
+    await loop.create_datagram_endpoint(lambda: ReplayServer(recording, speed, start, repeat),
+                                        sock=multicast_socket(port))
+    await loop.create_future()
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,140 +1,302 @@
 #!/usr/bin/python
 import pyrealsense2 as rs
 import sys, getopt
-import asyncore
+import asyncio
+import json
 import numpy as np
-import pickle
 import socket
-import struct
-import cv2
+from ethersense_protocol import parse_ping, parse_streams, clock, clock_reply, is_clock_message, ProtocolError, \
+    TRANSPORTS
+from ethersense_codecs import CODECS, negotiate_codec
+from ethersense_streaming import CameraPublisher, frame_key
+from ethersense_filters import FilterChain, DEFAULT_FILTERS
 
 
 print('Number of arguments:', len(sys.argv), 'arguments.')
 print('Argument List:', str(sys.argv))
 mc_ip_address = '224.0.0.1'
 port = 1024
+# clients asking for the udp transport receive the frame datagrams on this port
+udp_port = 1025
 chunk_size = 4096
+# the processing time of the filter chains is printed this often, in seconds
+report_interval = 30.0
 #rs.log_to_console(rs.log_severity.debug)
 
-def getDepthAndTimestamp(pipeline, depth_filter):
+def getFramesAndTimestamp(pipeline, depth_filters, streams, align=None):
     frames = pipeline.wait_for_frames()
     # take owner ship of the frame for further processing
     frames.keep()
-    depth = frames.get_depth_frame()
-    if depth:
-	depth2 = depth_filter.process(depth)
-	# take owner ship of the frame for further processing
-	depth2.keep()
-	# represent the frame as a numpy array
-        depthData = depth2.as_frame().get_data()        
-	depthMat = np.asanyarray(depthData)
-	ts = frames.get_timestamp()
-        return depthMat, ts
-    else:
+    images = {}
+    if 'depth' in streams:
+        depth = frames.get_depth_frame()
+        if depth:
+            # one depth frame for every filter chain in use
+            for chain in depth_filters:
+                depth2 = chain.process(depth)
+                # take owner ship of the frame for further processing
+                depth2.keep()
+                # represent the frame as a numpy array
+                images[frame_key('depth', chain.spec)] = np.asanyarray(depth2.as_frame().get_data())
+    if 'aligned_depth' in streams:
+        # full resolution depth in the pixel grid of the colour stream
+        aligned = align.process(frames)
+        aligned.keep()
+        aligned_depth = aligned.get_depth_frame()
+        if aligned_depth:
+            images['aligned_depth'] = np.asanyarray(aligned_depth.get_data())
+    if 'color' in streams:
+        color = frames.get_color_frame()
+        if color:
+            images['color'] = np.asanyarray(color.get_data())
+    if 'infrared' in streams:
+        infrared = frames.get_infrared_frame(1)
+        if infrared:
+            images['infrared'] = np.asanyarray(infrared.get_data())
+    if not images:
         return None, None
-def openPipeline():
+    return images, frames.get_timestamp()
+
+def openPipeline(streams=('depth',)):
     cfg = rs.config()
-    cfg.enable_stream(rs.stream.depth, 640, 480, rs.format.z16, 30)
+    if 'depth' in streams or 'aligned_depth' in streams:
+        cfg.enable_stream(rs.stream.depth, 640, 480, rs.format.z16, 30)
+    if 'color' in streams or 'aligned_depth' in streams:
+        cfg.enable_stream(rs.stream.color, 640, 480, rs.format.bgr8, 30)
+    if 'infrared' in streams:
+        cfg.enable_stream(rs.stream.infrared, 1, 640, 480, rs.format.y8, 30)
     pipeline = rs.pipeline()
     pipeline_profile = pipeline.start(cfg)
     sensor = pipeline_profile.get_device().first_depth_sensor()
+    # stamp the frames with the host clock, which the clients synchronize against
+    if sensor.supports(rs.option.global_time_enabled):
+        sensor.set_option(rs.option.global_time_enabled, 1)
     return pipeline
 
-class DevNullHandler(asyncore.dispatcher_with_send):
+def streamCodecs(streams, depth_codec, depth_filters):
+    # colour is always sent as JPEG, infrared with the depth codec as long as that is lossless
+    codecs = {}
+    for stream in streams:
+        if stream == 'color':
+            codecs[stream] = CODECS['jpeg']
+        elif stream == 'infrared' and not depth_codec.lossless:
+            codecs[stream] = CODECS['raw']
+        elif stream == 'depth':
+            # the depth filtered by the chain of the client
+            codecs[frame_key(stream, depth_filters.spec)] = depth_codec
+        else:
+            codecs[stream] = depth_codec
+    return codecs
 
-    def handle_read(self):
-        print(self.recv(1024))
+def loadConfig(path=None):
+    """
+    Reads a JSON config file, e.g. {"streams": ["depth", "color"], "filters": ["decimation:filter_magnitude=2",
+    "disparity", "spatial", "temporal", "depth"], "shared_memory": "ethersense"}, the filters are the
+    default chain of the clients. Returns the config with the defaults filled in.
+    """
+    config = {'streams': ['depth'], 'filters': DEFAULT_FILTERS, 'shared_memory': None,
+              'shared_memory_filters': 'none'}
+    if path is not None:
+        with open(path) as config_file:
+            config.update(json.load(config_file))
+    for key in ('filters', 'shared_memory_filters'):
+        if not isinstance(config[key], str):
+            config[key] = ','.join(config[key])
+    return config
 
-    def handle_close(self):
-        self.close()
-           
-		
-class EtherSenseServer(asyncore.dispatcher):
-    def __init__(self, address):
-        asyncore.dispatcher.__init__(self)
+class EtherSenseServer(object):
+    """
+    The camera of this server. Framesets are captured and filtered once and published to every
+    subscribed client, each client gets the streams it asked for, encoded with the codec it asked for.
+    The depth is filtered once per filter chain the clients asked for, a chain is built on first use
+    and kept, so its temporal filter keeps its history across frames and connections.
+    """
+    def __init__(self, streams=('depth',), idle_timeout=10.0, filters=DEFAULT_FILTERS):
         print("Launching Realsense Camera Server")
-	try:
-            self.pipeline = openPipeline()
-        except:
-            print("Unexpected error: ", sys.exc_info()[1])
-            sys.exit(1)
-        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.streams = streams
+        self.pipeline = openPipeline(streams)
+        self.align = rs.align(rs.stream.color) if 'aligned_depth' in streams else None
+
+        # the post processing of the clients that do not ask for filters of their own
+        self.default_filters = FilterChain(filters)
+        self.filter_chains = {self.default_filters.spec: self.default_filters}
+        # the number of subscriptions of every chain in use
+        self.chain_users = {}
+        self.publisher = CameraPublisher(self.read_frame, idle_timeout=idle_timeout)
+        self.connecting = set()
+        self._reporter = None
+
+    def read_frame(self):
+        # runs in the capture thread of the CameraPublisher, list copies the keys in one step
+        depth_filters = [self.filter_chains[spec] for spec in list(self.chain_users)]
+        return getFramesAndTimestamp(self.pipeline, depth_filters, self.streams, self.align)
+
+    def shareFrames(self, name, filters='none'):
+        """
+        Writes every frameset into the shared memory frame ring name for the processes on this machine,
+        with the depth filtered by the filters, full resolution by default. See ethersense_shm.py.
+        """
+        depth_filters = self.filterChain(filters)
+        self.chain_users[depth_filters.spec] = self.chain_users.get(depth_filters.spec, 0) + 1
+        keys = list(streamCodecs(self.streams, CODECS['raw'], depth_filters))
+        print('sharing %s with filters %s in shared memory %s' % (','.join(self.streams), depth_filters.spec,
+                                                                  name))
+        return self.publisher.subscribe_shared(name, keys)
+
+    def filterChain(self, spec):
+        """
+        Returns the chain of a client's filter spec, or the default chain when the spec is invalid.
+        """
+        try:
+            chain = FilterChain(spec)
+        except (ValueError, RuntimeError) as error:
+            print('invalid filters %s: %s, using %s' % (spec, error, self.default_filters.spec))
+            return self.default_filters
+        # the chain built first stays in use, with its temporal history
+        return self.filter_chains.setdefault(chain.spec, chain)
+
+    def handle_ping(self, address, options):
+        # a ping of a subscribed client only keeps its subscription alive
+        if self.publisher.touch(address[0]) or address[0] in self.connecting:
+            return
+        asyncio.ensure_future(self.connect(address, options))
+
+    async def connect(self, address, options):
         print('sending acknowledgement to', address)
-        
-	# reduce the resolution of the depth image using post processing
-        self.decimate_filter = rs.decimation_filter()
-        self.decimate_filter.set_option(rs.option.filter_magnitude, 2)
-        self.frame_data = ''
-        self.connect((address[0], 1024))
-        self.packet_id = 0        
-
-    def handle_connect(self):
+        codec = negotiate_codec(options['codec'], 'depth')
+        requested = parse_streams(options['streams'])
+        streams = [stream for stream in requested if stream in self.streams]
+        if len(streams) < len(requested):
+            print('streams %s are not enabled on this server' % ','.join(set(requested) - set(streams)))
+        if not streams:
+            return
+        transport = options['transport']
+        if transport not in TRANSPORTS:
+            print('transport %s is not available, sending over tcp' % transport)
+            transport = 'tcp'
+        self.connecting.add(address[0])
+        try:
+            if transport == 'udp':
+                loop = asyncio.get_event_loop()
+                datagrams, _ = await loop.create_datagram_endpoint(asyncio.DatagramProtocol,
+                                                                   remote_addr=(address[0], udp_port))
+            else:
+                reader, writer = await asyncio.open_connection(address[0], port)
+        except OSError as error:
+            print('Exception occured: {}'.format(error))
+            return
+        finally:
+            self.connecting.discard(address[0])
         print("connection received")
+        depth_filters = self.filterChain(options['filters']) if 'filters' in options else self.default_filters
+        print('sending %s with %s and filters %s to %s over %s' % (','.join(streams), codec.name,
+                                                                   depth_filters.spec, address[0], transport))
+        codecs = streamCodecs(streams, codec, depth_filters)
+        self.chain_users[depth_filters.spec] = self.chain_users.get(depth_filters.spec, 0) + 1
+        if self._reporter is None or self._reporter.done():
+            self._reporter = asyncio.ensure_future(self.reportFilters())
+        try:
+            if transport == 'udp':
+                subscription = self.publisher.subscribe_datagrams(address[0], datagrams, codecs,
+                                                                  parse_fec_group(options['fec']))
+            else:
+                subscription = self.publisher.subscribe(address[0], reader, writer, codecs)
+            await asyncio.wait([subscription.task])
+        finally:
+            self.chain_users[depth_filters.spec] -= 1
+            if not self.chain_users[depth_filters.spec]:
+                del self.chain_users[depth_filters.spec]
+        print('%s: sent %d frames, skipped %d frames' % (address[0], subscription.sent, subscription.dropped))
 
-    def writable(self):
-        return True
-
-    def update_frame(self):
-	depth, timestamp = getDepthAndTimestamp(self.pipeline, self.decimate_filter)
-        if depth is not None:
-	    # convert the depth image to a string for broadcast
-            data = pickle.dumps(depth)
-	    # capture the lenght of the data portion of the message	
-            length = struct.pack('<I', len(data))
-	    # include the current timestamp for the frame
-            ts = struct.pack('<d', timestamp)
-	    # for the message for transmission
-            self.frame_data = ''.join([length, ts, data])
-
-    def handle_write(self):
-	# first time the handle_write is called
-        if not hasattr(self, 'frame_data'):
-            self.update_frame()
-	# the frame has been sent in it entirety so get the latest frame
-        if len(self.frame_data) == 0:
-	    self.update_frame()
-        else:
-	    # send the remainder of the frame_data until there is no data remaining for transmition
-            remaining_size = self.send(self.frame_data)
-            self.frame_data = self.frame_data[remaining_size:]
-	
+    async def reportFilters(self):
+        # prints the time spent in every filter while the chains are in use
+        while self.chain_users:
+            await asyncio.sleep(report_interval)
+            for spec in list(self.chain_users):
+                print('filters %s' % self.filter_chains[spec].report())
+
+
+class MulticastServer(asyncio.DatagramProtocol):
+    def __init__(self, streams=('depth',), filters=DEFAULT_FILTERS):
+        self.streams = streams
+        self.filters = filters
+        self.server = None
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
 
-    def handle_close(self):
-        self.close()
-            
+    def datagram_received(self, data, addr):
+        received = clock()
+        if is_clock_message(data):
+            # answered whether or not the camera is open, the reply has to leave right away
+            try:
+                self.transport.sendto(clock_reply(data, received), addr)
+            except ProtocolError as error:
+                print(error)
+            return
+        try:
+            options = parse_ping(data)
+        except ProtocolError as error:
+            print(error)
+            return
+        # Once the server recives the first multicast signal, open the camera
+        if self.server is None:
+            print('Recived Multicast message %s bytes from %s' % (data, addr))
+            try:
+                self.server = EtherSenseServer(self.streams, filters=self.filters)
+            except RuntimeError as error:
+                print("Unexpected error: ", error)
+                return
+        self.server.handle_ping(addr, options)
 
-class MulticastServer(asyncore.dispatcher):
-    def __init__(self, host = mc_ip_address, port=1024):
-        asyncore.dispatcher.__init__(self)
-        server_address = ('', port)
-        self.create_socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.bind(server_address) 	
 
-    def handle_read(self):
-        data, addr = self.socket.recvfrom(42)
-        print('Recived Multicast message %s bytes from %s' % (data, addr))
-	# Once the server recives the multicast signal, open the frame server
-        EtherSenseServer(addr)
-        print(sys.stderr, data)
+def parse_fec_group(value):
+    try:
+        fec_group = int(value)
+    except ValueError:
+        fec_group = -1
+    if not 0 <= fec_group < 256:
+        print('invalid fec group %s, sending without parity' % value)
+        return 0
+    return fec_group
 
-    def writable(self): 
-        return False # don't want write notifies
 
-    def handle_close(self):
-        self.close()
+def multicast_socket(port):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(('', port))
+    return sock
 
-    def handle_accept(self):
-        channel, addr = self.accept()
-        print('received %s bytes from %s' % (data, addr))
+
+async def serve(streams, filters=DEFAULT_FILTERS, shared_memory=None, shared_memory_filters='none'):
+    # initalise the multicast receiver
+    loop = asyncio.get_event_loop()
+    multicast = MulticastServer(streams, filters)
+    if shared_memory:
+        # the local processes read without pinging, so the camera is opened right away
+        multicast.server = EtherSenseServer(streams, filters=filters)
+        multicast.server.shareFrames(shared_memory, shared_memory_filters)
+    await loop.create_datagram_endpoint(lambda: multicast, sock=multicast_socket(port))
+    await loop.create_future()
 
 
 def main(argv):
-    # initalise the multicast receiver 
-    server = MulticastServer()
-    # hand over excicution flow to asyncore
-    asyncore.loop()
-   
+    # e.g. python3 EtherSenseServer.py -c ethersense.json -m ethersense depth color aligned_depth
+    try:
+        opts, args = getopt.getopt(argv, 'c:m:')
+    except getopt.GetoptError:
+        print('EtherSenseServer.py [-c config file] [-m shared memory name] [stream...]')
+        sys.exit(2)
+    opts = dict(opts)
+    config = loadConfig(opts.get('-c'))
+    # the command line overrides the config file
+    if '-m' in opts:
+        config['shared_memory'] = opts['-m']
+    # the streams the camera captures
+    streams = parse_streams(','.join(args or config['streams']))
+    # hand over excicution flow to asyncio
+    asyncio.run(serve(streams, config['filters'], config['shared_memory'], config['shared_memory_filters']))
+
 if __name__ == '__main__':
     main(sys.argv[1:])
-
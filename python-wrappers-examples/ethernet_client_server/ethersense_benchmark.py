@@ -0,0 +1,685 @@
+#!/usr/bin/python
+import asyncio
+import multiprocessing
+import pickle
+import random
+import socket
+import shutil
+import struct
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+from ethersense_protocol import HEADER, FramesetCollector, frame_buffers, unpack_header, read_frame, read_message, \
+    decode_frame, unpack_frames, clock
+from ethersense_codecs import CODECS
+from ethersense_streaming import CameraPublisher
+from ethersense_udp import FrameAssembler
+from ethersense_clock import FrameSynchronizer
+from ethersense_mosaic import MosaicRenderer
+from ethersense_shm import SharedFramePublisher, SharedFrameReader, shared_memory
+from ethersense_recording import FrameRecorder, Recording
+from EtherSenseReplay import ReplayServer
+
+# Loopback throughput of the EtherSense frame transport and size and speed of the depth codecs,
+# no camera needed:
+#   python ethersense_benchmark.py [frames] [width] [height] [clients]
+
+
+def synthetic_depth(width, height, frame_id):
+    # a tilted plane with a moving box, close to what the decimated depth stream looks like
+    y, x = np.mgrid[0:height, 0:width]
+    depth = (1000 + 2 * y + x // 4).astype(np.uint16)
+    left = (frame_id * 3) % (width - 40)
+    depth[height // 3:height // 3 + 60, left:left + 40] = 700
+    return depth
+
+
+def send_pickle(sock, frames):
+    # the framing EtherSenseServer used before the binary protocol
+    for timestamp, depth in enumerate(frames):
+        data = pickle.dumps(depth)
+        frame_data = b''.join([struct.pack('<I', len(data)), struct.pack('<d', timestamp), data])
+        while len(frame_data):
+            sent = sock.send(frame_data)
+            frame_data = frame_data[sent:]
+
+
+def receive_pickle(sock, count):
+    for _ in range(count):
+        frame_length = struct.unpack('<I', recv_exactly(sock, 4))[0]
+        struct.unpack('<d', recv_exactly(sock, 8))
+        pickle.loads(recv_exactly(sock, frame_length))
+
+
+def recv_exactly(sock, size):
+    buffer = bytearray()
+    while len(buffer) < size:
+        data = sock.recv(size - len(buffer))
+        if not data:
+            raise EOFError("connection closed")
+        buffer += data
+    return buffer
+
+
+def advance_buffers(buffers, sent):
+    """
+    Drops the first sent bytes from a list of memoryviews without copying the remaining data.
+    """
+    while buffers and sent >= len(buffers[0]):
+        sent -= len(buffers[0])
+        buffers.pop(0)
+    if buffers and sent:
+        buffers[0] = buffers[0][sent:]
+    return buffers
+
+
+def send_buffers(sock, buffers):
+    """
+    Sends as much of the buffers as the socket accepts in one call, returns the number of bytes sent.
+    """
+    if hasattr(sock, 'sendmsg'):
+        return sock.sendmsg(buffers)
+    # sendmsg is not available on Windows
+    return sock.send(buffers[0])
+
+
+class FrameReceiver(object):
+    """
+    The blocking socket receiver of the binary framing, before the clients moved to asyncio.
+    Reassembles frames from a stream socket into preallocated buffers.
+
+    The header and the payload are received with recv_into and decoded with the codec named in
+    the header. Raw frames are handed out as a NumPy view on the payload buffer without copying,
+    the view is only valid until the next frame is received.
+    """
+    def __init__(self, initial_size=320 * 240 * 2):
+        self.header_buffer = bytearray(HEADER.size)
+        self.payload_buffer = bytearray(initial_size)
+        self.header = None
+        self._received = 0
+
+    def receive(self, sock):
+        """
+        Receives the available bytes, returns (header, frame) once a frame is complete, otherwise None.
+        Raises EOFError when the peer closed the connection.
+        """
+        if self.header is None:
+            view = memoryview(self.header_buffer)[self._received:]
+            count = sock.recv_into(view)
+            if count == 0:
+                raise EOFError("connection closed")
+            self._received += count
+            if self._received < HEADER.size:
+                return None
+            self.header = unpack_header(self.header_buffer)
+            self._received = 0
+            if len(self.payload_buffer) < self.header.payload_length:
+                self.payload_buffer = bytearray(self.header.payload_length)
+            if self.header.payload_length:
+                return None
+        else:
+            view = memoryview(self.payload_buffer)[self._received:self.header.payload_length]
+            count = sock.recv_into(view)
+            if count == 0:
+                raise EOFError("connection closed")
+            self._received += count
+            if self._received < self.header.payload_length:
+                return None
+
+        header = self.header
+        self.header = None
+        self._received = 0
+        payload = memoryview(self.payload_buffer)[:header.payload_length]
+        return header, header.codec.decode(payload, header.dtype, header.shape)
+
+
+def send_binary(sock, frames):
+    for frame_id, depth in enumerate(frames):
+        buffers = frame_buffers(depth, float(frame_id), frame_id)
+        while buffers:
+            advance_buffers(buffers, send_buffers(sock, buffers))
+
+
+def receive_binary(sock, count):
+    receiver = FrameReceiver()
+    received = 0
+    while received < count:
+        if receiver.receive(sock) is not None:
+            received += 1
+
+
+def measure_codec(codec, frames):
+    """
+    Returns the mean payload bytes per frame, encode and decode milliseconds per frame and the largest
+    depth error relative to the depth.
+    """
+    encode_seconds = decode_seconds = 0.0
+    total_bytes = 0
+    max_error = 0.0
+    for depth in frames:
+        start = time.perf_counter()
+        payload = memoryview(codec.encode(depth)).cast('B')
+        encoded = time.perf_counter()
+        decoded = codec.decode(payload, depth.dtype, depth.shape)
+        encode_seconds += encoded - start
+        decode_seconds += time.perf_counter() - encoded
+        total_bytes += len(payload)
+        valid = depth > 0
+        error = np.abs(decoded[valid].astype(np.float64) - depth[valid]) / depth[valid]
+        max_error = max(max_error, error.max() if len(error) else 0.0)
+    count = len(frames)
+    return total_bytes / count, 1000 * encode_seconds / count, 1000 * decode_seconds / count, max_error
+
+
+def synthetic_color(depth):
+    # a colour image of the scene, so a frameset carries two different streams
+    gray = (depth // 8).astype(np.uint8)
+    return np.dstack((gray, 255 - gray, gray // 2))
+
+
+def decimate(frame):
+    height, width = frame.shape
+    return frame.reshape(height // 2, 2, width // 2, 2).mean(axis=(1, 3)).astype(np.uint16)
+
+
+class SyntheticCamera(object):
+    """
+    Blocking frameset source replaying synthetic frames at a fixed rate, like pipeline.wait_for_frames.
+    The depth is decimated by 2 like the depth stream of EtherSenseServer, colour keeps the full size.
+    """
+    def __init__(self, frames, fps, streams=('depth',)):
+        self.frames = frames
+        self.period = 1.0 / fps
+        self.streams = streams
+        self.frame_id = 0
+        self.next_time = None
+
+    def read_frame(self):
+        now = time.perf_counter()
+        # like a camera, frames that were not picked up in time are lost rather than delivered late
+        if self.next_time is None or now - self.next_time > self.period:
+            self.next_time = now
+        self.next_time += self.period
+        delay = self.next_time - now
+        if delay > 0:
+            time.sleep(delay)
+        frame = self.frames[self.frame_id % len(self.frames)]
+        frames = {}
+        if 'depth' in self.streams:
+            frames['depth'] = decimate(frame)
+        if 'color' in self.streams:
+            frames['color'] = synthetic_color(frame)
+        self.frame_id += 1
+        return frames, float(self.frame_id - 1)
+
+
+def expected_depth(frames):
+    return [decimate(frame) for frame in frames]
+
+
+def check_frameset(frameset, expected, streams):
+    """
+    Returns True when a received frameset has all streams and the depth is the synthetic depth.
+    """
+    _, timestamp, frames = frameset
+    if sorted(frames) != sorted(streams):
+        return False
+    height, width = expected[0].shape
+    # colour is sent as JPEG, only its size can be checked
+    if 'color' in frames and frames['color'].shape != (2 * height, 2 * width, 3):
+        return False
+    return 'depth' not in frames or np.array_equal(frames['depth'], expected[int(timestamp) % len(expected)])
+
+
+def run_clients(address, frames, clients, duration, slow_fps, streams, results):
+    """
+    Client process of the fan-out load test: reads framesets on many concurrent connections, the first
+    one at slow_fps only, and checks every frameset against the synthetic source.
+    """
+    expected = expected_depth(frames)
+
+    async def client(delay):
+        reader, writer = await asyncio.open_connection(*address)
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + duration
+        collector = FramesetCollector()
+        received = corrupt = 0
+        while loop.time() < deadline:
+            frameset = collector.add(*await read_frame(reader))
+            if frameset is None:
+                continue
+            received += 1
+            if not check_frameset(frameset, expected, streams):
+                corrupt += 1
+            if delay:
+                await asyncio.sleep(delay)
+        writer.close()
+        return received, corrupt
+
+    async def run():
+        delays = [1.0 / slow_fps] + [0] * (clients - 1)
+        return await asyncio.gather(*[client(delay) for delay in delays])
+
+    results.put(asyncio.run(run()))
+
+
+async def fan_out(frames, clients, duration, codecs, fps=30, slow_fps=5):
+    """
+    Serves one synthetic camera through a CameraPublisher to clients connections opened by a client
+    process, codecs is a dictionary of codecs by stream name. Returns the server CPU seconds, framesets
+    captured, (received, corrupt) per client and (sent, skipped) per subscription.
+    """
+    streams = list(codecs)
+    publisher = CameraPublisher(SyntheticCamera(frames, fps, streams).read_frame, idle_timeout=None)
+    subscriptions = []
+
+    async def subscribe(reader, writer):
+        subscriptions.append(publisher.subscribe(writer.get_extra_info('peername'), reader, writer, codecs))
+
+    server = await asyncio.start_server(subscribe, '127.0.0.1', 0)
+    address = server.sockets[0].getsockname()
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=run_clients, args=(address, frames, clients, duration, slow_fps, streams,
+                                                                    results))
+    process.start()
+
+    loop = asyncio.get_event_loop()
+    while len(subscriptions) < clients:
+        await asyncio.sleep(0.01)
+    cpu_start = time.process_time()
+    captured_start = publisher.captured
+    await asyncio.sleep(duration)
+    cpu = time.process_time() - cpu_start
+    captured = publisher.captured - captured_start
+    received = await loop.run_in_executor(None, results.get)
+    await loop.run_in_executor(None, process.join)
+
+    publisher.close()
+    server.close()
+    await server.wait_closed()
+    return cpu, captured, received, [(subscription.sent, subscription.dropped) for subscription in subscriptions]
+
+
+class LossyTransport(object):
+    """
+    Shim around a datagram transport dropping a fraction of the datagrams and reordering the others
+    within a window of reorder datagrams.
+    """
+    def __init__(self, transport, loss, reorder=16, seed=0):
+        self.transport = transport
+        self.loss = loss
+        self.reorder = reorder
+        self.random = random.Random(seed)
+        self.held = []
+
+    def sendto(self, datagram):
+        if self.random.random() < self.loss:
+            return
+        self.held.append(bytes(datagram))
+        if len(self.held) > self.reorder:
+            self.transport.sendto(self.held.pop(self.random.randrange(len(self.held))))
+
+    def get_write_buffer_size(self):
+        return self.transport.get_write_buffer_size()
+
+    def is_closing(self):
+        return self.transport.is_closing()
+
+    def close(self):
+        self.transport.close()
+
+
+class AssemblingReceiver(asyncio.DatagramProtocol):
+    def __init__(self, expected, streams):
+        self.expected = expected
+        self.streams = streams
+        self.assembler = FrameAssembler()
+        self.delivered = 0
+        self.corrupt = 0
+
+    def datagram_received(self, data, addr):
+        message = self.assembler.add(data)
+        if message is not None:
+            collector = FramesetCollector()
+            framesets = [collector.add(header, frame) for header, frame in unpack_frames(message)]
+            self.delivered += 1
+            if not check_frameset(framesets[-1] or (None, None, {}), self.expected, self.streams):
+                self.corrupt += 1
+
+
+async def lossy_datagrams(frames, duration, loss, fec_group, codecs, fps=30):
+    """
+    Streams a synthetic camera over loopback UDP through a LossyTransport. Returns the framesets sent and
+    the AssemblingReceiver.
+    """
+    loop = asyncio.get_event_loop()
+    streams = list(codecs)
+    expected = expected_depth(frames)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+    sock.bind(('127.0.0.1', 0))
+    receiver_transport, receiver = await loop.create_datagram_endpoint(
+        lambda: AssemblingReceiver(expected, streams), sock=sock)
+    transport, _ = await loop.create_datagram_endpoint(asyncio.DatagramProtocol,
+                                                       remote_addr=sock.getsockname())
+    publisher = CameraPublisher(SyntheticCamera(frames, fps, streams).read_frame, idle_timeout=None)
+    subscription = publisher.subscribe_datagrams('receiver', LossyTransport(transport, loss), codecs, fec_group)
+    await asyncio.sleep(duration)
+    publisher.close()
+    await asyncio.wait([subscription.task])
+    receiver_transport.close()
+    return subscription.sent, receiver
+
+
+class SkewedClock(object):
+    """
+    A server clock running off the true time by offset ms and drift parts per million.
+    """
+    def __init__(self, offset, drift):
+        self.offset = offset
+        self.drift = drift
+
+    def time(self, true_time):
+        return true_time * (1.0 + self.drift * 1e-6) + self.offset
+
+
+def simulate_clock_sync(cameras, duration, tolerance=20.0, interval=500.0, seed=0):
+    """
+    Runs clock exchanges and 30 frames/s cameras against skewed server clocks on simulated time, the client
+    clock is the true time. The network delay is 0.2 ms plus an exponential queueing delay of 2 ms mean on
+    either way. Returns the largest error of the mapped frame timestamps after the first 10 s, the largest
+    error of the final drift estimates, the share of nearest calls matching every camera and the share of
+    matched frames that were not the nearest in true time.
+    """
+    rng = random.Random(seed)
+    clocks = [SkewedClock(rng.uniform(-5e3, 5e3), rng.uniform(-50, 50)) for _ in range(cameras)]
+    phases = [rng.uniform(0, 1000.0 / 30) for _ in range(cameras)]
+    synchronizer = FrameSynchronizer(tolerance)
+
+    def delay():
+        return 0.2 + rng.expovariate(1 / 2.0)
+
+    events = [(probe * interval, 'probe', camera) for camera in range(cameras)
+              for probe in range(int(duration / interval))]
+    events += [(phases[camera] + frame * 1000.0 / 30, 'frame', camera) for camera in range(cameras)
+               for frame in range(int(duration * 30 / 1000.0))]
+    events.sort()
+    mapping_error = 0.0
+    calls = complete = matches = wrong = 0
+    for true_time, kind, camera in events:
+        server = clocks[camera]
+        if kind == 'probe':
+            received = true_time + delay()
+            transmitted = received + 0.05
+            synchronizer.clock(camera).add(true_time, server.time(received), server.time(transmitted),
+                                           transmitted + delay())
+            continue
+        # the frames are the true capture time, so the matches can be checked
+        local_time = synchronizer.add(camera, server.time(true_time), true_time)
+        if local_time is None or true_time < 10000.0:
+            continue
+        mapping_error = max(mapping_error, abs(local_time - true_time))
+        reference, matched = synchronizer.nearest()
+        calls += 1
+        complete += len(matched) == cameras
+        for other, (_, captured) in matched.items():
+            history = [frames for _, frames in synchronizer.framesets[other]]
+            matches += 1
+            wrong += captured != min(history, key=lambda frames: abs(frames - reference))
+    drift_error = max(abs(synchronizer.clock(camera).drift * 1e6 - clocks[camera].drift)
+                      for camera in range(cameras))
+    return mapping_error, drift_error, complete / max(calls, 1), wrong / max(matches, 1)
+
+
+def measure_mosaic(frames, cameras, streams, count=100):
+    """
+    Composes a mosaic of cameras synthetic cameras without a window, returns the milliseconds per update
+    call of a receive handler and per composed mosaic with a new frameset from every camera.
+    """
+    camera = SyntheticCamera(frames, 1e6, streams)
+    framesets = [camera.read_frame()[0] for _ in range(len(frames))]
+    mosaic = MosaicRenderer(tiles=cameras * len(streams))
+    update = compose = 0.0
+    for index in range(count):
+        start = time.perf_counter()
+        for camera in range(cameras):
+            mosaic.update('camera%d' % camera, str(index), framesets[(index + camera) % len(framesets)])
+        update += time.perf_counter() - start
+        start = time.perf_counter()
+        mosaic.compose()
+        compose += time.perf_counter() - start
+    return 1000 * update / (count * cameras), 1000 * compose / count
+
+
+def read_shared(name, duration, copy, results):
+    # reader process of measure_shared_memory, every frameset carries its sequence in its first depth row
+    reader = SharedFrameReader(name)
+    read = torn = 0
+    end = time.perf_counter() + duration
+    while time.perf_counter() < end:
+        frameset = reader.wait(timeout=0.1)
+        if frameset is None:
+            continue
+        frames = frameset.copy() if copy else frameset.frames
+        if frames is None or (copy and not np.all(frames['depth'][0] == frameset.sequence & 0xffff)):
+            torn += 1
+        read += 1
+        del frames, frameset
+    results.put((read, torn, reader.skipped))
+    reader.close()
+
+
+def measure_shared_memory(frames, readers, duration, fps, copy):
+    """
+    Publishes synthetic depth and colour framesets at fps into a shared memory ring read by readers
+    processes, which copy the frames or only look at the views. Returns the framesets published and
+    (read, torn, skipped) per reader.
+    """
+    camera = SyntheticCamera(frames, 1e6, ('depth', 'color'))
+    framesets = [camera.read_frame()[0] for _ in range(len(frames))]
+    name = 'ethersense_benchmark_%d' % random.randrange(1 << 30)
+    shared = SharedFramePublisher(name, framesets[0], slots=4)
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=read_shared, args=(name, duration, copy, results))
+                 for _ in range(readers)]
+    for process in processes:
+        process.start()
+    # the readers attach while the first framesets go out
+    published = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration + 0.5:
+        frameset = framesets[published % len(framesets)]
+        frameset['depth'][0] = (shared.sequence + 1) & 0xffff
+        shared.publish(frameset, float(published))
+        published += 1
+        delay = start + published / fps - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+    counts = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    shared.close()
+    return published, counts
+
+
+async def record_and_replay(frames, duration, directory, speeds, codecs):
+    """
+    Records duration seconds of a synthetic camera received over loopback TCP, then replays the recording
+    at every speed in speeds to a loopback client. Returns the (frames, bytes, seconds) recorded and the
+    (framesets, seconds, corrupt) of every replay.
+    """
+    streams = list(codecs)
+    expected = expected_depth(frames)
+    recorder = FrameRecorder(directory, segment_size=256 * 1024)
+    publisher = CameraPublisher(SyntheticCamera(frames, 30, streams).read_frame, idle_timeout=None)
+    subscriptions = []
+
+    async def record(reader, writer):
+        # what EtherSenseClient.py -r does with every frame
+        while True:
+            try:
+                header, header_bytes, payload = await read_message(reader)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                break
+            recorder.write('camera', header_bytes, payload, clock())
+        writer.close()
+
+    server = await asyncio.start_server(lambda reader, writer: subscriptions.append(
+        publisher.subscribe('recorder', reader, writer, codecs)), '127.0.0.1', 0)
+    reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname())
+    recording = asyncio.ensure_future(record(reader, writer))
+    start = time.perf_counter()
+    await asyncio.sleep(duration)
+    publisher.close()
+    await recording
+    recorded = (recorder.frames, recorder.bytes, time.perf_counter() - start)
+    recorder.close()
+    server.close()
+
+    replays = []
+    for speed in speeds:
+        received = []
+
+        async def receive(reader, writer):
+            collector = FramesetCollector()
+            while True:
+                try:
+                    header, _, payload = await read_message(reader)
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                frameset = collector.add(header, decode_frame(header, payload))
+                if frameset is not None:
+                    # the replay moves the timestamps, the frame ids still count the synthetic frames
+                    frame_id, _, frames = frameset
+                    received.append(check_frameset((frame_id, frame_id, frames), expected, streams))
+            writer.close()
+
+        client = await asyncio.start_server(receive, '127.0.0.1', 0)
+        replay = ReplayServer(Recording(directory), speed, client_port=client.sockets[0].getsockname()[1])
+        start = time.perf_counter()
+        await replay.replay(('127.0.0.1', 0), {'transport': 'tcp'})
+        await asyncio.sleep(0.1)
+        replays.append((len(received), time.perf_counter() - start, received.count(False)))
+        client.close()
+    return recorded, replays
+
+
+def measure(sender, receiver, frames):
+    server, client = socket.socketpair()
+    thread = threading.Thread(target=sender, args=(server, frames))
+    start = time.perf_counter()
+    thread.start()
+    receiver(client, len(frames))
+    elapsed = time.perf_counter() - start
+    thread.join()
+    server.close()
+    client.close()
+    return elapsed
+
+
+def main(argv):
+    count = int(argv[0]) if len(argv) > 0 else 500
+    width = int(argv[1]) if len(argv) > 1 else 320
+    height = int(argv[2]) if len(argv) > 2 else 240
+    clients = int(argv[3]) if len(argv) > 3 else 32
+    frames = [synthetic_depth(width, height, i) for i in range(count)]
+    megabytes = sum(frame.nbytes for frame in frames) / 1e6
+
+    for name, sender, receiver in (('pickle', send_pickle, receive_pickle),
+                                   ('binary', send_binary, receive_binary)):
+        elapsed = measure(sender, receiver, frames)
+        print('%-8s %8.1f frames/s %8.1f MB/s' % (name, count / elapsed, megabytes / elapsed))
+
+    print()
+    print('%-14s %12s %8s %10s %10s %10s' % ('codec', 'bytes/frame', 'ratio', 'encode ms', 'decode ms', 'max error'))
+    raw_bytes = frames[0].nbytes
+    for name, codec in sorted(CODECS.items()):
+        # jpeg only carries the colour stream
+        if not codec.depth:
+            continue
+        size, encode_ms, decode_ms, max_error = measure_codec(codec, frames)
+        print('%-14s %12d %8.2f %10.2f %10.2f %10.4f' % (name, size, raw_bytes / size, encode_ms, decode_ms,
+                                                          max_error))
+
+    print()
+    duration = 3.0
+    codecs = {'depth': CODECS['delta_zlib'], 'color': CODECS['jpeg']}
+    full_frames = [synthetic_depth(2 * width, 2 * height, i) for i in range(30)]
+    print('one synthetic camera at 30 framesets/s, depth %s and color %s, %.0f s per run, '
+          'client 0 reads at 5 framesets/s' % (codecs['depth'].name, codecs['color'].name, duration))
+    print('%8s %12s %10s %16s %10s %10s' % ('clients', 'server cpu', 'captured', 'framesets/client', 'skipped',
+                                            'corrupt'))
+    count = 1
+    while count <= clients:
+        cpu, captured, received, subscriptions = asyncio.run(fan_out(full_frames, count, duration, codecs))
+        counts = [frames for frames, _ in received]
+        fast = counts[1:] or counts
+        print('%8d %11.1f%% %10d %16.1f %10d %10d' % (
+            count, 100 * cpu / duration, captured, sum(fast) / len(fast),
+            sum(skipped for _, skipped in subscriptions), sum(corrupt for _, corrupt in received)))
+        count *= 2
+
+    print()
+    codecs = {'depth': CODECS['raw']}
+    print('udp over loopback with datagram loss and reordering, raw depth, %.0f s per run' % duration)
+    print('%8s %8s %10s %10s %10s %10s' % ('loss', 'fec', 'sent', 'delivered', 'recovered', 'corrupt'))
+    for loss in (0.0, 0.001, 0.01, 0.05):
+        for fec_group in (0, 8, 4):
+            sent, receiver = asyncio.run(lossy_datagrams(full_frames, duration, loss, fec_group, codecs))
+            print('%7.1f%% %8s %10d %9.1f%% %10d %10d' % (
+                100 * loss, fec_group or '-', sent, 100.0 * receiver.delivered / max(sent, 1),
+                receiver.assembler.recovered, receiver.corrupt))
+
+    print()
+    print('mosaic of synthetic cameras, 320x240 tiles')
+    print('%8s %16s %12s %12s' % ('cameras', 'streams', 'update ms', 'compose ms'))
+    for cameras in (1, 8):
+        for streams in (('depth',), ('depth', 'color')):
+            update_ms, compose_ms = measure_mosaic(full_frames, cameras, streams)
+            print('%8d %16s %12.4f %12.2f' % (cameras, ','.join(streams), update_ms, compose_ms))
+
+    print()
+    if shared_memory is None:
+        print('shared memory frames need Python 3.8 or newer')
+    else:
+        print('shared memory ring of 4 slots, full resolution depth and colour, %.0f s per run' % duration)
+        print('%8s %8s %8s %10s %10s %10s %10s' % ('fps', 'readers', 'mode', 'published', 'read/reader',
+                                                  'skipped', 'torn'))
+        for fps, readers, copy in ((30, 4, True), (1000, 1, True), (1000, 4, False)):
+            published, counts = measure_shared_memory(full_frames, readers, duration, fps, copy)
+            print('%8d %8d %8s %10d %10.0f %10d %10d' % (
+                fps, readers, 'copy' if copy else 'view', published, sum(read for read, _, _ in counts) / readers,
+                sum(skipped for _, _, skipped in counts), sum(torn for _, torn, _ in counts)))
+
+    print()
+    directory = tempfile.mkdtemp(prefix='ethersense_recording_')
+    try:
+        codecs = {'depth': CODECS['delta_zlib'], 'color': CODECS['jpeg']}
+        recorded, replays = asyncio.run(record_and_replay(full_frames, duration, directory, (1.0, 4.0, 0),
+                                                          codecs))
+        frames, size, seconds = recorded
+        print('recorded %d frames of depth and colour in %.1f s, %.1f kB/frame, %.2f MB/s to disk' % (
+            frames, seconds, size / 1e3 / max(frames, 1), size / 1e6 / seconds))
+        print('%8s %10s %10s %12s %10s' % ('speed', 'framesets', 'seconds', 'framesets/s', 'corrupt'))
+        for speed, (framesets, seconds, corrupt) in zip((1.0, 4.0, 0), replays):
+            print('%8s %10d %10.2f %12.1f %10d' % ('%gx' % speed if speed else 'max', framesets, seconds,
+                                                    framesets / seconds, corrupt))
+    finally:
+        shutil.rmtree(directory)
+
+    print()
+    print('clock synchronisation against simulated server clocks up to 5 s and 50 ppm off, 2 exchanges/s')
+    print('%8s %10s %16s %16s %12s %12s' % ('cameras', 'duration', 'timestamp error', 'drift error',
+                                            'all matched', 'wrong frame'))
+    for cameras in (2, 4, 8):
+        for seconds in (30, 120):
+            mapping_error, drift_error, complete, wrong = simulate_clock_sync(cameras, seconds * 1000.0)
+            print('%8d %9ds %13.2f ms %12.2f ppm %11.1f%% %11.2f%%' % (cameras, seconds, mapping_error,
+                                                                      drift_error, 100 * complete, 100 * wrong))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
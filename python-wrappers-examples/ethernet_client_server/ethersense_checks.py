@@ -0,0 +1,424 @@
+#!/usr/bin/python
+import asyncio
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+from ethersense_protocol import FramesetCollector, ProtocolError, frame_buffers, read_frame, read_message, \
+    decode_frame, split_message, restamp_header, unpack_header
+from ethersense_codecs import CODECS, negotiate_codec
+from ethersense_streaming import CameraPublisher
+from ethersense_udp import FRAGMENT, FrameFragmenter, FrameAssembler
+from ethersense_clock import ClockEstimator
+from ethersense_shm import SharedFramePublisher, SharedFrameReader, shared_memory
+from ethersense_recording import FrameRecorder, Recording, camera_name
+from ethersense_benchmark import SkewedClock, simulate_clock_sync
+from EtherSenseReplay import ReplayServer
+
+# Checks of the EtherSense transport on synthetic frames over loopback, no camera needed, every check
+# raises an AssertionError when it fails:
+#   python ethersense_checks.py [check ...]
+
+LOSSLESS_CODECS = ('raw', 'delta_zlib', 'png16', 'rvl')
+
+
+def synthetic_frames(count, shape=(48, 64)):
+    # depth that differs in every pixel and from frame to frame, colour filled with the frame number
+    height, width = shape
+    depth = (np.arange(height * width).reshape(shape) * 7 + count * 13) % 4096 + 300
+    return {'depth': depth.astype(np.uint16), 'color': np.full((height, width, 3), count % 256, dtype=np.uint8)}
+
+
+class CountingCamera(object):
+    """
+    Blocking frameset source at a fixed rate like pipeline.wait_for_frames, the timestamp of a frameset is
+    its number, so the receivers can check its frames against synthetic_frames.
+    """
+    def __init__(self, fps):
+        self.period = 1.0 / fps
+        self.count = 0
+
+    def read_frame(self):
+        time.sleep(self.period)
+        self.count += 1
+        return synthetic_frames(self.count - 1), float(self.count - 1)
+
+
+def intact(frameset, streams):
+    _, timestamp, frames = frameset
+    if sorted(frames) != sorted(streams):
+        return False
+    expected = synthetic_frames(int(timestamp))
+    # colour is sent as JPEG, only its size can be checked
+    if 'color' in frames and frames['color'].shape != expected['color'].shape:
+        return False
+    return 'depth' not in frames or np.array_equal(frames['depth'], expected['depth'])
+
+
+async def read_framesets(address, count, delay=0.0):
+    reader, writer = await asyncio.open_connection(*address)
+    collector = FramesetCollector()
+    framesets = []
+    while len(framesets) < count:
+        frameset = collector.add(*await read_frame(reader))
+        if frameset is not None:
+            framesets.append(frameset)
+            if delay:
+                await asyncio.sleep(delay)
+    writer.close()
+    return framesets
+
+
+def check_framing():
+    frames = synthetic_frames(3)
+    messages = [frame_buffers(frames['depth'], 10.0 + index, index, CODECS[name], 'depth', 2)
+                for index, name in enumerate(LOSSLESS_CODECS)]
+    messages.append(frame_buffers(frames['color'], 20.0, 9, CODECS['jpeg'], 'color', 2))
+    data = b''.join(bytes(buffer) for buffers in messages for buffer in buffers)
+
+    async def read_all(data, chunk):
+        reader = asyncio.StreamReader()
+
+        async def feed():
+            # a few bytes at a time, so headers and payloads arrive split at every possible point
+            for start in range(0, len(data), chunk):
+                reader.feed_data(data[start:start + chunk])
+                await asyncio.sleep(0)
+            reader.feed_eof()
+
+        feeding = asyncio.ensure_future(feed())
+        received = []
+        try:
+            while True:
+                received.append(await read_message(reader))
+        except asyncio.IncompleteReadError as error:
+            await feeding
+            return received, len(error.partial)
+
+    for chunk in (1, 7, 4096):
+        received, partial = asyncio.run(read_all(data, chunk))
+        assert len(received) == len(messages) and partial == 0, (chunk, len(received), partial)
+        for (header, header_bytes, payload), buffers in zip(received, messages):
+            assert bytes(header_bytes) == bytes(buffers[0]) and bytes(payload) == bytes(buffers[1])
+            assert header.camera == 0 and header.frameset_size == 2
+        for (header, _, payload), name in zip(received, LOSSLESS_CODECS):
+            assert header.codec.name == name and header.stream == 'depth', (header.codec.name, header.stream)
+            assert np.array_equal(decode_frame(header, payload), frames['depth']), name
+        header, _, payload = received[-1]
+        assert header.stream == 'color' and decode_frame(header, payload).shape == frames['color'].shape
+
+    # a connection that closes within a frame raises after the last complete frame
+    received, partial = asyncio.run(read_all(data[:-5], 7))
+    assert len(received) == len(messages) - 1 and partial > 0, (len(received), partial)
+
+    # the same frames one after the other in one message, e.g. a datagram frameset
+    split = split_message(memoryview(data))
+    assert [header.frame_id for header, _, _ in split] == list(range(len(LOSSLESS_CODECS))) + [9]
+
+    # the replay moves the timestamp and the camera id, the rest of the header stays
+    header = unpack_header(restamp_header(bytes(messages[0][0]), 123.5, 3))
+    assert header.timestamp == 123.5 and header.camera == 3 and header.codec.name == 'raw'
+    try:
+        unpack_header(b'XXXX' + bytes(messages[0][0])[4:])
+    except ProtocolError:
+        pass
+    else:
+        raise AssertionError("a header with a bad magic was accepted")
+
+
+def check_codecs():
+    frames = synthetic_frames(5)
+    for name, codec in CODECS.items():
+        for stream in ('depth', 'aligned_depth'):
+            negotiated = negotiate_codec(name, stream)
+            # jpeg would push the 16 bit depth through 8 bit JPEG
+            assert negotiated is (codec if codec.depth else CODECS['raw']), (name, stream, negotiated.name)
+        if codec.depth and codec.lossless:
+            assert np.array_equal(codec.decode(memoryview(codec.encode(frames['depth'])).cast('B'), np.dtype('<u2'),
+                                               frames['depth'].shape), frames['depth']), name
+    assert negotiate_codec('jpeg', 'infrared') is CODECS['jpeg']
+    assert negotiate_codec('unknown') is CODECS['raw']
+
+
+def check_fan_out():
+
+    async def run():
+        publisher = CameraPublisher(CountingCamera(100).read_frame, idle_timeout=None)
+        # the newest sequence in the ring when each connection subscribed
+        subscribed = []
+
+        async def serve(codecs):
+            def subscribe(reader, writer):
+                subscribed.append(publisher.ring.sequence)
+                publisher.subscribe(writer.get_extra_info('peername'), reader, writer, codecs)
+            server = await asyncio.start_server(subscribe, '127.0.0.1', 0)
+            return server, server.sockets[0].getsockname()
+
+        compressed, compressed_address = await serve({'depth': CODECS['delta_zlib'], 'color': CODECS['jpeg']})
+        raw, raw_address = await serve({'depth': CODECS['raw']})
+        # two clients keeping up and one reading at 20 framesets/s
+        results = await asyncio.gather(read_framesets(compressed_address, 30), read_framesets(compressed_address, 30),
+                                       read_framesets(raw_address, 10, delay=0.05))
+        for framesets, streams in zip(results, (('depth', 'color'), ('depth', 'color'), ('depth',))):
+            corrupt = sum(not intact(frameset, streams) for frameset in framesets)
+            assert corrupt == 0, corrupt
+            frame_ids = [frame_id for frame_id, _, _ in framesets]
+            assert frame_ids == sorted(set(frame_ids)), frame_ids
+
+        # the capture pauses without subscribers, a new subscriber starts with a fresh frameset rather
+        # than the one left in the ring
+        deadline = time.monotonic() + 5.0
+        while publisher.subscriptions and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        assert not publisher.subscriptions
+        await asyncio.sleep(0.1)
+        (frame_id, _, frames), = await read_framesets(raw_address, 1)
+        assert frame_id > subscribed[-1] >= 0, (frame_id, subscribed)
+
+        publisher.close()
+        for server in (compressed, raw):
+            server.close()
+            await server.wait_closed()
+        return publisher.captured
+
+    captured = asyncio.run(run())
+    print("fan_out: %d framesets captured once for 4 clients, every frameset intact and in order" % captured)
+
+
+def check_fec():
+    datagram_size = 200
+    rng = random.Random(0)
+    message = np.random.RandomState(0).randint(0, 256, 2000).astype(np.uint8).tobytes()
+
+    def datagrams(fec_group, frame_id=7):
+        fragmenter = FrameFragmenter(datagram_size, fec_group)
+        # the datagrams are views on the buffers of the fragmenter
+        return [bytes(datagram) for datagram in fragmenter.fragments([message], frame_id)]
+
+    def assemble(received, now=0.0):
+        assembler = FrameAssembler(datagram_size=datagram_size)
+        delivered = []
+        for datagram in received:
+            result = assembler.add(datagram, now)
+            if result is not None:
+                delivered.append(bytes(result))
+        return assembler, delivered
+
+    group = 4
+    sent = datagrams(group)
+    count = -(-len(message) // (datagram_size - FRAGMENT.size))
+    groups = -(-count // group)
+    assert len(sent) == count + groups, (len(sent), count, groups)
+
+    # one data fragment lost in every group, at another place in each, the others reordered
+    lost = {start + (start // group) % min(group, count - start) for start in range(0, count, group)}
+    received = [datagram for index, datagram in enumerate(sent) if index not in lost]
+    rng.shuffle(received)
+    assembler, delivered = assemble(received)
+    assert delivered == [message] and assembler.recovered == groups, (len(delivered), assembler.recovered)
+
+    # a lost parity fragment costs nothing while its group is complete
+    assembler, delivered = assemble(sent[:count] + sent[count + 1:])
+    assert delivered == [message] and assembler.recovered == 0
+
+    # two fragments lost in one group can not be rebuilt, the frame is dropped at its deadline
+    assembler, delivered = assemble([datagram for index, datagram in enumerate(sent) if index not in (0, 1)])
+    assert delivered == [] and assembler.dropped == 0
+    assembler.expire(now=1.0)
+    assert assembler.dropped == 1
+
+    # without FEC a single lost fragment loses the frame
+    assembler, delivered = assemble(datagrams(0)[1:])
+    assert delivered == []
+    print("fec: %d fragments in %d groups, one lost fragment per group recovered" % (count, groups))
+
+
+def check_clock():
+    rng = random.Random(1)
+    server = SkewedClock(-1234.5, 30.0)
+    estimator = ClockEstimator()
+
+    def delay():
+        return 0.2 + rng.expovariate(1 / 2.0)
+
+    for probe in range(240):
+        origin = probe * 500.0
+        received = origin + delay()
+        transmitted = received + 0.05
+        estimator.add(origin, server.time(received), server.time(transmitted), transmitted + delay())
+        if probe == 5:
+            # the drift is only estimated once the exchanges span min_span
+            assert estimator.drift == 0.0 and abs(estimator.offset_at(origin) - (server.time(origin) - origin)) < 1.0
+    local_time = 120000.0
+    offset_error = abs(estimator.offset_at(local_time) - (server.time(local_time) - local_time))
+    assert offset_error < 1.0, offset_error
+    assert abs(estimator.to_local(server.time(local_time)) - local_time) < 1.0
+    assert abs(estimator.drift * 1e6 - server.drift) < 5.0, estimator.drift * 1e6
+
+    for cameras in (2, 4):
+        mapping_error, drift_error, complete, wrong = simulate_clock_sync(cameras, 120000.0)
+        assert mapping_error < 2.0 and drift_error < 5.0, (cameras, mapping_error, drift_error)
+        assert complete == 1.0 and wrong < 0.01, (cameras, complete, wrong)
+    print("clock: offset within %.2f ms of the simulated skew" % offset_error)
+
+
+def read_shared_copies(name, duration, results):
+    # reader process of check_shared_memory, every frame of a published frameset is filled with its sequence
+    reader = SharedFrameReader(name)
+    read = torn = overwritten = 0
+    end = time.perf_counter() + duration
+    while time.perf_counter() < end:
+        frameset = reader.wait(timeout=0.1)
+        if frameset is None:
+            continue
+        frames = frameset.copy()
+        if frames is None:
+            overwritten += 1
+        elif not (np.all(frames['depth'] == frameset.sequence & 0xffff) and
+                  np.all(frames['color'] == frameset.sequence & 0xff)):
+            torn += 1
+        read += 1
+        del frames, frameset
+    results.put((read, torn, overwritten))
+    reader.close()
+
+
+def check_shared_memory():
+    if shared_memory is None:
+        print("shared_memory: skipped, shared memory frames need Python 3.8 or newer")
+        return
+
+    def frameset(sequence):
+        return {'depth': np.full((48, 64), sequence & 0xffff, dtype=np.uint16),
+                'color': np.full((48, 64, 3), sequence & 0xff, dtype=np.uint8)}
+
+    name = 'ethersense_checks_%d' % os.getpid()
+    publisher = SharedFramePublisher(name, frameset(0), slots=4)
+    try:
+        reader = SharedFrameReader(name)
+        for sequence in range(3):
+            publisher.publish(frameset(sequence), float(sequence))
+        for sequence in range(3):
+            shared = reader.read()
+            assert shared.sequence == sequence and shared.timestamp == sequence
+            frames = shared.copy()
+            assert all(np.array_equal(frames[stream], frame) for stream, frame in frameset(sequence).items())
+        assert reader.read() is None
+
+        # a view on a slot the producer has gone around to is no longer valid and is not copied
+        publisher.publish(frameset(3), 3.0)
+        shared = reader.read()
+        for sequence in range(4, 8):
+            publisher.publish(frameset(sequence), float(sequence))
+        assert not shared.valid() and shared.copy() is None
+        # the reader fell behind, it skips to the newest frameset
+        shared = reader.read()
+        assert shared.sequence == 7 and reader.skipped == 3, (shared.sequence, reader.skipped)
+
+        # a slot with an odd counter is being written, the reader does not hand it out
+        publisher.publish(frameset(8), 8.0)
+        publisher.ring.counters[8 % 4] += 1
+        assert reader.read() is None and reader.skipped == 4, reader.skipped
+        publisher.ring.counters[8 % 4] += 1
+        del shared
+        reader.close()
+
+        # a reader process copying while the producer overwrites the ring as fast as it can
+        context = multiprocessing.get_context('spawn')
+        results = context.Queue()
+        process = context.Process(target=read_shared_copies, args=(name, 1.0, results))
+        process.start()
+        published = publisher.sequence + 1
+        start = time.perf_counter()
+        while process.is_alive() and time.perf_counter() - start < 10.0:
+            publisher.publish(frameset(published), float(published))
+            published += 1
+        read, torn, overwritten = results.get()
+        process.join()
+    finally:
+        publisher.close()
+    assert read > 0 and torn == 0, (read, torn)
+    print("shared_memory: %d framesets read while %d were published, %d copies refused, no torn reads" % (
+        read, published, overwritten))
+
+
+def check_recording():
+    directory = tempfile.mkdtemp(prefix='ethersense_checks_')
+    frames = [synthetic_frames(index)['depth'] for index in range(30)]
+    cameras = [camera_name('10.0.0.5', 0), camera_name('10.0.0.5', 1)]
+    try:
+        recorder = FrameRecorder(directory, segment_size=16 * 1024)
+        for index, depth in enumerate(frames):
+            header, payload = frame_buffers(depth, 1000.0 + index, index, CODECS['delta_zlib'])
+            recorder.write(cameras[index % 2], header, payload, 1000.0 + index)
+            if index == 10:
+                # the first camera reconnects, it goes on in a new segment of its directory
+                recorder.close(cameras[0])
+        recorder.close()
+        recording = Recording(directory)
+        assert recording.cameras == sorted(cameras), recording.cameras
+        for camera_id, camera in enumerate(cameras):
+            replayed = [(time, header.frame_id, decode_frame(header, payload))
+                        for time, header, _, payload in recording.frames(camera)]
+            assert [frame_id for _, frame_id, _ in replayed] == list(range(camera_id, len(frames), 2))
+            assert all(np.array_equal(depth, frames[frame_id]) for _, frame_id, depth in replayed)
+            assert recording.time_range(camera) == (1000.0 + camera_id, 1000.0 + len(frames) - 2 + camera_id)
+        assert [header.frame_id for _, header, _, _ in recording.frames(cameras[0], start=1020.0)] == \
+            list(range(20, len(frames), 2))
+
+        # a replay sends every recorded camera over a connection of its own, told apart by the camera id
+        async def replay():
+            received = {}
+            finished = []
+
+            async def receive(reader, writer):
+                while True:
+                    try:
+                        header, _, _ = await read_message(reader)
+                    except (asyncio.IncompleteReadError, ConnectionError):
+                        break
+                    received.setdefault(header.camera, []).append(header.frame_id)
+                writer.close()
+                finished.append(True)
+
+            client = await asyncio.start_server(receive, '127.0.0.1', 0)
+            server = ReplayServer(recording, speed=0, client_port=client.sockets[0].getsockname()[1])
+            await server.replay(('127.0.0.1', 0), {'transport': 'tcp'})
+            deadline = time.monotonic() + 5.0
+            while len(finished) < len(cameras) and time.monotonic() < deadline:
+                await asyncio.sleep(0.01)
+            client.close()
+            await client.wait_closed()
+            return received
+
+        received = asyncio.run(replay())
+        assert received == {0: list(range(0, len(frames), 2)), 1: list(range(1, len(frames), 2))}, received
+    finally:
+        shutil.rmtree(directory)
+
+
+CHECKS = {
+    'framing': check_framing,
+    'codecs': check_codecs,
+    'fan_out': check_fan_out,
+    'fec': check_fec,
+    'clock': check_clock,
+    'shared_memory': check_shared_memory,
+    'recording': check_recording,
+}
+
+
+def main(argv):
+    for name in argv or list(CHECKS):
+        if name not in CHECKS:
+            raise SystemExit("unknown check {}, use one of {}".format(name, ', '.join(CHECKS)))
+        CHECKS[name]()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
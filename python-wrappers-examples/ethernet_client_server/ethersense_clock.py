@@ -0,0 +1,184 @@
+#!/usr/bin/python
+import asyncio
+from collections import deque
+
+import numpy as np
+
+from ethersense_protocol import clock, clock_request, unpack_clock, ProtocolError
+
+# Every server stamps its frames with its own clock. The client measures the offset of each server
+# clock with NTP like exchanges (see the clock messages in ethersense_protocol.py) and maps the frame
+# timestamps onto its own clock, so the frames of several cameras can be matched in time.
+
+
+class ClockEstimator(object):
+    """
+    Running estimate of the offset and drift of one server clock against the local clock.
+
+    Every exchange gives an offset sample (server time - local time) and the round trip delay. Queueing
+    on the network makes the delay asymmetric and the offset wrong by up to half the round trip, so the
+    estimate is a line fitted through the samples with the shortest round trips of the last window
+    exchanges. The slope of the line is the drift.
+
+    Attributes
+    ___________
+    offset : float
+        server time - local time in ms at the local time reference, None before the first exchange
+    drift : float
+        change of the offset per ms of local time
+    delay : float
+        the shortest round trip in the window, the offset is accurate to about half of it
+    """
+    def __init__(self, window=256, min_span=10000.0):
+        self.samples = deque(maxlen=window)
+        self.min_span = min_span
+        self.offset = None
+        self.drift = 0.0
+        self.reference = 0.0
+        self.delay = None
+
+    @property
+    def synchronized(self):
+        return self.offset is not None
+
+    def add(self, origin, received, transmitted, arrived):
+        """
+        Adds an exchange: the local send time of the request, the server receive and send times and the
+        local arrival time of the reply. Returns the (offset, delay) of the exchange.
+        """
+        delay = (arrived - origin) - (transmitted - received)
+        offset = ((received - origin) + (transmitted - arrived)) / 2.0
+        if delay < 0:
+            # the server clock stepped during the exchange
+            return offset, delay
+        self.samples.append(((origin + arrived) / 2.0, offset, delay))
+        self._fit()
+        return offset, delay
+
+    def _fit(self):
+        samples = np.array(self.samples)
+        # the half of the window with the shortest round trips
+        best = samples[np.argsort(samples[:, 2], kind='stable')[:max(len(samples) // 2, 1)]]
+        times, offsets = best[:, 0], best[:, 1]
+        self.delay = float(samples[:, 2].min())
+        self.reference = float(times.mean())
+        self.offset = float(offsets.mean())
+        # the drift is only measurable once the samples span some time
+        if times.max() - times.min() < self.min_span:
+            self.drift = 0.0
+            return
+        spread = times - self.reference
+        self.drift = float(np.dot(spread, offsets - self.offset) / np.dot(spread, spread))
+
+    def offset_at(self, local_time):
+        return self.offset + self.drift * (local_time - self.reference)
+
+    def to_local(self, server_time):
+        """
+        Maps a time of the server clock, e.g. a frame timestamp, onto the local clock.
+        """
+        # solves local = server - offset_at(local)
+        return (server_time - self.offset + self.drift * self.reference) / (1.0 + self.drift)
+
+    def to_server(self, local_time):
+        return local_time + self.offset_at(local_time)
+
+
+class FrameSynchronizer(object):
+    """
+    Keeps the last framesets of every camera on the local clock and matches them in time.
+
+    The clocks are named by the address of their server, add ignores the framesets of a camera until its
+    clock is synchronized. The frames are kept as they are passed in, they have to stay valid for
+    history framesets.
+
+    Methods
+    _______
+    clock(self, name):
+
+    add(self, camera, timestamp, frames, clock_name=None):
+
+    remove(self, camera):
+
+    nearest(self, local_time=None):
+    """
+    def __init__(self, tolerance=20.0, history=8):
+        self.tolerance = tolerance
+        self.history = history
+        self.clocks = {}
+        self.framesets = {}
+
+    def clock(self, name):
+        """
+        Returns the ClockEstimator of a server.
+        """
+        estimator = self.clocks.get(name)
+        if estimator is None:
+            estimator = self.clocks[name] = ClockEstimator()
+        return estimator
+
+    def add(self, camera, timestamp, frames, clock_name=None):
+        """
+        Adds a frameset stamped with the clock of its server, clock_name when the camera is not named
+        after it. Returns the local time of the frameset or None while the clock is not synchronized.
+        """
+        estimator = self.clock(camera if clock_name is None else clock_name)
+        if not estimator.synchronized:
+            return None
+        local_time = estimator.to_local(timestamp)
+        framesets = self.framesets.get(camera)
+        if framesets is None:
+            framesets = self.framesets[camera] = deque(maxlen=self.history)
+        framesets.append((local_time, frames))
+        return local_time
+
+    def remove(self, camera):
+        """
+        Forgets the framesets of a camera that went away.
+        """
+        self.framesets.pop(camera, None)
+
+    def nearest(self, local_time=None):
+        """
+        Returns (local_time, {camera: (frameset local time, frames)}) with the frameset nearest to
+        local_time of every camera that has one within the tolerance. local_time defaults to the newest
+        time every camera has reached.
+        """
+        if not self.framesets:
+            return local_time, {}
+        if local_time is None:
+            local_time = min(framesets[-1][0] for framesets in self.framesets.values())
+        matched = {}
+        for camera, framesets in self.framesets.items():
+            frameset = min(framesets, key=lambda frameset: abs(frameset[0] - local_time))
+            if abs(frameset[0] - local_time) <= self.tolerance:
+                matched[camera] = frameset
+        return local_time, matched
+
+
+class ClockClient(asyncio.DatagramProtocol):
+    """
+    Sends clock requests to the servers and feeds their replies into the clocks of a FrameSynchronizer,
+    a reply from a server is an exchange of the camera named by the server's address.
+    """
+    def __init__(self, synchronizer, destination):
+        self.synchronizer = synchronizer
+        self.destination = destination
+        self.transport = None
+        self.sequence = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def probe(self):
+        self.sequence += 1
+        self.transport.sendto(clock_request(self.sequence), self.destination)
+
+    def datagram_received(self, data, addr):
+        arrived = clock()
+        try:
+            _, origin, received, transmitted = unpack_clock(data)
+        except ProtocolError as error:
+            print(error)
+            return
+        self.synchronizer.clock(addr[0]).add(origin, received, transmitted, arrived)
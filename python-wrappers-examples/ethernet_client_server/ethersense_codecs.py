@@ -0,0 +1,280 @@
+#!/usr/bin/python
+import math
+import struct
+import zlib
+
+import numpy as np
+import cv2
+
+try:
+    import lz4.block
+except ImportError:
+    lz4 = None
+
+# Codecs for the payload of an EtherSense frame. The codec id travels in the frame header, the client
+# asks for a depth codec by name in its multicast ping, colour frames are sent as JPEG.
+
+
+class Codec(object):
+    """
+    Turns a frame into a payload and back. encode returns a bytes-like object,
+    decode gets the payload together with the dtype and shape from the frame header.
+    depth tells whether the codec carries 16 bit depth.
+    """
+    name = None
+    codec_id = None
+    lossless = True
+    depth = True
+
+    def encode(self, frame):
+        raise NotImplementedError
+
+    def decode(self, payload, dtype, shape):
+        raise NotImplementedError
+
+
+class RawCodec(Codec):
+    name = 'raw'
+    codec_id = 0
+
+    def encode(self, frame):
+        return memoryview(np.ascontiguousarray(frame)).cast('B')
+
+    def decode(self, payload, dtype, shape):
+        return np.frombuffer(payload, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+
+
+def _delta_rows(frame):
+    # difference to the left neighbour, modulo 2**16 so it is exactly reversible
+    delta = np.empty(frame.shape, dtype=np.uint16)
+    delta[:, 0] = frame[:, 0]
+    np.subtract(frame[:, 1:], frame[:, :-1], out=delta[:, 1:], dtype=np.uint16, casting='unsafe')
+    return delta
+
+
+def _undelta_rows(delta):
+    return np.cumsum(delta, axis=1, dtype=np.uint16)
+
+
+class DeltaZlibCodec(Codec):
+    name = 'delta_zlib'
+    codec_id = 1
+
+    def __init__(self, level=1):
+        self.level = level
+
+    def encode(self, frame):
+        return zlib.compress(_delta_rows(frame).astype('<u2').tobytes(), self.level)
+
+    def decode(self, payload, dtype, shape):
+        delta = np.frombuffer(zlib.decompress(payload), dtype='<u2').reshape(shape)
+        return _undelta_rows(delta).astype(dtype, copy=False)
+
+
+class DeltaLz4Codec(Codec):
+    name = 'delta_lz4'
+    codec_id = 2
+
+    def encode(self, frame):
+        return lz4.block.compress(_delta_rows(frame).astype('<u2').tobytes())
+
+    def decode(self, payload, dtype, shape):
+        delta = np.frombuffer(lz4.block.decompress(bytes(payload)), dtype='<u2').reshape(shape)
+        return _undelta_rows(delta).astype(dtype, copy=False)
+
+
+class Png16Codec(Codec):
+    name = 'png16'
+    codec_id = 3
+
+    def __init__(self, compression=1):
+        self.params = [cv2.IMWRITE_PNG_COMPRESSION, compression]
+
+    def encode(self, frame):
+        ok, data = cv2.imencode('.png', frame, self.params)
+        if not ok:
+            raise ValueError("the frame could not be encoded as PNG")
+        return data
+
+    def decode(self, payload, dtype, shape):
+        frame = cv2.imdecode(np.frombuffer(payload, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+        return frame.astype(dtype, copy=False).reshape(shape)
+
+
+class JpegCodec(Codec):
+    """
+    Lossy codec for colour and infrared images.
+    """
+    name = 'jpeg'
+    codec_id = 6
+    lossless = False
+    depth = False
+
+    def __init__(self, quality=80):
+        self.params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+
+    def encode(self, frame):
+        ok, data = cv2.imencode('.jpg', frame, self.params)
+        if not ok:
+            raise ValueError("the frame could not be encoded as JPEG")
+        return data
+
+    def decode(self, payload, dtype, shape):
+        frame = cv2.imdecode(np.frombuffer(payload, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+        return frame.astype(dtype, copy=False).reshape(shape)
+
+
+def _encode_varints(values):
+    """
+    Variable length encoding with 3 data bits and a continuation bit per nibble, two nibbles per byte.
+    """
+    values = values.astype(np.uint64)
+    bits = np.zeros(len(values), dtype=np.int64)
+    nonzero = values > 0
+    bits[nonzero] = np.floor(np.log2(values[nonzero].astype(np.float64))).astype(np.int64) + 1
+    # guard against float rounding at exact powers of two
+    bits += (values >> np.minimum(bits, 63).astype(np.uint64)) > 0
+    nibble_count = np.maximum((bits + 2) // 3, 1)
+
+    token = np.repeat(np.arange(len(values)), nibble_count)
+    starts = np.cumsum(nibble_count) - nibble_count
+    position = np.arange(len(token)) - starts[token]
+    nibbles = (values[token] >> (3 * position).astype(np.uint64)) & 7
+    last = position == nibble_count[token] - 1
+    nibbles = nibbles.astype(np.uint8) | np.where(last, 0, 8).astype(np.uint8)
+
+    if len(nibbles) % 2:
+        nibbles = np.append(nibbles, np.uint8(0))
+    return (nibbles[0::2] << 4) | nibbles[1::2], len(values)
+
+
+def _decode_varints(data, count):
+    nibbles = np.empty(2 * len(data), dtype=np.uint8)
+    nibbles[0::2] = data >> 4
+    nibbles[1::2] = data & 15
+    ends = np.nonzero((nibbles & 8) == 0)[0][:count]
+    nibbles = nibbles[:ends[-1] + 1] if count else nibbles[:0]
+
+    token = np.zeros(len(nibbles), dtype=np.int64)
+    token[ends[:-1] + 1] = 1
+    token = np.cumsum(token)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    position = np.arange(len(nibbles)) - starts[token]
+    weighted = (nibbles & 7).astype(np.uint64) << (3 * position).astype(np.uint64)
+    values = np.zeros(count, dtype=np.uint64)
+    np.add.at(values, token, weighted)
+    return values
+
+
+class RvlCodec(Codec):
+    """
+    Run length and variable length coding after RVL (Wilson, 2017).
+
+    Zero runs and non zero runs are coded as run lengths, the non zero pixels as zigzag coded
+    differences to the previous non zero pixel. Run lengths and differences are kept in two
+    separate varint streams so both directions are vectorized.
+    """
+    name = 'rvl'
+    codec_id = 4
+    SECTIONS = struct.Struct('<III')
+
+    def encode(self, frame):
+        flat = np.ascontiguousarray(frame).reshape(-1).astype(np.int64)
+        valid = flat != 0
+
+        # run lengths, alternating zero and non zero runs, starting with a (possibly empty) zero run
+        edges = np.nonzero(np.diff(valid.astype(np.int8)))[0] + 1
+        bounds = np.concatenate(([0], edges, [len(flat)]))
+        runs = np.diff(bounds)
+        if len(flat) and valid[0]:
+            runs = np.concatenate(([0], runs))
+
+        values = flat[valid]
+        deltas = np.diff(values, prepend=0)
+        zigzag = np.where(deltas < 0, -2 * deltas - 1, 2 * deltas)
+
+        run_bytes, run_count = _encode_varints(runs)
+        delta_bytes, delta_count = _encode_varints(zigzag)
+        header = self.SECTIONS.pack(run_count, len(run_bytes), delta_count)
+        return b''.join([header, run_bytes.tobytes(), delta_bytes.tobytes()])
+
+    def decode(self, payload, dtype, shape):
+        payload = np.frombuffer(payload, dtype=np.uint8)
+        run_count, run_length, delta_count = self.SECTIONS.unpack(payload[:self.SECTIONS.size].tobytes())
+        start = self.SECTIONS.size
+        runs = _decode_varints(payload[start:start + run_length], run_count).astype(np.int64)
+        zigzag = _decode_varints(payload[start + run_length:], delta_count).astype(np.int64)
+
+        deltas = np.where(zigzag & 1, -((zigzag + 1) >> 1), zigzag >> 1)
+        valid = np.repeat(np.arange(len(runs)) % 2 == 1, runs)
+        frame = np.zeros(int(np.prod(shape)), dtype=dtype)
+        frame[valid] = np.cumsum(deltas)
+        return frame.reshape(shape)
+
+
+class LogQuantisedCodec(Codec):
+    """
+    Lossy codec with a bounded relative depth error.
+
+    Depth values are quantised on a logarithmic scale so the step grows with the distance, like the
+    depth error of a stereo camera. The reconstructed depth differs from the original by at most
+    max_relative_error times the depth plus half a depth unit. The quantised values are coded with
+    delta_zlib.
+    """
+    name = 'log_quantised'
+    codec_id = 5
+    lossless = False
+    PARAMETERS = struct.Struct('<f')
+
+    def __init__(self, max_relative_error=0.002):
+        if math.log(65535) / math.log1p(2 * max_relative_error) + 1 > 65535:
+            raise ValueError("max_relative_error is too small for 16 bit quantisation")
+        self.max_relative_error = max_relative_error
+        self._lossless = DeltaZlibCodec()
+
+    def encode(self, frame):
+        step = math.log1p(2 * self.max_relative_error)
+        quantised = np.zeros(frame.shape, dtype=np.uint16)
+        valid = frame > 0
+        quantised[valid] = np.round(np.log(frame[valid]) / step).astype(np.uint16) + 1
+        return self.PARAMETERS.pack(self.max_relative_error) + self._lossless.encode(quantised)
+
+    def decode(self, payload, dtype, shape):
+        max_relative_error, = self.PARAMETERS.unpack(bytes(payload[:self.PARAMETERS.size]))
+        step = math.log1p(2 * max_relative_error)
+        quantised = self._lossless.decode(payload[self.PARAMETERS.size:], np.uint16, shape)
+        frame = np.zeros(shape, dtype=dtype)
+        valid = quantised > 0
+        frame[valid] = np.round(np.exp((quantised[valid] - 1.0) * step)).astype(dtype)
+        return frame
+
+
+def available_codecs():
+    """
+    Returns the codecs usable in this process by name, delta_lz4 needs the lz4 package.
+    """
+    codecs = [RawCodec(), DeltaZlibCodec(), Png16Codec(), RvlCodec(), LogQuantisedCodec(), JpegCodec()]
+    if lz4 is not None:
+        codecs.append(DeltaLz4Codec())
+    return {codec.name: codec for codec in codecs}
+
+
+CODECS = available_codecs()
+# the streams of 16 bit depth
+DEPTH_STREAMS = ('depth', 'aligned_depth')
+CODECS_BY_ID = {codec.codec_id: codec for codec in CODECS.values()}
+
+
+def negotiate_codec(name, stream='depth'):
+    """
+    Returns the codec a client asked for a stream, falling back to raw when it is not available here or
+    can not carry the 16 bit depth of a depth stream.
+    """
+    codec = CODECS.get(name)
+    if codec is None:
+        print('codec %s is not available, sending raw frames' % name)
+        return CODECS['raw']
+    if stream in DEPTH_STREAMS and not codec.depth:
+        print('codec %s can not carry 16 bit depth, sending raw frames' % name)
+        return CODECS['raw']
+    return codec
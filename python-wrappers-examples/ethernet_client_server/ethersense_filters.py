@@ -0,0 +1,100 @@
+#!/usr/bin/python
+import time
+
+import pyrealsense2 as rs
+
+# Depth post processing of EtherSenseServer. A filter chain is written as filters separated by ',', each
+# optionally followed by ':option=value' settings named like rs.option, e.g.
+#   decimation:filter_magnitude=4,disparity,spatial,temporal:filter_smooth_alpha=0.4,depth,hole_filling
+# 'disparity' and 'depth' convert between depth and disparity, spatial and temporal filtering work best
+# on disparity. 'none' is the empty chain, which leaves the depth at full resolution.
+DEFAULT_FILTERS = 'decimation:filter_magnitude=2'
+
+FILTERS = {
+    'decimation': rs.decimation_filter,
+    'threshold': rs.threshold_filter,
+    'spatial': rs.spatial_filter,
+    'temporal': rs.temporal_filter,
+    'hole_filling': rs.hole_filling_filter,
+    'disparity': lambda: rs.disparity_transform(True),
+    'depth': lambda: rs.disparity_transform(False),
+}
+
+
+def parse_filters(spec):
+    """
+    Returns the [(name, {option: value})] of a filter chain spec.
+    Raises ValueError for an unknown filter or option or a value that is not a number.
+    """
+    filters = []
+    for item in spec.split(','):
+        settings = item.strip().split(':')
+        name = settings.pop(0)
+        if name in ('', 'none'):
+            continue
+        if name not in FILTERS:
+            raise ValueError("unknown filter {}".format(name))
+        options = {}
+        for setting in settings:
+            option, _, value = setting.partition('=')
+            if not hasattr(rs.option, option):
+                raise ValueError("unknown option {} of filter {}".format(option, name))
+            try:
+                options[option] = float(value)
+            except ValueError:
+                raise ValueError("bad value {!r} of option {}".format(value, option))
+        filters.append((name, options))
+    return filters
+
+
+def normalise_filters(spec):
+    """
+    Returns the spec in one spelling, so clients asking for the same filters share a chain.
+    """
+    return ','.join(name + ''.join(':%s=%g' % option for option in sorted(options.items()))
+                    for name, options in parse_filters(spec)) or 'none'
+
+
+class FilterChain(object):
+    """
+    The filters of a spec, built once and reused for every frame so the temporal filter keeps its
+    history. The time spent in every filter is summed up until the next report.
+
+    Methods
+    _______
+    process(self, frame):
+
+    report(self, reset=True):
+    """
+    def __init__(self, spec=DEFAULT_FILTERS):
+        self.spec = normalise_filters(spec)
+        self.filters = []
+        for name, options in parse_filters(self.spec):
+            block = FILTERS[name]()
+            for option, value in options.items():
+                # raises RuntimeError for a value out of the range of the option
+                block.set_option(getattr(rs.option, option), value)
+            self.filters.append((name, block))
+        self.times = [0.0] * len(self.filters)
+        self.frames = 0
+
+    def process(self, frame):
+        for index, (_, block) in enumerate(self.filters):
+            start = time.perf_counter()
+            frame = block.process(frame)
+            self.times[index] += time.perf_counter() - start
+        self.frames += 1
+        return frame
+
+    def report(self, reset=True):
+        """
+        Returns the mean processing time per frame of every filter as one line of text.
+        """
+        frames = max(self.frames, 1)
+        timings = ['%s %.2f ms' % (name, 1000 * total / frames)
+                   for (name, _), total in zip(self.filters, self.times)]
+        line = '%s: %d frames, %s' % (self.spec, self.frames, ', '.join(timings) or 'no filters')
+        if reset:
+            self.times = [0.0] * len(self.filters)
+            self.frames = 0
+        return line
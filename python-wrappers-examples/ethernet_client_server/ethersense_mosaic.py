@@ -0,0 +1,171 @@
+#!/usr/bin/python
+import threading
+import time
+
+import cv2
+import numpy as np
+
+# One window for every camera of the client. The receive handlers only hand their decoded framesets
+# to the MosaicRenderer, a render thread of its own draws the newest frame of every camera into one
+# preallocated mosaic at a fixed rate, so the network never waits for the GUI.
+
+# the streams holding uint16 depth, drawn through the depth colour table
+DEPTH_STREAMS = ('depth', 'aligned_depth')
+GRAY_LUT = np.repeat(np.arange(256, dtype=np.uint8)[:, None], 3, axis=1)
+
+
+def depth_lut(max_depth=4000, colormap=cv2.COLORMAP_JET):
+    """
+    Returns a (65536, 3) table of the BGR colours of every uint16 depth, depths from 0 to max_depth
+    cover the colormap, 0 (no depth) is black.
+    """
+    ramp = np.minimum(np.arange(65536) * 255 // max_depth, 255).astype(np.uint8)
+    lut = cv2.applyColorMap(ramp.reshape(-1, 1), colormap).reshape(-1, 3)
+    lut[0] = 0
+    return np.ascontiguousarray(lut)
+
+
+class MosaicTile(object):
+    """
+    The place of one stream of one camera in the mosaic, holding the newest frame handed in.
+    """
+    __slots__ = ('key', 'index', 'view', 'frame', 'timestamp', 'updated', 'scaled')
+
+    def __init__(self, key, index, view):
+        self.key = key
+        self.index = index
+        self.view = view
+        self.frame = None
+        self.timestamp = None
+        self.updated = False
+        self.scaled = None
+
+
+class MosaicRenderer(object):
+    """
+    Composes the newest frame of every camera stream into one window.
+
+    A tile of tile_size (width, height) is given to every (camera, stream) on its first frame, up to
+    tiles tiles in rows of columns tiles. update only swaps the frame of a tile under a lock, the frames
+    must not be changed afterwards. The render thread redraws the tiles that got a new frame fps times
+    per second: depth through a precomputed colour table, colour and infrared scaled into the tile.
+
+    Methods
+    _______
+    update(self, camera, timestamp, frames):
+
+    remove(self, camera):
+
+    compose(self):
+
+    start(self):
+
+    stop(self):
+    """
+    def __init__(self, tiles=8, tile_size=(320, 240), columns=4, fps=30, max_depth=4000, window='EtherSense'):
+        self.tile_size = tile_size
+        self.columns = min(columns, tiles)
+        self.rows = -(-tiles // self.columns)
+        self.period = 1.0 / fps
+        self.window = window
+        self.depth_lut = depth_lut(max_depth)
+        width, height = tile_size
+        self.mosaic = np.zeros((self.rows * height, self.columns * width, 3), dtype=np.uint8)
+        self.views = [self.mosaic[row * height:(row + 1) * height, column * width:(column + 1) * width]
+                      for row in range(self.rows) for column in range(self.columns)]
+        self.tiles = {}
+        self.rendered = 0
+        self._free = list(range(len(self.views)))
+        self._cleared = []
+        self._lock = threading.Lock()
+        self._thread = None
+        self._running = False
+
+    def update(self, camera, timestamp, frames):
+        """
+        Hands in the newest frameset of a camera, a dictionary of frames by stream name.
+        """
+        with self._lock:
+            for stream, frame in frames.items():
+                tile = self.tiles.get((camera, stream))
+                if tile is None:
+                    if not self._free:
+                        continue
+                    index = self._free.pop(0)
+                    tile = MosaicTile((camera, stream), index, self.views[index])
+                    self.tiles[(camera, stream)] = tile
+                tile.frame = frame
+                tile.timestamp = timestamp
+                tile.updated = True
+
+    def remove(self, camera):
+        """
+        Frees the tiles of a camera that went away.
+        """
+        with self._lock:
+            for key in [key for key in self.tiles if key[0] == camera]:
+                tile = self.tiles.pop(key)
+                # blanked by the render thread, which may still be drawing it
+                self._cleared.append(tile.view)
+                self._free.append(tile.index)
+            self._free.sort()
+
+    def compose(self):
+        """
+        Draws the tiles with a new frame, returns the mosaic.
+        """
+        with self._lock:
+            updated = [(tile, tile.frame, tile.timestamp) for tile in self.tiles.values() if tile.updated]
+            for tile, _, _ in updated:
+                tile.updated = False
+            cleared, self._cleared = self._cleared, []
+        for view in cleared:
+            view[...] = 0
+        for tile, frame, timestamp in updated:
+            self._draw(tile, frame)
+            cv2.putText(tile.view, '%s %s %s' % (tile.key[0], tile.key[1], timestamp), (10, 20),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.45, (255, 255, 255), 1, cv2.LINE_AA)
+        return self.mosaic
+
+    def _draw(self, tile, frame):
+        height, width = tile.view.shape[:2]
+        if frame.ndim == 3:
+            if frame.shape[:2] == (height, width):
+                tile.view[...] = frame
+            else:
+                cv2.resize(frame, (width, height), dst=tile.view, interpolation=cv2.INTER_AREA)
+            return
+        if frame.shape != (height, width):
+            # depth is scaled before the colour table, nearest neighbour keeps the depth edges
+            if tile.scaled is None or tile.scaled.dtype != frame.dtype:
+                tile.scaled = np.zeros((height, width), dtype=frame.dtype)
+            cv2.resize(frame, (width, height), dst=tile.scaled, interpolation=cv2.INTER_NEAREST)
+            frame = tile.scaled
+        lut = self.depth_lut if tile.key[1] in DEPTH_STREAMS else GRAY_LUT
+        np.take(lut, frame, axis=0, out=tile.view, mode='clip')
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='mosaic', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        # the only thread calling into the OpenCV GUI
+        next_time = time.perf_counter()
+        while self._running:
+            cv2.imshow(self.window, self.compose())
+            cv2.waitKey(1)
+            self.rendered += 1
+            next_time += self.period
+            delay = next_time - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                # the GUI fell behind, show the next mosaic a period from now
+                next_time = time.perf_counter()
+        cv2.destroyWindow(self.window)
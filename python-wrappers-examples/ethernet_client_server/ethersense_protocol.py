@@ -0,0 +1,282 @@
+#!/usr/bin/python
+import struct
+import time
+
+import numpy as np
+from ethersense_codecs import CODECS, CODECS_BY_ID
+
+# Every frame is sent as a fixed size header followed by the frame buffer, encoded by the codec:
+#   magic, version, dtype code, codec id, stream id, pixel channels, frameset size, camera id, width, height,
+#   timestamp, frame id, payload length
+# The frames of one frameset share the frame id and are sent one after the other. The camera id tells
+# apart the cameras of one host, a server sends its camera as 0 and a replay numbers the recorded ones.
+MAGIC = b'ESNS'
+VERSION = 4
+HEADER = struct.Struct('<4sBBBBBBBHHdII')
+HEADER_TIMESTAMP = 10
+HEADER_CAMERA = 7
+
+DTYPES = {
+    0: np.dtype('<u2'),
+    1: np.dtype('u1'),
+    2: np.dtype('<f4'),
+}
+DTYPE_CODES = {dtype: code for code, dtype in DTYPES.items()}
+
+STREAMS = {
+    'depth': 0,
+    'color': 1,
+    'infrared': 2,
+    'aligned_depth': 3,
+}
+STREAM_NAMES = {stream_id: name for name, stream_id in STREAMS.items()}
+
+# the multicast ping a client sends to find servers, optionally followed by key=value options, a ping
+# without filters gets the depth filter chain of the server
+PING = 'EtherSensePing'
+PING_DEFAULTS = {'codec': 'raw', 'transport': 'tcp', 'fec': '0', 'streams': 'depth'}
+TRANSPORTS = ('tcp', 'udp')
+
+# NTP like clock exchange over the multicast port: the client sends a request stamped with its send
+# time, the server answers with the request's stamp and its own receive and send times
+#   magic, sequence, origin time, receive time, transmit time
+# Times are milliseconds, the unit of the frame timestamps.
+CLOCK_MAGIC = b'ESNC'
+CLOCK = struct.Struct('<4sIddd')
+
+
+class ProtocolError(Exception):
+    pass
+
+
+class FrameHeader(object):
+    __slots__ = ('dtype', 'codec', 'stream', 'channels', 'frameset_size', 'camera', 'width', 'height',
+                 'timestamp', 'frame_id', 'payload_length')
+
+    def __init__(self, dtype, codec, stream, channels, frameset_size, camera, width, height, timestamp, frame_id,
+                 payload_length):
+        self.dtype = dtype
+        self.codec = codec
+        self.stream = stream
+        self.channels = channels
+        self.frameset_size = frameset_size
+        self.camera = camera
+        self.width = width
+        self.height = height
+        self.timestamp = timestamp
+        self.frame_id = frame_id
+        self.payload_length = payload_length
+
+    @property
+    def shape(self):
+        if self.channels == 1:
+            return (self.height, self.width)
+        return (self.height, self.width, self.channels)
+
+
+def ping_message(codec_name=None, transport=None, fec_group=None, streams=None, filters=None):
+    if streams is not None:
+        streams = ','.join(streams)
+    options = [('codec', codec_name), ('transport', transport), ('fec', fec_group), ('streams', streams),
+               ('filters', filters)]
+    return ' '.join([PING] + ['%s=%s' % (key, value) for key, value in options if value is not None])
+
+
+def parse_ping(data):
+    """
+    Returns the options of a multicast ping as a dictionary, PING_DEFAULTS fills in the options the
+    client did not set. Raises ProtocolError when the message is not a ping.
+    """
+    words = data.decode(errors='replace').split()
+    if not words or words[0] != PING:
+        raise ProtocolError("unexpected multicast message {!r}".format(data))
+    options = dict(PING_DEFAULTS)
+    options.update(word.split('=', 1) for word in words[1:] if '=' in word)
+    return options
+
+
+def clock():
+    """
+    The local clock in milliseconds. The servers enable the global time of the camera, which puts the
+    frame timestamps on this clock as well.
+    """
+    return time.time() * 1000.0
+
+
+def is_clock_message(data):
+    return data[:len(CLOCK_MAGIC)] == CLOCK_MAGIC
+
+
+def clock_request(sequence, origin=None):
+    return CLOCK.pack(CLOCK_MAGIC, sequence & 0xffffffff, clock() if origin is None else origin, 0.0, 0.0)
+
+
+def clock_reply(request, received, transmitted=None):
+    """
+    Answers a clock request received at the local time received.
+    """
+    sequence, origin, _, _ = unpack_clock(request)
+    return CLOCK.pack(CLOCK_MAGIC, sequence, origin, received, clock() if transmitted is None else transmitted)
+
+
+def unpack_clock(data):
+    """
+    Returns (sequence, origin, received, transmitted) of a clock message.
+    """
+    if len(data) != CLOCK.size:
+        raise ProtocolError("clock message of {} bytes".format(len(data)))
+    magic, sequence, origin, received, transmitted = CLOCK.unpack(data)
+    if magic != CLOCK_MAGIC:
+        raise ProtocolError("bad clock magic {!r}".format(magic))
+    return sequence, origin, received, transmitted
+
+
+def parse_streams(value):
+    """
+    Returns the known stream names of a comma separated list, e.g. the streams option of a ping.
+    """
+    streams = []
+    for name in value.split(','):
+        if name not in STREAMS:
+            print('unknown stream %s' % name)
+        elif name not in streams:
+            streams.append(name)
+    return streams
+
+
+def pack_header(frame, timestamp, frame_id, payload_length, codec=CODECS['raw'], stream='depth',
+                frameset_size=1):
+    """
+    Builds the header for a 2D or (height, width, channels) frame whose encoded payload is
+    payload_length bytes long.
+    """
+    dtype = frame.dtype.newbyteorder('<') if frame.dtype.byteorder == '>' else frame.dtype
+    code = DTYPE_CODES.get(np.dtype(dtype))
+    if code is None:
+        raise ProtocolError("dtype {} can not be sent".format(frame.dtype))
+    height, width = frame.shape[:2]
+    channels = frame.shape[2] if frame.ndim == 3 else 1
+    return HEADER.pack(MAGIC, VERSION, code, codec.codec_id, STREAMS[stream], channels, frameset_size, 0,
+                       width, height, timestamp, frame_id & 0xffffffff, payload_length)
+
+
+def unpack_header(data):
+    (magic, version, code, codec_id, stream_id, channels, frameset_size, camera, width, height, timestamp,
+     frame_id, payload_length) = HEADER.unpack(data)
+    if magic != MAGIC:
+        raise ProtocolError("bad magic {!r}, the stream is out of sync".format(magic))
+    if version != VERSION:
+        raise ProtocolError("unsupported protocol version {}".format(version))
+    if code not in DTYPES:
+        raise ProtocolError("unknown dtype code {}".format(code))
+    if codec_id not in CODECS_BY_ID:
+        raise ProtocolError("unknown codec id {}".format(codec_id))
+    if stream_id not in STREAM_NAMES:
+        raise ProtocolError("unknown stream id {}".format(stream_id))
+    return FrameHeader(DTYPES[code], CODECS_BY_ID[codec_id], STREAM_NAMES[stream_id], channels, frameset_size,
+                       camera, width, height, timestamp, frame_id, payload_length)
+
+
+def frame_buffers(frame, timestamp, frame_id, codec=CODECS['raw'], stream='depth', frameset_size=1):
+    """
+    Returns the [header, payload] buffers of a frame, written to the connection one after the other.
+    With the raw codec the payload is a view on the frame and is not copied.
+    """
+    payload = memoryview(codec.encode(frame)).cast('B')
+    header = pack_header(frame, timestamp, frame_id, len(payload), codec, stream, frameset_size)
+    return [memoryview(header), payload]
+
+
+async def read_message(reader):
+    """
+    Reads one frame from an asyncio StreamReader without decoding it, returns (header, header bytes,
+    encoded payload). Raises asyncio.IncompleteReadError when the peer closed the connection.
+    """
+    header_bytes = await reader.readexactly(HEADER.size)
+    header = unpack_header(header_bytes)
+    payload = await reader.readexactly(header.payload_length)
+    return header, header_bytes, payload
+
+
+async def read_frame(reader):
+    """
+    Reads one frame from an asyncio StreamReader, returns (header, frame).
+    Raises asyncio.IncompleteReadError when the peer closed the connection.
+    """
+    header, _, payload = await read_message(reader)
+    return header, decode_frame(header, payload)
+
+
+def decode_frame(header, payload):
+    return header.codec.decode(payload, header.dtype, header.shape)
+
+
+def split_message(message):
+    """
+    Splits a message holding several frames one after the other, e.g. a frameset, into a list of
+    (header, header bytes, encoded payload) without copying.
+    """
+    frames = []
+    offset = 0
+    while offset < len(message):
+        header_bytes = message[offset:offset + HEADER.size]
+        header = unpack_header(header_bytes)
+        end = offset + HEADER.size + header.payload_length
+        if len(message) < end:
+            raise ProtocolError("the frame message is truncated")
+        frames.append((header, header_bytes, message[offset + HEADER.size:end]))
+        offset = end
+    return frames
+
+
+def unpack_frame(message):
+    """
+    Decodes a complete frame message (header and payload in one buffer), returns (header, frame).
+    """
+    header, _, payload = split_message(message)[0]
+    return header, decode_frame(header, payload)
+
+
+def unpack_frames(message):
+    """
+    Decodes a message holding several frames one after the other, e.g. a frameset, returns a list of
+    (header, frame).
+    """
+    return [(header, decode_frame(header, payload)) for header, _, payload in split_message(message)]
+
+
+def restamp_header(header_bytes, timestamp, camera=None):
+    """
+    Returns a copy of a packed header with another timestamp, and another camera id unless camera is None.
+    """
+    fields = list(HEADER.unpack(header_bytes))
+    fields[HEADER_TIMESTAMP] = timestamp
+    if camera is not None:
+        fields[HEADER_CAMERA] = camera
+    return HEADER.pack(*fields)
+
+
+class FramesetCollector(object):
+    """
+    Groups the frames of one frameset, which share the frame id and arrive one after the other.
+    add returns (frame_id, timestamp, {stream: frame}) once all frameset_size frames are there, a frameset
+    that is interrupted by the next one is dropped.
+    """
+    def __init__(self):
+        self.frame_id = None
+        self.timestamp = None
+        self.frames = {}
+        self.dropped = 0
+
+    def add(self, header, frame):
+        if header.frame_id != self.frame_id:
+            if self.frames:
+                self.dropped += 1
+            self.frame_id = header.frame_id
+            self.timestamp = header.timestamp
+            self.frames = {}
+        self.frames[header.stream] = frame
+        if len(self.frames) < header.frameset_size:
+            return None
+        frames, self.frames = self.frames, {}
+        return self.frame_id, self.timestamp, frames
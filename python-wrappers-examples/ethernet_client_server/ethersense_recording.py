@@ -0,0 +1,172 @@
+#!/usr/bin/python
+import mmap
+import os
+
+import numpy as np
+
+from ethersense_protocol import HEADER, unpack_header
+
+# Recordings of the frames a client received, kept as they came over the wire: the header and the still
+# encoded payload of every frame are appended to a segment file of its camera, the client clock time of
+# the frame and its offset in the segment to a sidecar index file:
+#   <directory>/<camera>/<segment number>.esns   frame messages one after the other
+#   <directory>/<camera>/<segment number>.idx    INDEX records, one per frame
+SEGMENT_SUFFIX = '.esns'
+INDEX_SUFFIX = '.idx'
+INDEX = np.dtype([('time', '<f8'), ('offset', '<u8')])
+SEGMENT_SIZE = 256 * 1024 * 1024
+
+
+def camera_name(address, camera_id):
+    """
+    Names a camera by the address of its host and the camera id of its frame headers, the same camera gets
+    the same name when it reconnects, e.g. 192.168.0.5#0.
+    """
+    return '%s#%d' % (address, camera_id)
+
+
+def camera_directory(camera):
+    return camera.replace(':', '_').replace('/', '_')
+
+
+def segment_numbers(directory):
+    return sorted(int(name[:-len(INDEX_SUFFIX)]) for name in os.listdir(directory)
+                  if name.endswith(INDEX_SUFFIX) and name[:-len(INDEX_SUFFIX)].isdigit())
+
+
+class _SegmentWriter(object):
+    def __init__(self, directory, number):
+        self.number = number
+        path = os.path.join(directory, '%05d' % number)
+        self.segment = open(path + SEGMENT_SUFFIX, 'ab')
+        self.index = open(path + INDEX_SUFFIX, 'ab')
+        self.size = self.segment.tell()
+
+    def write(self, buffers, time):
+        offset = self.size
+        for buffer in buffers:
+            self.segment.write(buffer)
+            self.size += len(buffer)
+        # the frame reaches the file before its index record, an index never points past its segment
+        self.segment.flush()
+        self.index.write(np.array([(time, offset)], dtype=INDEX).tobytes())
+        self.index.flush()
+
+    def close(self):
+        self.segment.close()
+        self.index.close()
+
+
+class FrameRecorder(object):
+    """
+    Appends the received frames of every camera to the segments of the camera, a segment is closed
+    once it holds segment_size bytes. Segments and indexes only ever grow, a recording that was cut
+    off at any point replays up to its last complete frame.
+
+    Methods
+    _______
+    write(self, camera, header_bytes, payload, time):
+
+    close(self):
+    """
+    def __init__(self, directory, segment_size=SEGMENT_SIZE):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.writers = {}
+        self.frames = 0
+        self.bytes = 0
+
+    def write(self, camera, header_bytes, payload, time):
+        """
+        Appends a frame received from camera at the client clock time, in milliseconds.
+        """
+        writer = self.writers.get(camera)
+        if writer is None or writer.size >= self.segment_size:
+            directory = os.path.join(self.directory, camera_directory(camera))
+            if writer is None:
+                # a camera that reconnects continues its recording in a new segment
+                os.makedirs(directory, exist_ok=True)
+                number = max(segment_numbers(directory) or [-1]) + 1
+            else:
+                writer.close()
+                number = writer.number + 1
+            writer = self.writers[camera] = _SegmentWriter(directory, number)
+        writer.write((header_bytes, payload), time)
+        self.frames += 1
+        self.bytes += len(header_bytes) + len(payload)
+
+    def close(self, camera=None):
+        """
+        Closes the segments of a camera, or of every camera.
+        """
+        for name in [camera] if camera is not None else list(self.writers):
+            writer = self.writers.pop(name, None)
+            if writer is not None:
+                writer.close()
+
+
+class Recording(object):
+    """
+    Reads the segments of a FrameRecorder directory, cameras are the names of the recorded cameras.
+
+    Methods
+    _______
+    index(self, camera, number):
+
+    time_range(self, camera):
+
+    frames(self, camera, start=None):
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.cameras = sorted(name for name in os.listdir(directory)
+                              if os.path.isdir(os.path.join(directory, name)))
+
+    def _path(self, camera, number):
+        return os.path.join(self.directory, camera, '%05d' % number)
+
+    def index(self, camera, number):
+        """
+        Returns the INDEX records of a segment, without a record that was cut off while written.
+        """
+        with open(self._path(camera, number) + INDEX_SUFFIX, 'rb') as index_file:
+            data = index_file.read()
+        return np.frombuffer(data[:len(data) - len(data) % INDEX.itemsize], dtype=INDEX)
+
+    def time_range(self, camera):
+        """
+        Returns the client clock times of the first and the last frame of a camera.
+        """
+        times = [self.index(camera, number)['time']
+                 for number in segment_numbers(os.path.join(self.directory, camera))]
+        times = [segment for segment in times if len(segment)]
+        if not times:
+            return None, None
+        return float(times[0][0]), float(times[-1][-1])
+
+    def frames(self, camera, start=None):
+        """
+        Yields (time, header, header bytes, payload) for the frames of a camera in the order they were
+        received, from the first frame at or after the client clock time start. header bytes and
+        payload are views on the memory mapped segment.
+        """
+        for number in segment_numbers(os.path.join(self.directory, camera)):
+            index = self.index(camera, number)
+            if start is not None:
+                index = index[np.searchsorted(index['time'], start):]
+            if not len(index):
+                continue
+            with open(self._path(camera, number) + SEGMENT_SUFFIX, 'rb') as segment_file:
+                size = os.fstat(segment_file.fileno()).st_size
+                if not size:
+                    continue
+                data = memoryview(mmap.mmap(segment_file.fileno(), 0, access=mmap.ACCESS_READ))
+            for time, offset in index:
+                end = int(offset) + HEADER.size
+                if end > size:
+                    break
+                header_bytes = data[int(offset):end]
+                header = unpack_header(header_bytes)
+                if end + header.payload_length > size:
+                    break
+                yield float(time), header, header_bytes, data[end:end + header.payload_length]
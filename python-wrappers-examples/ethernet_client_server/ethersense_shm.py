@@ -0,0 +1,242 @@
+#!/usr/bin/python
+import json
+import struct
+import time
+
+import numpy as np
+
+try:
+    from multiprocessing import shared_memory, resource_tracker
+except ImportError:
+    # Python 3.8 and newer only
+    shared_memory = None
+
+# Framesets of the camera for processes on the same machine. The server writes every frameset into a
+# ring of fixed size slots in one shared memory block, the readers attach by name and get NumPy views on
+# the slots without copying. The block holds:
+#   ring header: magic, version, slot count, slot size, layout length, then the newest sequence at 32
+#   layout: JSON list of the streams with dtype, shape and offset within a slot
+#   slots: seqlock counter, sequence, timestamp, then the frames
+# The counter of a slot is odd while the producer writes it, a reader checks that it is even and
+# unchanged before and after using the slot.
+MAGIC = b'ESHM'
+VERSION = 1
+RING = struct.Struct('<4sBxxxIQI')
+LATEST_OFFSET = 32
+LAYOUT_OFFSET = 64
+SLOT_HEADER_SIZE = 64
+ALIGNMENT = 64
+
+
+def _align(size):
+    return -(-size // ALIGNMENT) * ALIGNMENT
+
+
+def _attach(name):
+    if shared_memory is None:
+        raise RuntimeError("shared memory frames need Python 3.8 or newer")
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        pass
+    # before Python 3.13 an attached block is registered with the resource tracker, which unlinks it
+    # when the reader exits, while the block belongs to the producer
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+
+class _SlotRing(object):
+    # the views shared by the producer and the readers of a block
+    def __init__(self, block, slots, slot_size, layout, data_offset):
+        self.block = block
+        self.slots = slots
+        self.layout = layout
+        buffer = block.buf
+        self.latest = np.ndarray((1,), dtype=np.int64, buffer=buffer, offset=LATEST_OFFSET)
+        self.counters = np.ndarray((slots,), dtype=np.uint64, buffer=buffer, offset=data_offset,
+                                   strides=(slot_size,))
+        self.sequences = np.ndarray((slots,), dtype=np.int64, buffer=buffer, offset=data_offset + 8,
+                                    strides=(slot_size,))
+        self.timestamps = np.ndarray((slots,), dtype=np.float64, buffer=buffer, offset=data_offset + 16,
+                                     strides=(slot_size,))
+        self.frames = [{stream['stream']: np.ndarray(stream['shape'], dtype=np.dtype(stream['dtype']),
+                                                     buffer=buffer,
+                                                     offset=data_offset + index * slot_size + stream['offset'])
+                        for stream in layout}
+                       for index in range(slots)]
+
+    def release(self):
+        # the views export the buffer of the block, which can only be closed without them
+        self.latest = self.counters = self.sequences = self.timestamps = None
+        self.frames = []
+        try:
+            self.block.close()
+        except BufferError:
+            # a frameset is still referenced, the mapping goes away with it
+            pass
+
+
+class SharedFramePublisher(object):
+    """
+    The producer side of a shared memory frame ring.
+
+    The block is created for the streams, shapes and dtypes of the first frameset, frames (a dictionary
+    by stream name) of every later frameset must match them. publish never waits for the readers.
+
+    Methods
+    _______
+    publish(self, frames, timestamp):
+
+    close(self):
+    """
+    def __init__(self, name, frames, slots=4):
+        if shared_memory is None:
+            raise RuntimeError("shared memory frames need Python 3.8 or newer")
+        if slots < 2:
+            raise ValueError("a ring needs at least 2 slots")
+        layout = []
+        offset = SLOT_HEADER_SIZE
+        for stream, frame in sorted(frames.items()):
+            layout.append({'stream': stream, 'dtype': frame.dtype.str, 'shape': list(frame.shape),
+                           'offset': offset})
+            offset += _align(frame.nbytes)
+        slot_size = offset
+        encoded = json.dumps(layout).encode()
+        data_offset = _align(LAYOUT_OFFSET + len(encoded))
+        self.name = name
+        self.sequence = -1
+        block = shared_memory.SharedMemory(name=name, create=True, size=data_offset + slots * slot_size)
+        RING.pack_into(block.buf, 0, MAGIC, VERSION, slots, slot_size, len(encoded))
+        block.buf[LAYOUT_OFFSET:LAYOUT_OFFSET + len(encoded)] = encoded
+        self.ring = _SlotRing(block, slots, slot_size, layout, data_offset)
+        self.ring.latest[0] = -1
+
+    def publish(self, frames, timestamp):
+        ring = self.ring
+        sequence = self.sequence + 1
+        index = sequence % ring.slots
+        slot = ring.frames[index]
+        for stream, frame in frames.items():
+            view = slot.get(stream)
+            if view is None or view.shape != frame.shape or view.dtype != frame.dtype:
+                raise ValueError("frame {} {} {} does not fit the shared memory layout".format(
+                    stream, frame.shape, frame.dtype))
+        # odd while the slot is written
+        ring.counters[index] += 1
+        for stream, frame in frames.items():
+            slot[stream][...] = frame
+        ring.sequences[index] = sequence
+        ring.timestamps[index] = timestamp
+        ring.counters[index] += 1
+        ring.latest[0] = sequence
+        self.sequence = sequence
+
+    def close(self):
+        block = self.ring.block
+        self.ring.release()
+        block.unlink()
+
+
+class SharedFrameset(object):
+    """
+    A frameset read from shared memory. The frames are read only views on the slot, which the producer
+    overwrites once it has gone around the ring: valid() tells whether they still hold this frameset,
+    copy() returns copies of them that are known to be intact.
+    """
+    __slots__ = ('sequence', 'timestamp', 'frames', '_ring', '_index', '_counter')
+
+    def __init__(self, sequence, timestamp, frames, ring, index, counter):
+        self.sequence = sequence
+        self.timestamp = timestamp
+        self.frames = frames
+        self._ring = ring
+        self._index = index
+        self._counter = counter
+
+    def valid(self):
+        return self._ring.counters is not None and self._ring.counters[self._index] == self._counter
+
+    def copy(self):
+        """
+        Returns a dictionary of copies of the frames, or None when the slot was overwritten meanwhile.
+        """
+        frames = {stream: frame.copy() for stream, frame in self.frames.items()}
+        return frames if self.valid() else None
+
+
+class SharedFrameReader(object):
+    """
+    Attaches to the shared memory frame ring of a SharedFramePublisher by name.
+
+    Framesets are read in order from the newest one at attach time. A reader that falls more than
+    slots - 2 framesets behind skips ahead to the newest frameset, it never holds up the producer,
+    the framesets skipped are counted in skipped.
+
+    Methods
+    _______
+    read(self):
+
+    wait(self, timeout=None, poll_interval=0.001):
+
+    close(self):
+    """
+    def __init__(self, name):
+        block = _attach(name)
+        magic, version, slots, slot_size, layout_length = RING.unpack_from(block.buf, 0)
+        if magic != MAGIC or version != VERSION:
+            block.close()
+            raise ValueError("{} is not an EtherSense frame ring".format(name))
+        layout = json.loads(bytes(block.buf[LAYOUT_OFFSET:LAYOUT_OFFSET + layout_length]).decode())
+        self.ring = _SlotRing(block, slots, slot_size, layout, _align(LAYOUT_OFFSET + layout_length))
+        for frames in self.ring.frames:
+            for frame in frames.values():
+                frame.flags.writeable = False
+        self.streams = [stream['stream'] for stream in layout]
+        self.cursor = max(int(self.ring.latest[0]), 0)
+        self.skipped = 0
+
+    def read(self):
+        """
+        Returns the next SharedFrameset, or None when the producer has not published it yet.
+        """
+        ring = self.ring
+        while True:
+            latest = int(ring.latest[0])
+            if latest < self.cursor:
+                return None
+            # the slot after the newest one may be being written
+            if self.cursor < latest - ring.slots + 2:
+                self.skipped += latest - self.cursor
+                self.cursor = latest
+            index = self.cursor % ring.slots
+            counter = ring.counters[index]
+            if counter % 2 == 0 and ring.sequences[index] == self.cursor:
+                timestamp = float(ring.timestamps[index])
+                if ring.counters[index] == counter:
+                    frameset = SharedFrameset(self.cursor, timestamp, ring.frames[index], ring, index, counter)
+                    self.cursor += 1
+                    return frameset
+            # overwritten while we looked at it, the producer has moved on
+            cursor = max(self.cursor + 1, int(ring.latest[0]))
+            self.skipped += cursor - self.cursor
+            self.cursor = cursor
+
+    def wait(self, timeout=None, poll_interval=0.001):
+        """
+        Polls for the next frameset, returns None after timeout seconds without one.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            frameset = self.read()
+            if frameset is not None:
+                return frameset
+            if deadline is not None and time.monotonic() > deadline:
+                return None
+            time.sleep(poll_interval)
+
+    def close(self):
+        self.ring.release()
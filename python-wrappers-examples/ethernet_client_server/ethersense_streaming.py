@@ -0,0 +1,379 @@
+#!/usr/bin/python
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from ethersense_protocol import frame_buffers, read_frame
+from ethersense_udp import FrameFragmenter
+from ethersense_shm import SharedFramePublisher
+
+# asyncio building blocks shared by EtherSenseServer.py and EtherSenseClient.py, free of any camera
+# or window code so they also run against synthetic frames.
+
+
+def frame_key(stream, filters=None):
+    """
+    The key of a stream in a published frameset. A stream may be published once per filter chain in
+    use, under the key 'stream/filters'.
+    """
+    return stream if filters is None else '%s/%s' % (stream, filters)
+
+
+def key_stream(key):
+    return key.split('/', 1)[0]
+
+
+class RingSlot(object):
+    """
+    One published frameset, a dictionary of frames by frame key (see frame_key). The encoded payload
+    of a frame is built once per codec and shared by every subscriber using that codec.
+    """
+    __slots__ = ('sequence', 'frames', 'timestamp', '_encoded')
+
+    def __init__(self, sequence, frames, timestamp):
+        self.sequence = sequence
+        self.frames = frames
+        self.timestamp = timestamp
+        self._encoded = {}
+
+    def buffers(self, key, codec, frameset_size=1):
+        """
+        Returns an awaitable of the [header, payload] buffers of one frame encoded with codec.
+        """
+        encoded = self._encoded.get((key, codec.name, frameset_size))
+        if encoded is None:
+            loop = asyncio.get_event_loop()
+            arguments = (self.frames[key], self.timestamp, self.sequence, codec, key_stream(key),
+                         frameset_size)
+            if codec.name == 'raw':
+                # the raw payload is a view on the frame, there is nothing to offload
+                encoded = loop.create_future()
+                encoded.set_result(frame_buffers(*arguments))
+            else:
+                encoded = loop.run_in_executor(None, frame_buffers, *arguments)
+            self._encoded[(key, codec.name, frameset_size)] = encoded
+        return encoded
+
+    async def frameset_buffers(self, codecs):
+        """
+        Returns the buffers of the frames of codecs (a dictionary of codecs by frame key) present in
+        this frameset, one frame after the other.
+        """
+        keys = [key for key in codecs if key in self.frames]
+        encoded = await asyncio.gather(*[self.buffers(key, codecs[key], len(keys)) for key in keys])
+        return [buffer for buffers in encoded for buffer in buffers]
+
+
+class FrameRing(object):
+    """
+    The last size framesets of a camera, written by one capture loop and read by many subscribers.
+
+    Every subscriber keeps its own cursor: frames are delivered in order while the subscriber keeps up,
+    one that falls more than size frames behind skips ahead to the newest frame.
+    """
+    def __init__(self, size=3):
+        self.slots = [None] * size
+        self.sequence = -1
+        self.closed = False
+        self._published = asyncio.Event()
+
+    def publish(self, frames, timestamp):
+        self.sequence += 1
+        slot = RingSlot(self.sequence, frames, timestamp)
+        self.slots[self.sequence % len(self.slots)] = slot
+        # wake the waiting subscribers, later waiters wait on a fresh event
+        published, self._published = self._published, asyncio.Event()
+        published.set()
+        return slot
+
+    def close(self):
+        self.closed = True
+        self._published.set()
+
+    async def next(self, cursor):
+        """
+        Waits until the frame at cursor is published, returns it or the newest frame when the frame
+        at cursor has already been overwritten. Raises EOFError once the ring is closed.
+        """
+        while self.sequence < cursor:
+            if self.closed:
+                raise EOFError("frame source closed")
+            await self._published.wait()
+        if cursor <= self.sequence - len(self.slots):
+            cursor = self.sequence
+        return self.slots[cursor % len(self.slots)]
+
+
+class Subscription(object):
+    """
+    Sends the framesets of a FrameRing to one connection.
+
+    codecs is a dictionary of codecs by frame key, it selects the streams the client gets and how
+    each of them is encoded. The subscription waits for the socket to drain before it moves its cursor,
+    so a slow viewer skips the framesets it could not keep up with instead of buffering them.
+    """
+    def __init__(self, ring, address, reader, writer, codecs):
+        self.ring = ring
+        self.address = address
+        self.reader = reader
+        self.writer = writer
+        self.codecs = codecs
+        # the frameset in the ring may be from before the capture paused, start with the next one
+        self.cursor = ring.sequence + 1
+        self.sent = 0
+        self.dropped = 0
+        self.last_seen = time.monotonic()
+        self.last_sent = self.last_seen
+        self.task = None
+
+    def touch(self):
+        self.last_seen = time.monotonic()
+
+    def idle(self, now, timeout):
+        # neither a keep alive ping nor a sent frame within the timeout
+        return now - self.last_seen > timeout or now - self.last_sent > timeout
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+
+    async def run(self):
+        watch = asyncio.ensure_future(self._watch_peer()) if self.reader is not None else None
+        try:
+            while True:
+                slot = await self.ring.next(self.cursor)
+                self.dropped += slot.sequence - self.cursor
+                # shielded, the encoding is shared with the other subscribers
+                buffers = await asyncio.shield(slot.frameset_buffers(self.codecs))
+                # empty when none of the streams of this client is in the frameset
+                if buffers and await self.send(buffers, slot.sequence):
+                    self.sent += 1
+                    self.last_sent = time.monotonic()
+                elif buffers:
+                    self.dropped += 1
+                self.cursor = slot.sequence + 1
+        except (EOFError, ConnectionError):
+            pass
+        finally:
+            if watch is not None:
+                watch.cancel()
+            self.close()
+
+    async def send(self, buffers, frame_id):
+        """
+        Sends the buffers of a frameset, returns False when the frameset was skipped.
+        """
+        for buffer in buffers:
+            self.writer.write(buffer)
+        await self.writer.drain()
+        return True
+
+    def close(self):
+        self.writer.close()
+
+    async def _watch_peer(self):
+        # the client never sends anything, reading only notices when it goes away
+        try:
+            while await self.reader.read(1024):
+                pass
+        except ConnectionError:
+            pass
+        self.stop()
+
+
+class DatagramSubscription(Subscription):
+    """
+    Sends the framesets of a FrameRing as datagrams to one client, see ethersense_udp.py. All frames
+    of a frameset go into one fragmented message.
+
+    There is no drain to wait for, a frameset is skipped while the datagrams of the previous one are
+    still queued in the transport. A client that goes away is only noticed by its missing keep alive
+    pings.
+    """
+    def __init__(self, ring, address, transport, codecs, fec_group=0):
+        Subscription.__init__(self, ring, address, None, None, codecs)
+        self.transport = transport
+        self.fragmenter = FrameFragmenter(fec_group=fec_group)
+
+    async def send(self, buffers, frame_id):
+        if self.transport.is_closing():
+            raise EOFError("transport closed")
+        if self.transport.get_write_buffer_size():
+            return False
+        for datagram in self.fragmenter.fragments(buffers, frame_id):
+            self.transport.sendto(datagram)
+        return True
+
+    def close(self):
+        self.transport.close()
+
+
+class SharedMemorySubscription(Subscription):
+    """
+    Writes the framesets of a FrameRing into a shared memory frame ring for the processes on the same
+    machine, see ethersense_shm.py. keys are the frame keys written, each under its stream name. The
+    block is created with the first frameset and removed when the subscription ends, it is never idle.
+    """
+    def __init__(self, ring, name, keys, slots=4):
+        Subscription.__init__(self, ring, 'shared memory %s' % name, None, None, {})
+        self.name = name
+        self.keys = keys
+        self.slots = slots
+        self.shared = None
+
+    def idle(self, now, timeout):
+        return False
+
+    async def run(self):
+        try:
+            while True:
+                slot = await self.ring.next(self.cursor)
+                self.dropped += slot.sequence - self.cursor
+                frames = {key_stream(key): slot.frames[key] for key in self.keys if key in slot.frames}
+                if frames:
+                    if self.shared is None:
+                        self.shared = SharedFramePublisher(self.name, frames, self.slots)
+                    # a copy into the slot, the readers never hold up the camera
+                    self.shared.publish(frames, slot.timestamp)
+                    self.sent += 1
+                self.cursor = slot.sequence + 1
+        except EOFError:
+            pass
+        finally:
+            self.close()
+
+    def close(self):
+        if self.shared is not None:
+            self.shared.close()
+            self.shared = None
+
+
+class CameraPublisher(object):
+    """
+    Runs one capture loop for a camera and fans its framesets out to every subscriber.
+
+    read_frame() returns (frames, timestamp) with a dictionary of frames by frame key, or (None, None)
+    when no frame was available, and runs in a thread of its own so wait_for_frames never blocks the
+    event loop. Every frameset is captured, filtered and published once however many clients are
+    subscribed, the capture pauses while there are none.
+    Subscriptions are kept by client address and dropped after idle_timeout seconds without a keep
+    alive ping or a sent frame.
+
+    Methods
+    _______
+    subscribe(self, address, reader, writer, codecs):
+
+    subscribe_datagrams(self, address, transport, codecs, fec_group=0):
+
+    subscribe_shared(self, name, keys, slots=4):
+
+    touch(self, address):
+
+    reap_idle(self):
+
+    close(self):
+    """
+    def __init__(self, read_frame, ring_size=3, idle_timeout=10.0, executor=None):
+        self.read_frame = read_frame
+        self.ring = FrameRing(ring_size)
+        self.idle_timeout = idle_timeout
+        self.executor = executor or ThreadPoolExecutor(max_workers=1)
+        self.subscriptions = {}
+        self.captured = 0
+        self._capture = None
+        self._reaper = None
+
+    def subscribe(self, address, reader, writer, codecs):
+        """
+        Starts sending framesets to a connection, replacing an older subscription of the same address.
+        codecs is a dictionary of codecs by frame key.
+        """
+        return self._add(Subscription(self.ring, address, reader, writer, codecs))
+
+    def subscribe_datagrams(self, address, transport, codecs, fec_group=0):
+        """
+        Starts sending framesets as datagrams through a transport connected to the client.
+        """
+        return self._add(DatagramSubscription(self.ring, address, transport, codecs, fec_group))
+
+    def subscribe_shared(self, name, keys, slots=4):
+        """
+        Starts writing the frames of keys into the shared memory frame ring name, which keeps the
+        capture running without any client.
+        """
+        return self._add(SharedMemorySubscription(self.ring, name, keys, slots))
+
+    def _add(self, subscription):
+        old = self.subscriptions.get(subscription.address)
+        if old is not None:
+            old.stop()
+        subscription.task = asyncio.ensure_future(self._run_subscription(subscription))
+        self.subscriptions[subscription.address] = subscription
+        if self._capture is None or self._capture.done():
+            self._capture = asyncio.ensure_future(self._capture_loop())
+        if self.idle_timeout and (self._reaper is None or self._reaper.done()):
+            self._reaper = asyncio.ensure_future(self._reap_loop())
+        return subscription
+
+    def touch(self, address):
+        """
+        Refreshes the subscription of an address, returns False when the address is not subscribed.
+        """
+        subscription = self.subscriptions.get(address)
+        if subscription is None:
+            return False
+        subscription.touch()
+        return True
+
+    def reap_idle(self):
+        now = time.monotonic()
+        for subscription in list(self.subscriptions.values()):
+            if subscription.idle(now, self.idle_timeout):
+                print('dropping idle subscription of %s' % (subscription.address,))
+                subscription.stop()
+
+    def close(self):
+        for subscription in list(self.subscriptions.values()):
+            subscription.stop()
+        self.ring.close()
+        if self._reaper is not None:
+            self._reaper.cancel()
+
+    async def _run_subscription(self, subscription):
+        try:
+            await subscription.run()
+        finally:
+            if self.subscriptions.get(subscription.address) is subscription:
+                del self.subscriptions[subscription.address]
+
+    async def _capture_loop(self):
+        loop = asyncio.get_event_loop()
+        try:
+            while self.subscriptions and not self.ring.closed:
+                frames, timestamp = await loop.run_in_executor(self.executor, self.read_frame)
+                if frames:
+                    self.ring.publish(frames, timestamp)
+                    self.captured += 1
+        except Exception as error:
+            print('Exception occured: {}'.format(error))
+            self.close()
+
+    async def _reap_loop(self):
+        while self.subscriptions:
+            await asyncio.sleep(min(1.0, self.idle_timeout))
+            self.reap_idle()
+
+
+async def receive_frames(reader, handle_frame):
+    """
+    Calls handle_frame(header, frame) for every frame until the peer closes the connection,
+    returns the number of frames received.
+    """
+    count = 0
+    while True:
+        try:
+            header, frame = await read_frame(reader)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return count
+        handle_frame(header, frame)
+        count += 1
@@ -0,0 +1,221 @@
+#!/usr/bin/python
+import struct
+import time
+
+import numpy as np
+
+# Datagram transport for EtherSense. A frame message (frame header and encoded payload, see
+# ethersense_protocol.py) is split into fragments that fit into one datagram, every fragment starts with:
+#   magic, frame id, fragment index, data fragment count, message length, FEC group size
+# With a FEC group size g > 0, every g data fragments are followed by a parity fragment holding their XOR,
+# parity fragment k has the index count + k. A lost fragment per group is rebuilt from the parity.
+MAGIC = b'ESNF'
+FRAGMENT = struct.Struct('<4sIHHIB')
+# leaves room for the IP and UDP headers in a 1500 byte Ethernet MTU
+DATAGRAM_SIZE = 1400
+
+
+class FrameFragmenter(object):
+    """
+    Splits frame messages into datagrams. The datagrams are rows of one reused array, they are valid
+    until the next call to fragments.
+    """
+    def __init__(self, datagram_size=DATAGRAM_SIZE, fec_group=0):
+        if not 0 <= fec_group < 256:
+            raise ValueError("fec_group has to be between 0 and 255")
+        self.datagram_size = datagram_size
+        self.fragment_size = datagram_size - FRAGMENT.size
+        self.fec_group = fec_group
+        self._datagrams = np.zeros((0, datagram_size), dtype=np.uint8)
+        self._message = np.zeros(0, dtype=np.uint8)
+
+    def fragments(self, buffers, frame_id):
+        """
+        Returns the datagrams of a message given as a list of buffers, e.g. the result of frame_buffers.
+        """
+        length = sum(len(buffer) for buffer in buffers)
+        count = max(-(-length // self.fragment_size), 1)
+        if count > 0xffff:
+            raise ValueError("a message of {} bytes does not fit into {} fragments".format(length, 0xffff))
+        parity_count = -(-count // self.fec_group) if self.fec_group else 0
+        rows = count + parity_count
+        if len(self._datagrams) < rows:
+            self._datagrams = np.zeros((rows, self.datagram_size), dtype=np.uint8)
+        if len(self._message) < count * self.fragment_size:
+            self._message = np.zeros(count * self.fragment_size, dtype=np.uint8)
+
+        message = self._message[:count * self.fragment_size]
+        offset = 0
+        for buffer in buffers:
+            message[offset:offset + len(buffer)] = np.frombuffer(buffer, dtype=np.uint8)
+            offset += len(buffer)
+        # the padding of the last fragment is part of the parity
+        message[offset:] = 0
+        self._datagrams[:count, FRAGMENT.size:] = message.reshape(count, -1)
+
+        if parity_count:
+            groups = np.zeros((parity_count * self.fec_group, self.fragment_size), dtype=np.uint8)
+            groups[:count] = self._datagrams[:count, FRAGMENT.size:]
+            np.bitwise_xor.reduce(groups.reshape(parity_count, self.fec_group, -1), axis=1,
+                                  out=self._datagrams[count:rows, FRAGMENT.size:])
+
+        for index in range(rows):
+            FRAGMENT.pack_into(self._datagrams[index], 0, MAGIC, frame_id & 0xffffffff, index, count, length,
+                               self.fec_group)
+        return [memoryview(self._datagrams[index]) for index in range(rows)]
+
+
+class _AssemblySlot(object):
+    def __init__(self):
+        self.active = False
+        self.frame_id = None
+        self.started = 0.0
+        self.count = 0
+        self.length = 0
+        self.group = 0
+        self.missing = 0
+        self.data = np.zeros((0, 0), dtype=np.uint8)
+        self.received = np.zeros(0, dtype=bool)
+        self.parity = np.zeros((0, 0), dtype=np.uint8)
+        self.parity_received = np.zeros(0, dtype=bool)
+
+    def reset(self, frame_id, count, length, group, fragment_size, now):
+        self.active = True
+        self.frame_id = frame_id
+        self.started = now
+        self.count = count
+        self.length = length
+        self.group = group
+        self.missing = count
+        parity_count = -(-count // group) if group else 0
+        # the buffers only ever grow, so a slot stops allocating once it has seen the largest frame
+        if self.data.shape[0] < count or self.data.shape[1] != fragment_size:
+            self.data = np.zeros((count, fragment_size), dtype=np.uint8)
+            self.received = np.zeros(count, dtype=bool)
+        if self.parity.shape[0] < parity_count or self.parity.shape[1] != fragment_size:
+            self.parity = np.zeros((parity_count, fragment_size), dtype=np.uint8)
+            self.parity_received = np.zeros(parity_count, dtype=bool)
+        self.received[:count] = False
+        self.parity_received[:parity_count] = False
+
+    def message(self):
+        return memoryview(self.data[:self.count].reshape(-1))[:self.length]
+
+
+class FrameAssembler(object):
+    """
+    Reassembles the fragments of one sender into frame messages.
+
+    Fragments are copied into a few preallocated slots, one per frame in flight. Frames are delivered in
+    order: when a frame completes, older incomplete frames are dropped, and so is a frame that is still
+    incomplete deadline seconds after its first fragment arrived. Late fragments of delivered or dropped
+    frames are ignored.
+
+    Methods
+    _______
+    add(self, datagram, now=None):
+
+    expire(self, now=None):
+    """
+    def __init__(self, slots=4, deadline=0.1, datagram_size=DATAGRAM_SIZE):
+        self.fragment_size = datagram_size - FRAGMENT.size
+        self.deadline = deadline
+        self._slots = [_AssemblySlot() for _ in range(slots)]
+        self._last_frame = None
+        self.completed = 0
+        self.dropped = 0
+        self.recovered = 0
+        self.late = 0
+
+    def add(self, datagram, now=None):
+        """
+        Adds one datagram, returns the frame message once its frame is complete, otherwise None.
+        The message is a view into the slot and only valid until the next call.
+        """
+        now = time.monotonic() if now is None else now
+        self.expire(now)
+        if len(datagram) < FRAGMENT.size:
+            return None
+        magic, frame_id, index, count, length, group = FRAGMENT.unpack_from(datagram)
+        if magic != MAGIC or length > count * self.fragment_size:
+            return None
+        if self._last_frame is not None and not _newer(frame_id, self._last_frame):
+            self.late += 1
+            return None
+
+        slot = self._slot(frame_id, count, length, group, now)
+        fragment = np.frombuffer(datagram, dtype=np.uint8, offset=FRAGMENT.size)[:self.fragment_size]
+        if index < count:
+            if slot.received[index]:
+                return None
+            slot.data[index, :len(fragment)] = fragment
+            slot.data[index, len(fragment):] = 0
+            slot.received[index] = True
+            slot.missing -= 1
+            group_index = index // group if group else None
+        else:
+            group_index = index - count
+            if not group or group_index >= len(slot.parity_received) or slot.parity_received[group_index]:
+                return None
+            slot.parity[group_index, :len(fragment)] = fragment
+            slot.parity[group_index, len(fragment):] = 0
+            slot.parity_received[group_index] = True
+
+        if slot.missing and group_index is not None:
+            self._recover(slot, group_index)
+        if slot.missing:
+            return None
+        return self._deliver(slot)
+
+    def expire(self, now=None):
+        """
+        Drops the incomplete frames older than the deadline.
+        """
+        now = time.monotonic() if now is None else now
+        for slot in self._slots:
+            if slot.active and now - slot.started > self.deadline:
+                slot.active = False
+                self.dropped += 1
+
+    def _slot(self, frame_id, count, length, group, now):
+        free = None
+        for slot in self._slots:
+            if slot.active and slot.frame_id == frame_id:
+                return slot
+            if not slot.active and free is None:
+                free = slot
+        if free is None:
+            # every slot is busy, give up on the oldest frame
+            free = min(self._slots, key=lambda slot: slot.started)
+            self.dropped += 1
+        free.reset(frame_id, count, length, group, self.fragment_size, now)
+        return free
+
+    def _recover(self, slot, group_index):
+        start = group_index * slot.group
+        stop = min(start + slot.group, slot.count)
+        received = slot.received[start:stop]
+        if not slot.parity_received[group_index] or received.sum() != stop - start - 1:
+            return
+        missing = start + int(np.argmin(received))
+        others = np.delete(slot.data[start:stop], missing - start, axis=0)
+        np.bitwise_xor.reduce(np.vstack((others, slot.parity[group_index:group_index + 1])), axis=0,
+                              out=slot.data[missing])
+        slot.received[missing] = True
+        slot.missing -= 1
+        self.recovered += 1
+
+    def _deliver(self, slot):
+        slot.active = False
+        for other in self._slots:
+            if other.active and _newer(slot.frame_id, other.frame_id):
+                other.active = False
+                self.dropped += 1
+        self._last_frame = slot.frame_id
+        self.completed += 1
+        return slot.message()
+
+
+def _newer(frame_id, other):
+    # frame ids are 32 bit counters, compared with wrap around
+    return 0 < (frame_id - other) & 0xffffffff < 0x80000000